@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Admin control channel for the chat server.
+
+The server listens for admin commands on 127.0.0.1 only. Each command is a
+single text line and each reply is a single JSON line, so the channel can be
+used interactively (e.g. `nc 127.0.0.1 5556`) or polled by scripts.
+
+Commands:
+    list                      Connections with address, username, queue depth, bytes in/out
+    stats [username]          Full per-connection counters
+    kick <username>           Disconnect a user
+    ban <username|ip>         Ban and disconnect a user or address
+    unban <username|ip>       Lift a ban
+    bans                      Show current bans
+    ratelimit [rate burst]    Show or change the per-connection chat rate limit
+    memory                    Memory budget usage and each connection's footprint
+    peers                     Server-to-server links with sequence counters
+    peer <host:port>          Peer with another chat server (re-dialed if it drops)
+    help                      Show this list
+
+Usage from a shell:
+    python admin.py list
+    python admin.py kick alice
+"""
+
+import json
+import socket
+import sys
+import threading
+
+ADMIN_HOST = '127.0.0.1'
+ADMIN_PORT = 5556
+
+class AdminServer:
+    """Serves admin commands for a ChatServer on a loopback-only socket"""
+    
+    def __init__(self, chat_server, host=ADMIN_HOST, port=ADMIN_PORT):
+        self.chat_server = chat_server
+        self.host = host
+        self.port = port
+        self.socket = None
+        self.commands = {
+            'list': self.cmd_list,
+            'stats': self.cmd_stats,
+            'kick': self.cmd_kick,
+            'ban': self.cmd_ban,
+            'unban': self.cmd_unban,
+            'bans': self.cmd_bans,
+            'ratelimit': self.cmd_ratelimit,
+            'memory': self.cmd_memory,
+            'peers': self.cmd_peers,
+            'peer': self.cmd_peer,
+            'help': self.cmd_help
+        }
+    
+    def start(self):
+        """Bind the admin socket and accept admin sessions in the background"""
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen()
+        print(f"Admin channel listening on {self.host}:{self.port}")
+        thread = threading.Thread(target=self.accept_loop, daemon=True)
+        thread.start()
+    
+    def accept_loop(self):
+        while True:
+            try:
+                admin_socket, _ = self.socket.accept()
+            except OSError:
+                break
+            thread = threading.Thread(target=self.handle_session, args=(admin_socket,), daemon=True)
+            thread.start()
+    
+    def handle_session(self, admin_socket):
+        """Answer commands from one admin connection until it closes"""
+        try:
+            with admin_socket, admin_socket.makefile('r', encoding='utf-8') as lines:
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    reply = self.execute(line)
+                    admin_socket.sendall((json.dumps(reply) + '\n').encode('utf-8'))
+        except OSError:
+            pass
+    
+    def execute(self, line):
+        """Run one command line and return the reply dict"""
+        parts = line.split()
+        handler = self.commands.get(parts[0].lower())
+        if not handler:
+            return {'ok': False, 'error': f"Unknown command '{parts[0]}' (try 'help')"}
+        try:
+            return handler(*parts[1:])
+        except TypeError:
+            return {'ok': False, 'error': f"Wrong arguments for '{parts[0]}' (try 'help')"}
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+    
+    def cmd_list(self):
+        connections = []
+        for conn in self.chat_server.connections():
+            stats = conn.stats()
+            connections.append({
+                key: stats[key]
+                for key in ('address', 'username', 'queue_depth', 'bytes_in', 'bytes_out')
+            })
+        return {'ok': True, 'connections': connections}
+    
+    def cmd_stats(self, username=None):
+        connections = [conn.stats() for conn in self.chat_server.connections()
+                       if username is None or conn.username == username]
+        if username and not connections:
+            return {'ok': False, 'error': f"No user named '{username}'"}
+        # Compare a connection's 'acked' with the room's latest seq to see how far behind it is
+        return {'ok': True, 'room_seq': dict(self.chat_server.room_seq), 'connections': connections}
+    
+    def cmd_kick(self, username):
+        if not self.chat_server.kick(username):
+            return {'ok': False, 'error': f"No user named '{username}'"}
+        return {'ok': True}
+    
+    def cmd_ban(self, target):
+        self.chat_server.ban(target)
+        return {'ok': True}
+    
+    def cmd_unban(self, target):
+        if not self.chat_server.unban(target):
+            return {'ok': False, 'error': f"'{target}' is not banned"}
+        return {'ok': True}
+    
+    def cmd_bans(self):
+        return {
+            'ok': True,
+            'users': sorted(self.chat_server.banned_users),
+            'ips': sorted(self.chat_server.banned_ips)
+        }
+    
+    def cmd_ratelimit(self, rate=None, burst=None):
+        if rate is not None:
+            rate = float(rate)
+            burst = int(burst) if burst is not None else max(1, int(rate * 2))
+            if rate <= 0 or burst < 1:
+                return {'ok': False, 'error': 'Rate must be positive and burst at least 1'}
+            self.chat_server.set_rate_limit(rate, burst)
+        rate, burst = self.chat_server.rate_limit
+        return {'ok': True, 'rate': rate, 'burst': burst}
+    
+    def cmd_memory(self):
+        connections = [
+            dict(conn.memory(), username=conn.username, shed=conn.shed)
+            for conn in self.chat_server.connections()
+        ]
+        connections.sort(key=lambda c: c['total'], reverse=True)
+        return {'ok': True, 'budget': self.chat_server.budget.stats(), 'connections': connections}
+    
+    def cmd_peers(self):
+        federation = self.chat_server.federation
+        return {'ok': True, 'server_id': federation.server_id, 'links': federation.stats()}
+    
+    def cmd_peer(self, address):
+        host, _, port = address.rpartition(':')
+        if not host or not port.isdigit():
+            return {'ok': False, 'error': 'Expected host:port'}
+        if not self.chat_server.federation.secret:
+            return {'ok': False, 'error': 'No peer secret configured on this server'}
+        if not self.chat_server.federation.add_peer(host, int(port)):
+            return {'ok': False, 'error': f"Could not reach {address} (will keep retrying)"}
+        return {'ok': True}
+    
+    def cmd_help(self):
+        return {'ok': True, 'commands': sorted(self.commands)}
+
+def main():
+    """Send one admin command to a local server and print the reply"""
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return
+    with socket.create_connection((ADMIN_HOST, ADMIN_PORT)) as sock:
+        sock.sendall((' '.join(sys.argv[1:]) + '\n').encode('utf-8'))
+        with sock.makefile('r', encoding='utf-8') as replies:
+            print(json.dumps(json.loads(replies.readline()), indent=2))
+
+if __name__ == '__main__':
+    main()
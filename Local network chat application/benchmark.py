@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the chat protocol code paths.
+
+Run with:  python benchmark.py
+"""
+
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+import tracemalloc
+
+from protocol import FrameReader, encode_frame
+from search_index import MessageIndex
+from simulation import SimulatedNetwork
+
+def build_stream(frame_count):
+    """Build a realistic byte stream: mostly short chat lines with some large frames"""
+    frames = []
+    for i in range(frame_count):
+        if i % 50 == 0:
+            # Occasional large frame, e.g. a page of search results
+            results = [{'username': f'user{j}', 'message': 'x' * 120, 'timestamp': '12:00:00'} for j in range(100)]
+            frames.append(encode_frame({'type': 'search_results', 'query': 'x', 'results': results}))
+        else:
+            frames.append(encode_frame({
+                'type': 'message',
+                'username': f'user{i % 40}',
+                'message': f'message number {i} with a little bit of text',
+                'timestamp': '12:00:00'
+            }))
+    return b''.join(frames)
+
+def send_all(sock, data):
+    sock.sendall(data)
+    sock.shutdown(socket.SHUT_WR)
+
+class LegacyReader:
+    """The receive loop used before FrameReader: recv(1024), decode, str concat and split"""
+    
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = ""
+    
+    def fill(self):
+        """Receive once. Returns the frames completed by it, or None on EOF."""
+        data = self.sock.recv(1024).decode('utf-8')
+        if not data:
+            return None
+        frames = []
+        self.buffer += data
+        while '\n' in self.buffer:
+            line, self.buffer = self.buffer.split('\n', 1)
+            line = line.strip()
+            if line:
+                frames.append(line)
+        if len(self.buffer) > 0 and len(self.buffer) < 2048:
+            try:
+                json.loads(self.buffer.strip())
+                frames.append(self.buffer.strip())
+                self.buffer = ""
+            except json.JSONDecodeError:
+                pass
+        return frames
+
+class CurrentReader:
+    """FrameReader driven one recv at a time, with the same interface as LegacyReader"""
+    
+    def __init__(self, sock):
+        self.reader = FrameReader(sock)
+    
+    def fill(self):
+        if not self.reader.fill():
+            return None
+        frames = list(self.reader.frames)
+        self.reader.frames.clear()
+        return frames
+
+def receive(reader_class, sock, parse=True):
+    reader = reader_class(sock)
+    recv_calls = 0
+    frames = 0
+    while True:
+        batch = reader.fill()
+        recv_calls += 1   # Including the final recv that returned EOF
+        if batch is None:
+            break
+        if parse:
+            for frame in batch:
+                json.loads(frame)
+        frames += len(batch)
+    return frames, recv_calls
+
+def trace_allocations(reader_class, sock):
+    """Bytes allocated per frame and peak traced memory while receiving.
+    
+    tracemalloc only sees live memory, so the memory allocated by each recv
+    (and the frames split out of it) is taken as the traced peak during that
+    recv above the memory traced before it. Anything allocated and freed
+    again within the same recv is counted once at most, so this is a lower
+    bound, and a looser one for the legacy loop, which copies the rest of
+    its buffer on every split.
+    """
+    tracemalloc.start()
+    reader = reader_class(sock)
+    frames = 0
+    allocated = 0
+    max_peak = 0
+    while True:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        batch = reader.fill()
+        _, peak = tracemalloc.get_traced_memory()
+        if batch is None:
+            break
+        allocated += peak - before
+        max_peak = max(max_peak, peak)
+        frames += len(batch)
+        del batch
+    tracemalloc.stop()
+    return allocated / frames, max_peak
+
+def run_once(data, func, reader_class, **kwargs):
+    """Send `data` over a socket pair and run func(reader_class, receiving socket)"""
+    receiver, sender = socket.socketpair()
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+    thread = threading.Thread(target=send_all, args=(sender, data), daemon=True)
+    
+    start = time.perf_counter()
+    thread.start()
+    result = func(reader_class, receiver, **kwargs)
+    elapsed = time.perf_counter() - start
+    
+    thread.join()
+    receiver.close()
+    sender.close()
+    return result, elapsed
+
+def run(name, reader_class, data):
+    (frames, recv_calls), framing = run_once(data, receive, reader_class, parse=False)
+    _, total = run_once(data, receive, reader_class, parse=True)
+    # tracemalloc slows every allocation down, so measure memory in a separate pass
+    (per_frame, peak), _ = run_once(data, trace_allocations, reader_class)
+    print(f"{name:<12} {frames:>7} {recv_calls:>10} {len(data) / recv_calls:>9.0f} "
+          f"{framing * 1000:>11.1f} {total * 1000:>10.1f} {per_frame:>9.0f} {peak / 1024:>9.0f}")
+
+def benchmark_receive(frame_count=50000):
+    """Receive loop cost, old and new.
+    
+    FrameReader allocates far less per frame, but its peak is higher: its
+    buffer grows to hold a full 64 KiB receive window (twice that while a
+    large frame is pending), and every frame split out of one large recv is
+    queued at once. The legacy loop never held more than a 1 KiB read and
+    its partial frame, at the cost of a recv, a decode and a buffer copy
+    per KiB.
+    """
+    data = build_stream(frame_count)
+    print(f"Receive path: {frame_count} frames, {len(data) / 1024 / 1024:.1f} MiB")
+    print(f"{'':<12} {'frames':>7} {'recv calls':>10} {'B/recv':>9} "
+          f"{'framing ms':>11} {'+json ms':>10} {'B/frame':>9} {'peak KiB':>9}")
+    run('recv(1024)', LegacyReader, data)
+    run('FrameReader', CurrentReader, data)
+
+def simulate_fanout(client_count, sender_count, messages_each):
+    """Drive one deterministic fan-out run and return its measurements"""
+    net = SimulatedNetwork()
+    clients = [net.connect(f'user{i}') for i in range(client_count)]
+    start = time.perf_counter()
+    net.run_until_idle()
+    join_time = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    for round_number in range(messages_each):
+        for sender in clients[:sender_count]:
+            sender.say(f'round {round_number} from {sender.username}')
+        net.run_until_idle()
+    chat_time = time.perf_counter() - start
+    
+    # Every client must see the chat messages in exactly the same order
+    orders = {tuple((m['username'], m['message']) for m in c.messages()) for c in clients}
+    digest = hashlib.sha1(repr(sorted(orders)).encode('utf-8')).hexdigest()[:12]
+    delivered = sum(len(c.messages()) for c in clients)
+    return join_time, chat_time, delivered, len(orders) == 1, digest
+
+def benchmark_simulated_fanout(client_count=1000, sender_count=50, messages_each=4):
+    print(f"Simulated fan-out: {client_count} clients, {sender_count} senders x {messages_each} messages")
+    print(f"{'run':<5} {'join ms':>9} {'chat ms':>9} {'delivered':>10} {'frames/s':>10} {'same order':>11} {'digest':>13}")
+    for run_number in (1, 2):
+        join_time, chat_time, delivered, ordered, digest = simulate_fanout(client_count, sender_count, messages_each)
+        print(f"{run_number:<5} {join_time * 1000:>9.1f} {chat_time * 1000:>9.1f} {delivered:>10} "
+              f"{delivered / chat_time:>10.0f} {str(ordered):>11} {digest:>13}")
+
+def build_index(message_count):
+    """An in-memory index of random chat lines with a few deliberately awkward tokens.
+    
+    'the' is in half the messages; 'morning' and 'evening' are each in a
+    quarter but never together, and 'deploy' and 'rollback' only meet in
+    one message in ten thousand. Those AND queries are the worst case: many
+    candidates, almost no matches.
+    """
+    rng = random.Random(1)
+    words = [f'w{i}' for i in range(20000)]
+    users = [f'user{i}' for i in range(300)]
+    index = MessageIndex(None)
+    for i in range(message_count):
+        extra = []
+        if i % 2:
+            extra.append('the')
+        if i % 4 == 1:
+            extra.append('morning')
+        elif i % 4 == 3:
+            extra.append('evening')
+        if i % 5 == 0:
+            extra.append('deploy')
+        if i % 7 == 0 and (i % 5 or i % 10000 == 0):
+            extra.append('rollback')
+        text = ' '.join([rng.choice(words) for _ in range(8)] + extra)
+        index.index_message(rng.choice(users), text, 1e9 + i)
+    return index
+
+def benchmark_search(message_count=1000000, target_ms=10):
+    index = build_index(message_count)
+    start_ts = 1e9 + message_count // 4
+    queries = [
+        ('the', None, None),
+        ('the w17', None, None),
+        ('w5 w6', None, None),
+        ('', 'user7', None),
+        ('the', 'user3', start_ts),
+        ('morning evening', None, None),
+        ('deploy rollback', None, None),
+        ('deploy rollback the', None, None),
+        ('morning evening', None, start_ts),
+    ]
+    print(f"Search: {message_count} messages, limit 50 (target {target_ms} ms)")
+    print(f"{'query':<30} {'results':>8} {'complete':>9} {'ms':>8}")
+    worst = 0
+    for query, username, since in queries:
+        times = []
+        for _ in range(5):
+            start = time.perf_counter()
+            results, complete = index.search(query, username, since)
+            times.append(time.perf_counter() - start)
+        elapsed = max(times) * 1000
+        worst = max(worst, elapsed)
+        label = query + (f' @{username}' if username else '') + (' since' if since else '')
+        print(f"{label:<30} {len(results):>8} {str(complete):>9} {elapsed:>8.2f}")
+    print(f"worst case {worst:.2f} ms: {'OK' if worst <= target_ms else 'OVER TARGET'}")
+
+if __name__ == '__main__':
+    benchmark_receive()
+    print()
+    benchmark_simulated_fanout()
+    print()
+    benchmark_search()
@@ -1,21 +1,34 @@
-import socket
-import json
-import threading
 import queue
+import time
 import tkinter as tk
 from tkinter import scrolledtext, messagebox, simpledialog
 from datetime import datetime
+from network_worker import NetworkWorker, LOGGING_IN, CONNECTED, FAILED, DISCONNECTED
+from message_cache import CacheWriter, MessageCache
+
+TYPING_REFRESH = 2.0  # Resend 'typing' at most this often while the user keeps typing
+ACK_INTERVAL = 5.0    # Acknowledge received room frames at most this often
+DEFAULT_ROOM = 'general'
 
 class ChatClient:
-    def __init__(self):
-        self.socket = None
+    def __init__(self, transport=None):
+        self.thread_safe_queue = queue.Queue()  # Thread-safe queue for events from the network worker
+        self.network = NetworkWorker(self.thread_safe_queue.put, transport)  # Sole owner of the socket
         self.username = None
         self.server_host = 'localhost'
         self.server_port = 5555
         self.connected = False
         self.root = None
         self.message_queue = []  # Queue messages that arrive before chat window is ready
-        self.thread_safe_queue = queue.Queue()  # Thread-safe queue for messages from network thread
+        self.typing_active = False  # Whether the server currently thinks we are typing
+        self.typing_sent_at = 0.0
+        self.last_seq = {}  # room -> highest sequence number received
+        self.missing = {}   # room -> set of sequence numbers requested with gap_fill
+        self.acked = {}     # room -> last cumulative ack sent
+        self.acked_at = 0.0
+        self.epoch = None         # Server run our sequence numbers belong to
+        self.cache = None         # On-disk history for the current server
+        self.history_start = 0    # Cache position of the oldest message on screen
         
     def create_login_window(self):
         """Create the login window"""
@@ -87,7 +100,7 @@ class ChatClient:
         self.port_entry.bind('<Return>', lambda e: self.connect_to_server())
         
         # Connect button
-        connect_button = tk.Button(
+        self.connect_button = tk.Button(
             self.root,
             text="Connect",
             command=self.connect_to_server,
@@ -98,7 +111,7 @@ class ChatClient:
             pady=5,
             cursor='hand2'
         )
-        connect_button.pack(pady=20)
+        self.connect_button.pack(pady=20)
         
         # Status label
         self.status_label = tk.Label(
@@ -125,71 +138,62 @@ class ChatClient:
             messagebox.showerror("Error", "Please enter a username")
             return
         
-        try:
-            self.status_label.config(text="Connecting...", fg='#666')
-            self.root.update()
-            
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((host, port))
-            self.server_host = host
-            self.server_port = port
-            self.username = username
-            self.connected = True
-            
-            # Send login message
-            login_message = json.dumps({
-                'type': 'login',
-                'username': username
-            })
-            self.socket.send(login_message.encode('utf-8'))
-            
-            # Wait for login response (with timeout) before starting listener thread
-            self.socket.settimeout(3)
+        # The cache is opened on the network worker; the server only replays what is newer
+        if not self.network.connect(host, port, username, resume=lambda: self.open_cache(host, port)):
+            return  # Already connecting
+        
+        self.server_host = host
+        self.server_port = port
+        self.username = username
+        self.connect_button.config(state=tk.DISABLED)
+        self.status_label.config(text="Connecting...", fg='#666')
+        # The network worker connects and logs in; watch for the outcome without blocking
+        self.root.after(50, self.poll_connection)
+    
+    def open_cache(self, host, port):
+        """Network worker: open the local cache for this server and return (epoch, since) to log in with.
+        
+        Opening recovers and may compact each room's log, so it stays off the
+        Tk thread. The Tk thread reads what is set here only once CONNECTED
+        has been posted.
+        """
+        if self.cache:
+            self.cache.close()
+        cache = MessageCache(host, port)
+        self.epoch, since = cache.resume_point()
+        cache.room(DEFAULT_ROOM)  # Shown as soon as the chat window opens
+        self.last_seq = dict(since or {})
+        self.cache = CacheWriter(cache)
+        return self.epoch, since
+    
+    def poll_connection(self):
+        """Follow the network worker through connect and login (called from main thread)"""
+        while True:
             try:
-                response = self.socket.recv(1024).decode('utf-8')
-                # Remove newline delimiter if present
-                response = response.strip()
-                message = json.loads(response)
-                
-                if message['type'] == 'error':
-                    self.status_label.config(text=message['message'], fg='red')
-                    self.socket.close()
-                    self.connected = False
-                    return
-                elif message['type'] == 'login_success':
-                    # Reset timeout to None (blocking mode) for normal operation
-                    self.socket.settimeout(None)
-                    # Start listening thread after successful login
-                    listen_thread = threading.Thread(target=self.listen_for_messages, daemon=True)
-                    listen_thread.start()
-                    self.root.after(100, self.create_chat_window)
-            except socket.timeout:
-                # Timeout waiting for login response - connection might be okay
-                # But this shouldn't normally happen, so close connection
-                self.status_label.config(text="Login timeout - connection failed", fg='red')
-                self.socket.close()
-                self.connected = False
-                messagebox.showerror("Connection Error", "Failed to receive login response from server.")
-            except json.JSONDecodeError:
-                # If we got a response but couldn't decode it, it might be okay
-                # Reset timeout and proceed (the response might have been consumed by listener)
-                self.socket.settimeout(None)
-                listen_thread = threading.Thread(target=self.listen_for_messages, daemon=True)
-                listen_thread.start()
+                event = self.thread_safe_queue.get_nowait()
+            except queue.Empty:
+                break
+            _, state, detail = event
+            if state == LOGGING_IN:
+                self.status_label.config(text="Logging in...", fg='#666')
+            elif state == CONNECTED:
+                # Frames that follow login stay queued for the chat window
+                self.connected = True
                 self.root.after(100, self.create_chat_window)
-                
-        except ConnectionRefusedError:
-            self.status_label.config(text="Connection refused. Is the server running?", fg='red')
-            messagebox.showerror("Connection Error", "Could not connect to server.\nMake sure the server is running.")
-            if self.socket:
-                self.socket.close()
-            self.connected = False
-        except Exception as e:
-            self.status_label.config(text=f"Error: {str(e)}", fg='red')
-            messagebox.showerror("Error", f"Failed to connect: {str(e)}")
-            if self.socket:
-                self.socket.close()
-            self.connected = False
+                return
+            elif state == FAILED:
+                self.status_label.config(text=detail, fg='red')
+                self.connect_button.config(state=tk.NORMAL)
+                if detail.startswith("Connection refused"):
+                    messagebox.showerror("Connection Error", "Could not connect to server.\nMake sure the server is running.")
+                elif detail.startswith("Login timeout"):
+                    messagebox.showerror("Connection Error", "Failed to receive login response from server.")
+                return
+        
+        try:
+            self.root.after(50, self.poll_connection)
+        except (RuntimeError, tk.TclError):
+            pass
     
     def create_chat_window(self):
         """Create the chat window"""
@@ -250,6 +254,17 @@ class ChatClient:
         )
         self.chat_display.pack(fill=tk.BOTH, expand=True)
         
+        # Typing indicator
+        self.typing_label = tk.Label(
+            chat_frame,
+            text="",
+            font=("Arial", 9, "italic"),
+            bg='#f0f0f0',
+            fg='#7f8c8d',
+            anchor='w'
+        )
+        self.typing_label.pack(fill=tk.X)
+        
         # Configure tags for styling - ensure colors are visible
         self.chat_display.tag_config('system', foreground='#7f8c8d', font=("Arial", 9, "italic"))
         self.chat_display.tag_config('message', foreground='#000000', font=("Arial", 10))  # Black for visibility
@@ -273,6 +288,7 @@ class ChatClient:
         )
         self.message_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 5))
         self.message_entry.bind('<Return>', lambda e: self.send_message())
+        self.message_entry.bind('<KeyRelease>', lambda e: self.on_typing())
         self.message_entry.focus()
         
         send_button = tk.Button(
@@ -290,48 +306,131 @@ class ChatClient:
         # Handle window close
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         
+        # Show recent history from the local cache; older pages load on scroll-back
+        self.chat_display.config(yscrollcommand=self.on_chat_scroll)
+        self.chat_display.bind('<MouseWheel>', self.on_chat_wheel)
+        self.chat_display.bind('<Button-4>', self.on_chat_wheel)
+        self.show_cached_history()
+        
         # Display welcome message
         self.display_system_message("Welcome to the chat!")
         
         # Process any queued messages that arrived before window was ready
         if self.message_queue:
             for queued_msg in self.message_queue:
-                self.handle_message(queued_msg)
+                # Already sequenced and cached when it arrived
+                self.display_message(queued_msg.get('username', 'Unknown'), queued_msg.get('message', ''), queued_msg.get('timestamp', ''))
             self.message_queue = []
         
         # Start polling the thread-safe queue for incoming messages
         self.process_message_queue()
     
+    def show_cached_history(self):
+        """Display the newest page of cached messages"""
+        messages, self.history_start = self.cache.page(DEFAULT_ROOM)
+        for message in messages:
+            self.display_message(message.get('username', 'Unknown'), message.get('message', ''), message.get('timestamp', ''))
+    
+    def on_chat_scroll(self, first, last):
+        """Scrollbar update; page in older history once the user reaches the top"""
+        self.chat_display.vbar.set(first, last)
+        if float(first) == 0.0 and float(last) < 1.0 and self.history_start > 0:
+            self.root.after_idle(self.load_older_history)
+    
+    def on_chat_wheel(self, event):
+        # Also covers the case where everything fits and the scrollbar cannot move
+        if (event.num == 4 or event.delta > 0) and self.chat_display.yview()[0] == 0.0:
+            self.load_older_history()
+    
+    def load_older_history(self):
+        """Insert the previous page of cached messages above what is shown (no network round trip)"""
+        if self.history_start <= 0 or self.chat_display.yview()[0] > 0.0:
+            return
+        messages, self.history_start = self.cache.page(DEFAULT_ROOM, self.history_start)
+        if not messages:
+            return
+        self.chat_display.config(state=tk.NORMAL)
+        for message in reversed(messages):
+            self.chat_display.insert(
+                '1.0',
+                f"[{message.get('timestamp', '')}] ", 'system',
+                f"{message.get('username', 'Unknown')}: ", 'username',
+                f"{message.get('message', '')}\n", 'message'
+            )
+        self.chat_display.config(state=tk.DISABLED)
+        # Keep the line the user was looking at in place
+        self.chat_display.yview(f"{len(messages) + 1}.0")
+    
     def send_message(self):
         """Send a message to the server"""
         message = self.message_entry.get().strip()
         if not message or not self.connected:
             return
         
-        try:
-            message_json = json.dumps({
+        if message.startswith('/search'):
+            request = self.build_search_request(message[len('/search'):])
+        else:
+            request = {
                 'type': 'message',
                 'message': message
-            })
-            # Send with newline delimiter for consistency with server
-            self.socket.send((message_json + '\n').encode('utf-8'))
-            self.message_entry.delete(0, tk.END)
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to send message: {str(e)}")
-            self.connected = False
+            }
+        # Queued for the network worker; never blocks the UI
+        if not self.network.send(request):
+            messagebox.showerror("Error", "Failed to send message: not connected")
+            return
+        self.message_entry.delete(0, tk.END)
+        if self.typing_active and not message.startswith('/'):
+            # The server clears our typing state when it sees the message
+            self.typing_active = False
+        else:
+            self.on_typing()
+    
+    def on_typing(self):
+        """Throttle typing notifications: one on start, a refresh every few seconds, one on stop"""
+        if not self.connected:
+            return
+        
+        is_typing = bool(self.message_entry.get().strip())
+        now = time.monotonic()
+        if is_typing and self.typing_active and now - self.typing_sent_at < TYPING_REFRESH:
+            return
+        if not is_typing and not self.typing_active:
+            return
+        
+        # Typing updates are disposable, so let them go if the send queue is backed up
+        if self.network.send({'type': 'typing', 'typing': is_typing}, droppable=True):
+            self.typing_active = is_typing
+            self.typing_sent_at = now
+    
+    def build_search_request(self, args):
+        """Build a search frame from '/search [@user] [keywords]'"""
+        request = {'type': 'search', 'query': ''}
+        keywords = []
+        for word in args.split():
+            if word.startswith('@') and len(word) > 1:
+                request['username'] = word[1:]
+            else:
+                keywords.append(word)
+        request['query'] = ' '.join(keywords)
+        return request
     
     def process_message_queue(self):
         """Process messages from the thread-safe queue (called from main thread)"""
         try:
             while True:
                 try:
-                    # Get message from queue (non-blocking)
-                    message = self.thread_safe_queue.get_nowait()
-                    # Process the message on the main thread
-                    self.handle_message(message)
+                    # Get event from queue (non-blocking)
+                    event = self.thread_safe_queue.get_nowait()
+                    # Process the event on the main thread
+                    if event[0] == 'frame':
+                        self.handle_message(event[1])
+                    elif event[1] == DISCONNECTED and self.connected:
+                        self.handle_disconnect()
+                        return
                 except queue.Empty:
                     # No more messages
                     break
+            self.send_acks()
         except Exception as e:
             print(f"Error processing message queue: {e}")
         
@@ -343,85 +442,84 @@ class ChatClient:
                 # Main loop stopped or window destroyed
                 pass
     
-    def safe_gui_call(self, func, *args):
-        """Safely queue a GUI function call from a thread"""
-        try:
-            # For handle_message, put it in the thread-safe queue instead of using root.after()
-            if func == self.handle_message and args:
-                self.thread_safe_queue.put(args[0])  # Put the message dict in queue
-            else:
-                # For other functions, try to use root.after() but catch errors
-                if hasattr(self, 'root') and self.root:
-                    try:
-                        if self.root.winfo_exists():
-                            self.root.after(0, lambda: func(*args))
-                    except (tk.TclError, RuntimeError):
-                        pass
-        except Exception as e:
-            print(f"Error in safe_gui_call: {e}")
+    def track_sequence(self, message):
+        """Follow per-room sequence numbers and request a gap fill when frames go missing.
+        
+        Returns False for frames that should not be shown (duplicates and stale replays).
+        """
+        seq = message.get('seq')
+        if seq is None:
+            return True
+        room = message.get('room', DEFAULT_ROOM)
+        last = self.last_seq.get(room)
+        missing = self.missing.setdefault(room, set())
+        msg_type = message.get('type')
+        
+        if msg_type == 'user_list':
+            # Our starting cursor; after a resumed login the replay fills in everything since `last`
+            if last is not None and seq > last:
+                missing.update(range(last + 1, seq + 1))
+            self.last_seq[room] = max(seq, last or 0)
+            return True
+        if msg_type == 'replay_done':
+            # Everything up to 'seq' has now arrived; whatever is still missing in the range was too old to replay
+            lost = [s for s in missing if message['from'] <= s <= message['to']]
+            missing.difference_update(lost)
+            if lost and hasattr(self, 'chat_display'):
+                self.display_system_message(f"{len(lost)} earlier message(s) could not be recovered")
+            self.last_seq[room] = max(seq, last or 0)
+            return False
+        
+        if last is None:
+            self.last_seq[room] = seq
+            return True
+        if seq <= last:
+            # A replayed frame: only wanted if we were missing it
+            if seq not in missing:
+                return False
+            missing.discard(seq)
+            return True
+        if seq > last + 1:
+            missing.update(range(last + 1, seq))
+            self.network.send({'type': 'gap_fill', 'room': room, 'from': last + 1, 'to': seq - 1})
+        self.last_seq[room] = seq
+        return True
     
-    def listen_for_messages(self):
-        """Listen for messages from the server"""
-        buffer = ""
-        while self.connected:
-            try:
-                data = self.socket.recv(1024).decode('utf-8')
-                if not data:
-                    break
-                
-                # Add to buffer (handle partial messages and multiple messages)
-                buffer += data
-                
-                # Process all complete JSON messages in the buffer
-                while '\n' in buffer:
-                    line, buffer = buffer.split('\n', 1)
-                    line = line.strip()
-                    if not line:
-                        continue
-                    
-                    try:
-                        message = json.loads(line)
-                        self.safe_gui_call(self.handle_message, message)
-                    except json.JSONDecodeError as e:
-                        # Skip malformed JSON
-                        continue
-                
-                # Handle case where buffer might contain a complete JSON without newline
-                # (backward compatibility for messages without delimiter)
-                if buffer.strip() and len(buffer) > 0:
-                    try:
-                        # Try to parse as complete JSON
-                        message = json.loads(buffer.strip())
-                        self.safe_gui_call(self.handle_message, message)
-                        buffer = ""
-                    except json.JSONDecodeError:
-                        # Partial message, keep in buffer for next recv
-                        pass
-                
-            except (ConnectionResetError, ConnectionAbortedError):
-                if self.connected:
-                    self.safe_gui_call(self.handle_disconnect)
-                break
-            except socket.timeout:
-                # Socket timeout - this shouldn't happen in blocking mode
-                # but handle it gracefully by continuing to listen
-                continue
-            except Exception as e:
-                if self.connected:
-                    # Only print unexpected errors, ignore timeouts and GUI errors silently
-                    error_msg = str(e).lower()
-                    if "timeout" not in error_msg and "main loop" not in error_msg:
-                        print(f"Error receiving message: {e}")
-                    # For timeout or GUI errors, just continue listening
-                    if "timeout" in error_msg or "main loop" in error_msg:
-                        continue
-                break
+    def send_acks(self):
+        """Cumulatively acknowledge each room up to the first frame still missing"""
+        now = time.monotonic()
+        if not self.connected or now - self.acked_at < ACK_INTERVAL:
+            return
+        self.acked_at = now
+        for room, last in self.last_seq.items():
+            missing = self.missing.get(room)
+            seq = min(missing) - 1 if missing else last
+            if seq > self.acked.get(room, 0) and self.network.send({'type': 'ack', 'room': room, 'seq': seq}, droppable=True):
+                self.acked[room] = seq
+                self.cache.set_cursor(room, self.epoch, seq)
     
     def handle_message(self, message):
         """Handle incoming messages"""
+        if not self.track_sequence(message):
+            return
         msg_type = message.get('type')
         
-        if msg_type == 'message':
+        if msg_type == 'login_success':
+            if message.get('epoch') != self.epoch:
+                # The server restarted since our cache was written; its numbering starts over
+                self.epoch = message.get('epoch')
+                self.last_seq, self.missing, self.acked = {}, {}, {}
+                self.cache.new_epoch()
+        
+        elif msg_type == 'message':
+            if message.get('seq') is not None:
+                room = message.get('room', DEFAULT_ROOM)
+                if self.cache.has(room, message['seq']):
+                    return  # Received last session after the cursor was saved; already on screen
+                self.cache.append(room, message['seq'], {
+                    key: message.get(key) for key in ('seq', 'username', 'message', 'timestamp')
+                })
+            
             username = message.get('username', 'Unknown')
             text = message.get('message', '')
             timestamp = message.get('timestamp', '')
@@ -450,6 +548,27 @@ class ChatClient:
             users = message.get('users', [])
             if hasattr(self, 'users_label'):
                 self.update_user_count(users)
+        
+        elif msg_type == 'error':
+            # Rate limit warnings, kick and ban notices
+            if hasattr(self, 'chat_display'):
+                self.display_system_message(message.get('message', ''))
+        
+        elif msg_type == 'typing':
+            typists = [u for u in message.get('users', []) if u != self.username]
+            self.update_typing_indicator(typists)
+        
+        elif msg_type == 'search_results':
+            if hasattr(self, 'chat_display'):
+                results = message.get('results', [])
+                self.display_system_message(f"Search '{message.get('query', '')}': {len(results)} result(s)")
+                if not message.get('complete', True):
+                    self.display_system_message("  Search stopped early; add more keywords or a time range to see older matches")
+                # Results arrive newest first; show them in chronological order
+                for result in reversed(results):
+                    self.display_system_message(
+                        f"  [{result.get('timestamp', '')}] {result.get('username', '')}: {result.get('message', '')}"
+                    )
     
     def display_message(self, username, message, timestamp):
         """Display a chat message"""
@@ -490,6 +609,20 @@ class ChatClient:
         self.chat_display.config(state=tk.DISABLED)
         self.chat_display.see(tk.END)
     
+    def update_typing_indicator(self, typists):
+        """Show who else is currently typing"""
+        if not hasattr(self, 'typing_label'):
+            return
+        if not typists:
+            text = ""
+        elif len(typists) == 1:
+            text = f"{typists[0]} is typing..."
+        elif len(typists) <= 3:
+            text = f"{', '.join(typists)} are typing..."
+        else:
+            text = "Several people are typing..."
+        self.typing_label.config(text=text)
+    
     def update_user_count(self, users):
         """Update the user count display"""
         if not hasattr(self, 'users_label'):
@@ -505,13 +638,14 @@ class ChatClient:
     
     def on_closing(self):
         """Handle window close event"""
-        if self.connected:
-            try:
-                disconnect_message = json.dumps({'type': 'disconnect'})
-                self.socket.send(disconnect_message.encode('utf-8'))
-                self.socket.close()
-            except:
-                pass
+        # Save an exact resume point so the next session only fetches newer messages
+        self.acked_at = 0.0
+        self.send_acks()
+        if self.cache:
+            self.cache.close()
+        # The worker sends the disconnect frame and closes the socket on its own thread
+        self.network.close()
+        self.connected = False
         self.root.destroy()
     
     def center_window(self, window, width, height):
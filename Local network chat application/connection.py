@@ -0,0 +1,314 @@
+import queue
+import socket
+import sys
+import threading
+from protocol import FrameReader, encode_frame
+from transport import Clock
+
+DEFAULT_RATE = 10.0   # Sustained chat frames per second per connection
+DEFAULT_BURST = 20    # Frames a connection may send back-to-back
+
+MAX_FRAME_SIZE = 64 * 1024            # Largest frame a client may send; bounds its receive buffer
+MAX_OUTBOUND_BYTES = 1024 * 1024      # Frames queued for one client before new ones are shed
+MEMORY_BUDGET = 64 * 1024 * 1024      # Receive buffers plus outbound queues across all connections
+THREAD_STACK_SIZE = 512 * 1024        # Stack reserved per connection thread (reader and writer)
+
+class MemoryBudget:
+    """Bytes held in receive buffers and outbound queues by every connection, against one limit.
+    
+    Over the limit the server sheds load: typing updates are dropped, and so
+    are frames for any connection already holding more than its fair share,
+    so slow clients lose frames (which they can gap-fill later) while the
+    rest keep up. New logins are refused until usage falls again.
+    """
+    
+    def __init__(self, limit=MEMORY_BUDGET):
+        self.limit = limit
+        self.used = 0
+        self.connections = 0
+        self.shed = 0  # Frames dropped because the budget was exhausted
+        self.lock = threading.Lock()
+    
+    def charge(self, nbytes):
+        with self.lock:
+            self.used += nbytes
+    
+    def add_connection(self, nbytes):
+        with self.lock:
+            self.connections += 1
+            self.used += nbytes
+    
+    def remove_connection(self, nbytes):
+        with self.lock:
+            self.connections -= 1
+            self.used -= nbytes
+    
+    def exceeded(self, extra=0):
+        return self.used + extra > self.limit
+    
+    def fair_share(self):
+        return self.limit // max(1, self.connections)
+    
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'used': self.used,
+            'connections': self.connections,
+            'shed': self.shed
+        }
+
+class RateLimiter:
+    """Token bucket: `rate` tokens per second, holding at most `burst`"""
+    
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, clock=None):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock or Clock()
+        self.tokens = float(burst)
+        self.updated = self.clock.monotonic()
+    
+    def configure(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = min(self.tokens, float(burst))
+    
+    def allow(self):
+        """Take one token if available"""
+        now = self.clock.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class ClientConnection:
+    """One connected client: its socket, identity, outbound queue and traffic counters.
+    
+    Sends never touch the socket directly. Frames are queued and a dedicated
+    writer thread drains the queue, so a slow client cannot stall a broadcast.
+    Without `start()` there is no writer thread and the owner calls `flush()`
+    instead (used by the simulated network).
+    
+    Memory is bounded per connection: frames over MAX_FRAME_SIZE close the
+    connection and at most MAX_OUTBOUND_BYTES wait in the outbound queue.
+    Both are charged to the shared MemoryBudget.
+    """
+    
+    def __init__(self, sock, address, rate=DEFAULT_RATE, burst=DEFAULT_BURST, clock=None, budget=None,
+                 max_outbound=MAX_OUTBOUND_BYTES):
+        self.socket = sock
+        self.address = address
+        self.username = None
+        self.peer = None  # PeerLink when this is a server-to-server connection
+        self.clock = clock or Clock()
+        self.reader = FrameReader(sock, max_frame=MAX_FRAME_SIZE)
+        self.outbound = queue.Queue()
+        self.outbound_bytes = 0  # Bytes of frames queued but not yet written
+        self.max_outbound = max_outbound
+        self.shed = 0            # Frames dropped because a queue or the budget was full
+        self.budget = budget or MemoryBudget()
+        self.recv_charged = len(self.reader.buffer)  # Receive buffer size as last charged to the budget
+        self.budget.add_connection(self.recv_charged)
+        self.released = False    # Whether this connection's memory went back to the budget
+        self.lock = threading.Lock()
+        self.limiter = RateLimiter(rate, burst, self.clock)
+        self.throttled = False  # Whether the client was told it is being rate limited
+        self.acked = {}  # room -> highest seq the client has acknowledged
+        self.connected_at = self.clock.time()
+        self.frames_in = 0
+        self.frames_handled = 0  # Frames the server has processed; a peer link's hello must be the first
+        self.frames_out = 0
+        self.bytes_out = 0
+        self.dropped = 0
+        self.closed = False
+        self.writer = threading.Thread(target=self.run_writer, daemon=True)
+    
+    @property
+    def bytes_in(self):
+        return self.reader.bytes_in
+    
+    def start(self):
+        """Start the writer thread"""
+        self.writer.start()
+    
+    def next_frame(self):
+        """Return the next raw frame from the client, or None on EOF"""
+        frame = self.reader.next_frame()
+        self.charge_receive_buffer()
+        if frame is not None:
+            self.frames_in += 1
+        return frame
+    
+    def read_available(self):
+        """Non-blocking read: (complete frames received so far, eof)"""
+        frames, eof = self.reader.read_available()
+        self.charge_receive_buffer()
+        self.frames_in += len(frames)
+        return frames, eof
+    
+    def charge_receive_buffer(self):
+        """Bring the budget up to date after the reader grew or shrank its buffer"""
+        size = len(self.reader.buffer)
+        with self.lock:
+            if self.released or size == self.recv_charged:
+                return
+            delta, self.recv_charged = size - self.recv_charged, size
+        self.budget.charge(delta)
+    
+    def send(self, message, droppable=False):
+        """Queue a message for this client"""
+        return self.send_frame(encode_frame(message), droppable)
+    
+    def send_frame(self, frame, droppable=False):
+        """Queue an already encoded frame for this client. Returns False if it was shed.
+        
+        Droppable frames (typing updates) are the first to go when memory is short.
+        """
+        size = len(frame)
+        with self.lock:
+            if self.closed:
+                return False
+            if self.outbound_bytes + size > self.max_outbound or (
+                    self.budget.exceeded(size) and (droppable or self.outbound_bytes + size > self.budget.fair_share())):
+                self.shed += 1
+                self.budget.shed += 1
+                return False
+            self.outbound_bytes += size
+        self.budget.charge(size)
+        self.outbound.put(frame)
+        return True
+    
+    def written(self, size):
+        """Release queued bytes once they have been written (or abandoned)"""
+        with self.lock:
+            if self.released:
+                return
+            self.outbound_bytes -= size
+        self.budget.charge(-size)
+    
+    def run_writer(self):
+        """Drain the outbound queue into the socket, batching whatever is waiting"""
+        try:
+            while True:
+                frame = self.outbound.get()
+                if frame is None:
+                    break
+                batch = [frame]
+                while True:
+                    try:
+                        frame = self.outbound.get_nowait()
+                    except queue.Empty:
+                        break
+                    if frame is None:
+                        self.outbound.put(None)
+                        break
+                    batch.append(frame)
+                
+                self.write_batch(batch)
+        except OSError:
+            pass
+        finally:
+            self.closed = True
+            try:
+                # Wake the reader thread so handle_client can clean up
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.socket.close()
+            self.release()
+    
+    def write_batch(self, batch):
+        data = b''.join(batch)
+        self.socket.sendall(data)
+        self.frames_out += len(batch)
+        self.bytes_out += len(data)
+        self.written(len(data))
+    
+    def flush(self):
+        """Write everything queued on the calling thread. Returns the number of frames sent."""
+        batch = []
+        while True:
+            try:
+                frame = self.outbound.get_nowait()
+            except queue.Empty:
+                break
+            if frame is not None:
+                batch.append(frame)
+        if batch:
+            self.write_batch(batch)
+        return len(batch)
+    
+    def close(self, linger=None):
+        """Flush queued frames, then close the socket.
+        
+        With `linger`, a writer thread still stuck after that many seconds (on
+        a client that stopped reading) has the socket shut down underneath it.
+        """
+        if not self.closed:
+            self.closed = True
+            if self.writer.ident is None:
+                # No writer thread (rejected before start, or simulated)
+                try:
+                    self.flush()
+                except OSError:
+                    pass
+                self.socket.close()
+                self.release()
+            else:
+                self.outbound.put(None)
+                if linger is not None:
+                    timer = threading.Timer(linger, self.abort)
+                    timer.daemon = True
+                    timer.start()
+    
+    def abort(self):
+        """Shut the socket down under both threads, whatever they are waiting on"""
+        if self.writer.is_alive():
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+    
+    def release(self):
+        """Return everything this connection still holds to the budget"""
+        with self.lock:
+            if self.released:
+                return
+            self.released = True
+            held = self.outbound_bytes + self.recv_charged
+            self.outbound_bytes = 0
+        self.budget.remove_connection(held)
+    
+    def memory(self):
+        """This connection's memory footprint in bytes, by component"""
+        reader = self.reader
+        pending = list(self.outbound.queue)
+        footprint = {
+            'recv_buffer': sys.getsizeof(reader.buffer),
+            'pending_frames': sum(sys.getsizeof(frame) for frame in list(reader.frames)),
+            # Broadcast frames are shared between queues; this is what this client holds on to
+            'outbound_queue': sum(sys.getsizeof(frame) for frame in pending if frame is not None),
+            'thread_stacks': 2 * THREAD_STACK_SIZE if self.writer.ident is not None else 0
+        }
+        footprint['total'] = sum(footprint.values())
+        return footprint
+    
+    def stats(self):
+        """Snapshot of this connection's counters"""
+        return {
+            'address': f'{self.address[0]}:{self.address[1]}',
+            'username': self.username,
+            'connected_for': round(self.clock.time() - self.connected_at, 1),
+            'queue_depth': self.outbound.qsize(),
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'frames_in': self.frames_in,
+            'frames_out': self.frames_out,
+            'dropped': self.dropped,
+            'shed': self.shed,
+            'memory': self.memory(),
+            'acked': dict(self.acked),
+            'recv_window': self.reader.recv_size,
+            'rate_limit': [self.limiter.rate, self.limiter.burst]
+        }
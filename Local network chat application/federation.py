@@ -0,0 +1,318 @@
+"""
+Server-to-server federation for the chat server.
+
+Servers peer over ordinary chat connections: a link opens with a
+`peer_hello` frame instead of `login`. Linked servers share a secret, and
+each side's hello carries a random nonce. The dialing server answers the
+other's nonce with a `peer_auth` frame holding an HMAC of it under the
+secret, plus its user directory; the accepting server checks it before
+answering in kind, so it never signs anything for an unproven peer. Until
+a link's auth checks out, anything other than the handshake closes it and
+nothing is sent to it. A server with no secret neither dials nor accepts
+peers. After that each side sends `peer_event`
+frames that wrap the client-facing frame being replicated (messages,
+joins, leaves and typing updates). Every server fans events out to its own
+clients only, so adding servers spreads the fan-out work.
+
+Each event carries its origin server, an origin-assigned id and the path
+of servers it has visited. A server drops events it has already seen or
+that already passed through it, and forwards the rest to every link not on
+the path, so any topology (chain, star, full mesh) works without loops.
+Frames on a link are numbered; a jump in the numbers is logged as a gap.
+"""
+
+import hashlib
+import hmac
+import secrets
+import threading
+from collections import deque
+from connection import ClientConnection
+
+PEER_CONNECT_TIMEOUT = 5   # Seconds to wait when dialing a peer
+RECONNECT_INTERVAL = 10.0  # Seconds between attempts to re-dial lost peers
+SEEN_EVENTS = 4096         # Recent (origin, id) pairs remembered for duplicate suppression
+PEER_MAX_OUTBOUND = 8 * 1024 * 1024  # A link carries every room's traffic, so it may queue more than a client
+NONCE_BYTES = 16           # Random challenge in each peer_hello
+REPLICATED_TYPES = ('message', 'user_joined', 'user_left', 'typing_update')
+
+def valid_event(message):
+    """Whether a peer_event has the fields handle_event and apply_remote rely on"""
+    event = message.get('event')
+    if (not isinstance(message.get('origin'), str) or not isinstance(message.get('id'), int)
+            or not isinstance(message.get('path', []), list) or not isinstance(event, dict)
+            or not isinstance(message.get('ts') or 0, (int, float))
+            or event.get('type') not in REPLICATED_TYPES or not isinstance(event.get('username'), str)
+            or not isinstance(event.get('room', ''), str)):
+        return False
+    if event['type'] == 'message':
+        return isinstance(event.get('message'), str)
+    if event['type'] == 'typing_update':
+        return 'room' in event and 'typing' in event
+    return True
+
+class PeerLink:
+    """One server-to-server connection and its sequence counters"""
+    
+    def __init__(self, conn, dialed_address=None):
+        self.conn = conn
+        self.dialed_address = dialed_address  # (host, port) if we dialed it, else None
+        self.server_id = None                 # Learned from the peer's hello
+        self.nonce = secrets.token_hex(NONCE_BYTES)  # Challenge the peer must sign
+        self.peer_nonce = None                # Challenge from the peer's hello, which we sign
+        self.verified = False                 # The peer's peer_auth checked out
+        self.send_seq = 0
+        self.recv_seq = 0
+        self.gaps = 0
+        self.lock = threading.Lock()
+    
+    def send(self, message):
+        """Number and queue a frame for the peer"""
+        with self.lock:
+            self.send_seq += 1
+            message['seq'] = self.send_seq
+            self.conn.send(message)
+    
+    def stats(self):
+        return {
+            'server_id': self.server_id,
+            'address': f'{self.conn.address[0]}:{self.conn.address[1]}',
+            'dialed': self.dialed_address is not None,
+            'verified': self.verified,
+            'sent': self.send_seq,
+            'received': self.recv_seq,
+            'gaps': self.gaps,
+            'queue_depth': self.conn.outbound.qsize()
+        }
+
+class Federation:
+    """Peer links, the directory of remote users and event replication for one ChatServer"""
+    
+    def __init__(self, chat_server, server_id, peers=(), secret=None):
+        self.chat_server = chat_server
+        self.server_id = server_id
+        self.secret = secret.encode('utf-8') if isinstance(secret, str) else secret
+        self.peers = [tuple(peer) for peer in peers]  # Addresses we keep dialing
+        self.links = []
+        self.remote_users = {}  # origin server_id -> (set of usernames, link they were learned from)
+        self.next_event_id = 0
+        self.seen = set()
+        self.seen_order = deque()
+        self.lock = threading.Lock()
+    
+    def start(self):
+        """Dial configured peers now and keep re-dialing any that drop"""
+        if self.peers:
+            self.maintain()
+            self.chat_server.clock.every(RECONNECT_INTERVAL, self.maintain)
+    
+    def maintain(self):
+        with self.lock:
+            linked = {link.dialed_address for link in self.links}
+        for address in self.peers:
+            if address not in linked:
+                self.connect_peer(*address)
+    
+    def add_peer(self, host, port):
+        """Remember a peer address and dial it"""
+        address = (host, int(port))
+        if address not in self.peers:
+            self.peers.append(address)
+        return self.connect_peer(*address)
+    
+    def connect_peer(self, host, port):
+        """Open a link to another server. Returns False if it cannot be reached."""
+        if not self.secret:
+            print(f"Not dialing peer {host}:{port}: no peer secret configured")
+            return False
+        try:
+            sock = self.chat_server.transport.connect(host, port, PEER_CONNECT_TIMEOUT)
+            sock.settimeout(None)
+        except OSError as e:
+            print(f"Could not reach peer {host}:{port}: {e}")
+            return False
+        conn = ClientConnection(sock, (host, port), clock=self.chat_server.clock, budget=self.chat_server.budget,
+                                max_outbound=PEER_MAX_OUTBOUND)
+        link = PeerLink(conn, dialed_address=(host, port))
+        conn.peer = link
+        with self.lock:
+            self.links.append(link)
+        link.send(self.hello(link))
+        self.chat_server.serve_connection(conn)
+        return True
+    
+    def hello(self, link):
+        return {'type': 'peer_hello', 'server_id': self.server_id, 'nonce': link.nonce}
+    
+    def proof(self, nonce, prover, verifier):
+        """HMAC showing `prover` holds the secret, bound to the verifier's nonce and both ids"""
+        return hmac.new(self.secret, f'{nonce}|{prover}|{verifier}'.encode('utf-8'), hashlib.sha256).hexdigest()
+    
+    def auth(self, link):
+        """Our answer to the peer's challenge, with every user we know about grouped by origin"""
+        with self.lock:
+            directory = {origin: sorted(users) for origin, (users, _) in self.remote_users.items()}
+        directory[self.server_id] = [c.username for c in self.chat_server.connections()]
+        return {
+            'type': 'peer_auth',
+            'proof': self.proof(link.peer_nonce, self.server_id, link.server_id),
+            'users': directory
+        }
+    
+    def accept(self, conn, message):
+        """First frame of an incoming connection was a peer_hello. Returns False to close it."""
+        if not self.secret:
+            print(f"Refusing peer link from {conn.address}: no peer secret configured")
+            return False
+        link = PeerLink(conn)
+        conn.peer = link
+        conn.max_outbound = PEER_MAX_OUTBOUND
+        with self.lock:
+            self.links.append(link)
+        return self.receive(link, message)
+    
+    def remove_link(self, link):
+        """Forget a dropped link and the users that were reachable through it"""
+        with self.lock:
+            if link not in self.links:
+                return
+            self.links.remove(link)
+            lost = [origin for origin, (_, via) in self.remote_users.items() if via is link]
+            departed = []
+            for origin in lost:
+                departed.extend(self.remote_users.pop(origin)[0])
+        print(f"Peer link to {link.server_id or link.conn.address} closed")
+        for username in departed:
+            self.chat_server.apply_remote({
+                'type': 'user_left',
+                'username': username,
+                'message': f'{username} left the chat',
+                'timestamp': self.chat_server.timestamp()
+            }, None)
+    
+    def receive(self, link, message):
+        """Handle one frame from a peer. Returns False when the link should close."""
+        seq = message.get('seq', 0)
+        if not isinstance(seq, int):
+            return False
+        if seq <= link.recv_seq:
+            return True  # Replayed frame
+        if seq != link.recv_seq + 1:
+            link.gaps += 1
+            print(f"Peer {link.server_id}: sequence gap {link.recv_seq + 1}..{seq - 1}")
+        link.recv_seq = seq
+        
+        msg_type = message.get('type')
+        if msg_type == 'peer_hello':
+            return self.handle_hello(link, message)
+        if msg_type == 'peer_auth':
+            return self.handle_auth(link, message)
+        if not link.verified:
+            print(f"Closing peer link from {link.conn.address}: {msg_type} before authentication")
+            return False
+        if msg_type == 'peer_event':
+            self.handle_event(link, message)
+        return True
+    
+    def handle_hello(self, link, message):
+        server_id = message.get('server_id')
+        nonce = message.get('nonce')
+        if link.peer_nonce is not None or not isinstance(nonce, str) or not nonce:
+            print(f"Refusing peer link from {link.conn.address} (bad hello)")
+            return False
+        if not isinstance(server_id, str) or not server_id or server_id == self.server_id:
+            print(f"Refusing peer link from {link.conn.address} (same server id)")
+            return False
+        link.server_id = server_id
+        link.peer_nonce = nonce
+        if link.dialed_address is None:
+            # They dialed us: challenge them, and prove ourselves only once they have
+            link.send(self.hello(link))
+        else:
+            link.send(self.auth(link))
+        return True
+    
+    def handle_auth(self, link, message):
+        proof = message.get('proof')
+        expected = self.proof(link.nonce, link.server_id, self.server_id)
+        if (link.verified or link.peer_nonce is None or not isinstance(proof, str)
+                or not hmac.compare_digest(proof, expected)):
+            print(f"Refusing peer link from {link.conn.address} (authentication failed)")
+            return False
+        users = message.get('users')
+        if not isinstance(users, dict):
+            return False
+        link.verified = True
+        if link.dialed_address is None:
+            link.send(self.auth(link))
+        with self.lock:
+            for origin, names in users.items():
+                if origin != self.server_id and isinstance(names, list):
+                    self.remote_users[origin] = ({name for name in names if isinstance(name, str)}, link)
+        print(f"Peered with {link.server_id} at {link.conn.address[0]}:{link.conn.address[1]}")
+        self.chat_server.broadcast({'type': 'user_list', 'users': self.chat_server.usernames()})
+        return True
+    
+    def handle_event(self, link, message):
+        if not valid_event(message):
+            print(f"Ignoring malformed event from peer {link.server_id}")
+            return
+        origin = message['origin']
+        path = message.get('path', [])
+        event = message['event']
+        if origin == self.server_id or self.server_id in path or not self.mark_seen(origin, message.get('id')):
+            return
+        
+        with self.lock:
+            # Users are reachable through whichever link last carried their origin's events
+            users = self.remote_users.get(origin, (set(),))[0]
+            self.remote_users[origin] = (users, link)
+            if event['type'] == 'user_joined':
+                users.add(event['username'])
+            elif event['type'] == 'user_left':
+                users.discard(event['username'])
+        self.chat_server.apply_remote(event, message.get('ts'))
+        self.forward(message, path + [self.server_id])
+    
+    def mark_seen(self, origin, event_id):
+        """Record an event. Returns False if it was already seen."""
+        key = (origin, event_id)
+        with self.lock:
+            if key in self.seen:
+                return False
+            self.seen.add(key)
+            self.seen_order.append(key)
+            if len(self.seen_order) > SEEN_EVENTS:
+                self.seen.discard(self.seen_order.popleft())
+        return True
+    
+    def publish(self, event, ts=None):
+        """Replicate a locally originated client-facing frame to every peer"""
+        with self.lock:
+            if not self.links:
+                return
+            self.next_event_id += 1
+            event_id = self.next_event_id
+        self.forward({
+            'type': 'peer_event',
+            'origin': self.server_id,
+            'id': event_id,
+            'ts': ts,
+            'event': event
+        }, [self.server_id])
+    
+    def forward(self, message, path):
+        with self.lock:
+            targets = [link for link in self.links if link.verified and link.server_id not in path]
+        for link in targets:
+            link.send(dict(message, path=path))
+    
+    def remote_usernames(self):
+        with self.lock:
+            return [u for users, _ in self.remote_users.values() for u in users]
+    
+    def has_user(self, username):
+        return username in self.remote_usernames()
+    
+    def stats(self):
+        with self.lock:
+            return [link.stats() for link in self.links]
@@ -0,0 +1,308 @@
+import hashlib
+import json
+import os
+import queue
+import re
+import shutil
+import struct
+import threading
+import time
+
+CACHE_DIR = 'chat_cache'
+PAGE_SIZE = 50      # Messages loaded per scroll-back
+TAIL_RECORDS = 1000  # Records checked on open for messages newer than the saved cursor
+MAX_ROOM_BYTES = 16 * 1024 * 1024   # Log size per room that triggers compaction
+MAX_AGE = 180 * 24 * 3600           # Messages older than this (seconds) trigger compaction
+COMPACT_RATIO = 0.75  # Compaction keeps at most this share of either limit, so it is not redone on every open
+
+INDEX_RECORD = struct.Struct('<QQd')  # (byte offset in the log, server sequence number, time received)
+
+def file_key(text):
+    """A filename for any string: readable where it can be, unique thanks to a hash"""
+    safe = re.sub(r'[^A-Za-z0-9.-]', '_', text)[:40]
+    return f"{safe}-{hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]}"
+
+class RoomCache:
+    """Append-only message log for one server and room, with a fixed-width index.
+    
+    `<key>.<generation>.jsonl` holds one message per line and
+    `<key>.<generation>.idx` one 24-byte record per message: where its line
+    starts, its server sequence number and when it was received. Record i of
+    the index is message i of the log, so a page of history is one seek into
+    each file, however large the cache grows.
+    
+    `<key>.meta` holds the room name, the resume cursor and the current
+    generation. When the log passes MAX_ROOM_BYTES or holds messages older
+    than MAX_AGE, opening the room copies the newest messages into the next
+    generation's files and then switches the meta file over, so a crash at
+    any point leaves one complete generation in use.
+    """
+    
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.meta_path = path + '.meta'
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        self.epoch = meta.get('epoch')  # Server run the cursor belongs to
+        self.cursor = meta.get('seq')   # Last sequence number we have everything up to
+        self.generation = meta.get('generation', 0)
+        self.open_files()
+        self.count = self.recover()
+        self.compact()
+        self.known = self.tail_after(self.cursor)
+    
+    def files(self, generation):
+        return f'{self.path}.{generation}.jsonl', f'{self.path}.{generation}.idx'
+    
+    def open_files(self):
+        log_path, index_path = self.files(self.generation)
+        self.log = open(log_path, 'ab+')
+        self.index = open(index_path, 'ab+')
+    
+    def recover(self):
+        """Trim a torn log line or index record left by a crash. Returns the message count."""
+        self.index.seek(0, os.SEEK_END)
+        count = self.index.tell() // INDEX_RECORD.size
+        self.log.seek(0, os.SEEK_END)
+        log_size = self.log.tell()
+        # Walk back until the last indexed line is complete
+        end = 0
+        while count:
+            offset = self.record(count - 1)[0]
+            self.log.seek(offset)
+            line = self.log.readline()
+            if line.endswith(b'\n'):
+                end = offset + len(line)
+                break
+            count -= 1
+        self.index.truncate(count * INDEX_RECORD.size)
+        if end != log_size:
+            self.log.truncate(end)
+        return count
+    
+    def first_record(self, keep):
+        """Index of the first record for which keep(record) holds, assuming it holds for every later one"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if keep(self.record(mid)):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+    
+    def compact(self, now=None):
+        """Drop the oldest messages if the log is over its size or age limit"""
+        if not self.count:
+            return
+        now = time.time() if now is None else now
+        self.log.seek(0, os.SEEK_END)
+        size = self.log.tell()
+        start = 0
+        if size > MAX_ROOM_BYTES:
+            start = self.first_record(lambda record: size - record[0] <= MAX_ROOM_BYTES * COMPACT_RATIO)
+        if now - self.record(0)[2] > MAX_AGE:
+            start = max(start, self.first_record(lambda record: now - record[2] <= MAX_AGE * COMPACT_RATIO))
+        if start:
+            self.rewrite(start)
+    
+    def rewrite(self, start):
+        """Move records start.. into the next generation's files and switch to them"""
+        base = self.record(start)[0] if start < self.count else None
+        old_files = self.files(self.generation)
+        log_path, index_path = self.files(self.generation + 1)
+        with open(log_path, 'wb') as log, open(index_path, 'wb') as index:
+            if base is not None:
+                self.log.seek(base)
+                shutil.copyfileobj(self.log, log)
+                self.index.seek(start * INDEX_RECORD.size)
+                for offset, seq, received in INDEX_RECORD.iter_unpack(self.index.read()):
+                    index.write(INDEX_RECORD.pack(offset - base, seq, received))
+            log.flush()
+            os.fsync(log.fileno())
+            index.flush()
+            os.fsync(index.fileno())
+        self.log.close()
+        self.index.close()
+        self.generation += 1
+        self.write_meta()
+        for path in old_files:
+            os.remove(path)
+        self.open_files()
+        self.count -= start
+    
+    def tail_after(self, cursor):
+        """Sequence numbers of recent records past the cursor (stored after the cursor was last saved)"""
+        if cursor is None:
+            return set()
+        return {seq for _, seq, _ in map(self.record, range(max(0, self.count - TAIL_RECORDS), self.count)) if seq > cursor}
+    
+    def has(self, seq):
+        """Whether a message replayed from the saved cursor onwards is already stored"""
+        return seq in self.known
+    
+    def record(self, i):
+        self.index.seek(i * INDEX_RECORD.size)
+        return INDEX_RECORD.unpack(self.index.read(INDEX_RECORD.size))
+    
+    def append(self, seq, message):
+        """Store one received message"""
+        line = (json.dumps(message) + '\n').encode('utf-8')
+        self.log.seek(0, os.SEEK_END)
+        offset = self.log.tell()
+        self.log.write(line)
+        self.index.write(INDEX_RECORD.pack(offset, seq, time.time()))
+        self.count += 1
+    
+    def page(self, before=None, limit=PAGE_SIZE):
+        """Messages [start, before) in arrival order, where start = before - limit. Returns (messages, start)."""
+        before = self.count if before is None else min(before, self.count)
+        start = max(0, before - limit)
+        if start == before:
+            return [], start
+        self.log.flush()
+        offset = self.record(start)[0]
+        end = self.record(before)[0] if before < self.count else None
+        self.log.seek(offset)
+        data = self.log.read() if end is None else self.log.read(end - offset)
+        return [json.loads(line) for line in data.splitlines()], start
+    
+    def set_cursor(self, epoch, seq):
+        """Remember how far this room is complete, for the next login"""
+        if (epoch, seq) == (self.epoch, self.cursor):
+            return
+        if epoch != self.epoch:
+            self.known = set()
+        self.epoch, self.cursor = epoch, seq
+        self.flush()
+        self.write_meta()
+    
+    def write_meta(self):
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'room': self.name, 'epoch': self.epoch, 'seq': self.cursor, 'generation': self.generation}, f)
+        os.replace(tmp_path, self.meta_path)
+    
+    def flush(self):
+        self.log.flush()
+        self.index.flush()
+    
+    def close(self):
+        self.flush()
+        self.log.close()
+        self.index.close()
+
+class MessageCache:
+    """On-disk message history per server and room, kept by the client"""
+    
+    def __init__(self, host, port, directory=CACHE_DIR):
+        self.directory = directory
+        self.prefix = file_key(f'{host}_{port}')
+        self.rooms = {}
+    
+    def room(self, name):
+        if name not in self.rooms:
+            self.rooms[name] = self.open_room(name)
+        return self.rooms[name]
+    
+    def open_room(self, name):
+        """Open (recover and, if due, compact) a room's files without adding it to self.rooms"""
+        os.makedirs(self.directory, exist_ok=True)
+        return RoomCache(os.path.join(self.directory, f'{self.prefix}_{file_key(name)}'), name)
+    
+    def resume_point(self):
+        """(epoch, {room: seq}) to send at login, or (None, None) for an empty cache"""
+        for filename in os.listdir(self.directory) if os.path.isdir(self.directory) else ():
+            if filename.startswith(self.prefix + '_') and filename.endswith('.meta'):
+                # Room names are only stored in the meta file; filenames may be lossy
+                try:
+                    with open(os.path.join(self.directory, filename), 'r', encoding='utf-8') as f:
+                        name = json.load(f).get('room')
+                except (OSError, ValueError, AttributeError):
+                    continue
+                if isinstance(name, str):
+                    self.room(name)
+        epochs = {room.epoch for room in self.rooms.values() if room.cursor is not None}
+        if len(epochs) != 1:
+            return None, None
+        return epochs.pop(), {name: room.cursor for name, room in self.rooms.items() if room.cursor is not None}
+    
+    def has(self, room, seq):
+        """Whether a message replayed into `room` is already stored. Rooms not opened yet have no cursor to replay from."""
+        return room in self.rooms and self.rooms[room].has(seq)
+    
+    def new_epoch(self):
+        """The server restarted: sequence numbers from the previous run mean nothing now"""
+        for room in self.rooms.values():
+            room.known = set()
+    
+    def close(self):
+        for room in self.rooms.values():
+            room.close()
+
+class CacheWriter:
+    """Writes to a MessageCache on a background thread, so the UI never waits on the disk.
+    
+    `append` and `set_cursor` return immediately. Writes that pile up while
+    the thread is busy are applied as one batch and flushed once; a room seen
+    for the first time is opened (and compacted) on the thread too. `page`
+    reads under the same lock, and `close` waits for every queued write.
+    """
+    
+    def __init__(self, cache):
+        self.cache = cache
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def append(self, room, seq, message):
+        self.queue.put(('append', room, seq, message))
+    
+    def set_cursor(self, room, epoch, seq):
+        self.queue.put(('cursor', room, epoch, seq))
+    
+    def has(self, room, seq):
+        return self.cache.has(room, seq)
+    
+    def new_epoch(self):
+        self.cache.new_epoch()
+    
+    def page(self, room, before=None):
+        """RoomCache.page for a room opened at connect"""
+        with self.lock:
+            return self.cache.room(room).page(before)
+    
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            names = {item[1] for item in batch if item is not None}
+            # Opening may compact a large log; do it outside the lock so page() is not held up
+            opened = {name: self.cache.open_room(name) for name in names - set(self.cache.rooms)}
+            with self.lock:
+                self.cache.rooms.update(opened)
+                for item in batch:
+                    if item is None:
+                        self.cache.close()
+                        return
+                    kind, name, *args = item
+                    if kind == 'append':
+                        self.cache.rooms[name].append(*args)
+                    else:
+                        self.cache.rooms[name].set_cursor(*args)
+                for name in names:
+                    self.cache.rooms[name].flush()
+    
+    def close(self):
+        """Apply everything queued, then close the cache"""
+        self.queue.put(None)
+        self.thread.join()
@@ -0,0 +1,203 @@
+import json
+import queue
+import socket
+import threading
+from protocol import FrameReader, encode_frame
+from transport import SocketTransport
+
+# Connection states
+DISCONNECTED = 'disconnected'
+CONNECTING = 'connecting'
+LOGGING_IN = 'logging_in'
+CONNECTED = 'connected'
+FAILED = 'failed'
+CLOSED = 'closed'
+
+CONNECT_TIMEOUT = 5    # Seconds to establish the TCP connection
+LOGIN_TIMEOUT = 3      # Seconds to wait for the login response
+BACKLOG_LIMIT = 100    # Droppable frames (e.g. typing) are skipped beyond this queue depth
+
+class NetworkWorker:
+    """Owns the client socket so the Tk thread never blocks on the network.
+    
+    `connect` and `send` return immediately. Connection setup, login and all
+    writes happen on the worker thread; a reader thread decodes incoming
+    frames. Everything the UI needs to know is handed to `post` as
+    ('state', state, detail) or ('frame', message) tuples, which the Tk
+    thread drains from a queue.
+    """
+    
+    def __init__(self, post, transport=None):
+        self.post = post
+        self.transport = transport or SocketTransport()
+        self.state = DISCONNECTED
+        self.socket = None
+        self.reader = None
+        self.outbound = queue.Queue()
+        self.lock = threading.Lock()
+    
+    def set_state(self, state, detail=None):
+        """Move to a new state and tell the UI. Returns False if the worker was closed meanwhile."""
+        with self.lock:
+            if self.state == CLOSED:
+                return False
+            self.state = state
+        self.post(('state', state, detail))
+        return True
+    
+    def connect(self, host, port, username, resume=None):
+        """Start connecting in the background. Returns False if already connecting or connected.
+        
+        `resume`, if given, is called on the worker thread before connecting and
+        returns (epoch, since): `since` maps room -> last sequence number seen in
+        server run `epoch`, so the server can replay what was missed.
+        """
+        with self.lock:
+            if self.state in (CONNECTING, LOGGING_IN, CONNECTED):
+                return False
+            self.state = CONNECTING
+            self.outbound = queue.Queue()
+        self.post(('state', CONNECTING, None))
+        thread = threading.Thread(target=self.run, args=(host, port, username, resume), daemon=True)
+        thread.start()
+        return True
+    
+    def run(self, host, port, username, resume=None):
+        """Worker thread: connect, log in, then write queued frames until closed"""
+        try:
+            epoch, since = resume() if resume else (None, None)
+        except OSError as e:
+            self.set_state(FAILED, f"Error: {e}")
+            return
+        try:
+            self.socket = self.transport.connect(host, port, CONNECT_TIMEOUT)
+        except ConnectionRefusedError:
+            self.set_state(FAILED, "Connection refused. Is the server running?")
+            return
+        except socket.timeout:
+            self.set_state(FAILED, "Connection timed out")
+            return
+        except OSError as e:
+            self.set_state(FAILED, f"Error: {e}")
+            return
+        
+        self.reader = FrameReader(self.socket)
+        if not self.set_state(LOGGING_IN) or not self.login(username, since, epoch):
+            self.socket.close()
+            return
+        
+        listen_thread = threading.Thread(target=self.listen, daemon=True)
+        listen_thread.start()
+        self.write_loop()
+    
+    def login(self, username, since=None, epoch=None):
+        """Send the login frame and wait for the server's answer"""
+        login_message = {
+            'type': 'login',
+            'username': username
+        }
+        if since:
+            login_message['since'] = since
+            login_message['epoch'] = epoch
+        try:
+            # Wait for login response (with timeout) before starting the reader
+            self.socket.settimeout(LOGIN_TIMEOUT)
+            self.socket.sendall(encode_frame(login_message))
+            response = self.reader.next_frame()
+            if response is None:
+                self.set_state(FAILED, "Server closed the connection")
+                return False
+            message = json.loads(response)
+            if message.get('type') == 'error':
+                self.set_state(FAILED, message.get('message', 'Login refused'))
+                return False
+            welcome = message
+            # Reset timeout to None (blocking mode) for normal operation
+            self.socket.settimeout(None)
+        except socket.timeout:
+            self.set_state(FAILED, "Login timeout - connection failed")
+            return False
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            # Unreadable response; proceed as the client always has and let the reader sort it out
+            self.socket.settimeout(None)
+            welcome = None
+        except OSError as e:
+            self.set_state(FAILED, f"Error: {e}")
+            return False
+        if not self.set_state(CONNECTED):
+            return False
+        if welcome:
+            # The UI wants login_success too (it carries the server epoch)
+            self.post(('frame', welcome))
+        return True
+    
+    def write_loop(self):
+        """Drain the outbound queue into the socket, batching whatever is waiting"""
+        try:
+            while True:
+                frame = self.outbound.get()
+                if frame is None:
+                    break
+                batch = [frame]
+                while True:
+                    try:
+                        frame = self.outbound.get_nowait()
+                    except queue.Empty:
+                        break
+                    if frame is None:
+                        self.outbound.put(None)
+                        break
+                    batch.append(frame)
+                self.socket.sendall(b''.join(batch))
+        except OSError:
+            self.set_state(DISCONNECTED, "Connection to server lost.")
+        finally:
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.socket.close()
+    
+    def listen(self):
+        """Reader thread: hand every incoming frame to the UI"""
+        try:
+            while True:
+                frame = self.reader.next_frame()
+                if frame is None:
+                    break
+                try:
+                    message = json.loads(frame)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    # Skip malformed JSON
+                    continue
+                self.post(('frame', message))
+        except OSError:
+            pass
+        # Stop the writer too; set_state is a no-op if we closed on purpose
+        if self.set_state(DISCONNECTED, "Connection to server lost."):
+            self.outbound.put(None)
+    
+    def send(self, message, droppable=False):
+        """Queue a message for the server. Never blocks.
+        
+        Droppable messages are skipped while the server is not keeping up.
+        Returns False if the message was not queued.
+        """
+        if self.state != CONNECTED:
+            return False
+        if droppable and self.outbound.qsize() >= BACKLOG_LIMIT:
+            return False
+        self.outbound.put(encode_frame(message))
+        return True
+    
+    def backlog(self):
+        """Frames queued but not yet written"""
+        return self.outbound.qsize()
+    
+    def close(self):
+        """Say goodbye to the server (if connected) and stop both threads without waiting"""
+        if self.state == CONNECTED:
+            self.outbound.put(encode_frame({'type': 'disconnect'}))
+        with self.lock:
+            self.state = CLOSED
+        self.outbound.put(None)
@@ -0,0 +1,73 @@
+import threading
+from transport import Clock
+
+TYPING_INTERVAL = 1.0  # Seconds between presence fan-outs
+TYPING_TIMEOUT = 5.0   # Typing state expires unless the client refreshes it
+
+class PresenceCoalescer:
+    """Coalesce typing updates per user and room and fan them out at most once per interval.
+    
+    Incoming `typing` frames only touch an in-memory table. A periodic flush
+    compares each changed room against what was last sent and broadcasts one
+    `typing` frame per room when the set of typists differs.
+    """
+    
+    def __init__(self, broadcast, interval=TYPING_INTERVAL, timeout=TYPING_TIMEOUT, clock=None):
+        self.broadcast = broadcast
+        self.interval = interval
+        self.timeout = timeout
+        self.clock = clock or Clock()
+        self.typing = {}     # room -> {username: expires_at}
+        self.dirty = set()   # rooms whose typists changed since the last flush
+        self.last_sent = {}  # room -> tuple of typists last fanned out
+        self.lock = threading.Lock()
+    
+    def start(self):
+        """Schedule the periodic flush"""
+        self.clock.every(self.interval, self.flush)
+    
+    def update(self, room, username, is_typing, now=None):
+        """Record a typing start/stop for a user in a room"""
+        now = now if now is not None else self.clock.time()
+        with self.lock:
+            typists = self.typing.setdefault(room, {})
+            if is_typing:
+                if username not in typists:
+                    self.dirty.add(room)
+                typists[username] = now + self.timeout
+            elif typists.pop(username, None) is not None:
+                self.dirty.add(room)
+    
+    def remove_user(self, username):
+        """Forget a user in every room (on disconnect)"""
+        with self.lock:
+            for room, typists in self.typing.items():
+                if typists.pop(username, None) is not None:
+                    self.dirty.add(room)
+    
+    def flush(self, now=None):
+        """Expire stale typists and fan out one frame per changed room"""
+        now = now if now is not None else self.clock.time()
+        updates = []
+        with self.lock:
+            for room, typists in self.typing.items():
+                expired = [u for u, expires_at in typists.items() if expires_at <= now]
+                for username in expired:
+                    del typists[username]
+                if expired:
+                    self.dirty.add(room)
+            
+            for room in self.dirty:
+                users = tuple(sorted(self.typing.get(room, {})))
+                if users != self.last_sent.get(room, ()):
+                    self.last_sent[room] = users
+                    updates.append((room, users))
+            self.dirty.clear()
+        
+        # Broadcast outside our lock so a slow send never blocks incoming updates
+        for room, users in updates:
+            self.broadcast({
+                'type': 'typing',
+                'room': room,
+                'users': list(users)
+            })
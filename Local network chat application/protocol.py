@@ -0,0 +1,149 @@
+import json
+from collections import deque
+
+MIN_RECV_SIZE = 4096          # Starting (and smallest) receive window
+MAX_RECV_SIZE = 64 * 1024     # Receive window never grows past this
+COMPAT_FRAME_LIMIT = 2048     # Largest unterminated frame accepted from older peers
+SHRINK_AFTER = 16             # Small reads in a row before the window shrinks again
+
+class FrameTooLarge(ValueError):
+    """A peer sent (or is still sending) a frame over the reader's size limit"""
+
+def encode_frame(message):
+    """Serialize a message as a newline-delimited JSON frame"""
+    return (json.dumps(message) + '\n').encode('utf-8')
+
+class FrameReader:
+    """Read newline-delimited frames from a socket into one reusable buffer.
+    
+    Data is received with `recv_into` straight into a preallocated bytearray,
+    so no intermediate bytes or str objects are created per recv. Frames are
+    sliced out only once their terminating newline has arrived, which means
+    UTF-8 decoding (done by `json.loads`) never sees a split character.
+    
+    The receive window adapts to traffic: it doubles whenever a recv fills it
+    and halves after a run of small reads. With `max_frame` set, a frame (or
+    an unterminated partial frame) longer than that raises FrameTooLarge, so
+    the buffer can never grow past max_frame plus one receive window.
+    """
+    
+    def __init__(self, sock, min_size=MIN_RECV_SIZE, max_size=MAX_RECV_SIZE, max_frame=None):
+        self.sock = sock
+        self.max_frame = max_frame
+        self.min_size = min_size
+        self.max_size = max_size
+        self.recv_size = min_size
+        self.buffer = bytearray(min_size)
+        self.start = 0      # First unconsumed byte
+        self.end = 0        # One past the last received byte
+        self.scanned = 0    # Bytes before this offset contain no newline
+        self.frames = deque()
+        self.small_reads = 0
+        self.recv_calls = 0
+        self.bytes_in = 0
+    
+    def next_frame(self):
+        """Return the next complete frame as a bytearray, or None on EOF"""
+        while not self.frames:
+            if not self.fill():
+                return None
+        return self.frames.popleft()
+    
+    def read_available(self):
+        """Receive until a non-blocking socket would block.
+        
+        Returns (frames, eof) where frames are all complete frames received so far.
+        """
+        eof = False
+        try:
+            while True:
+                if not self.fill():
+                    eof = True
+                    break
+        except BlockingIOError:
+            pass
+        frames = list(self.frames)
+        self.frames.clear()
+        return frames, eof
+    
+    def fill(self):
+        """Receive once and split out any complete frames. Returns False on EOF."""
+        self.reserve(self.recv_size)
+        with memoryview(self.buffer) as view:
+            n = self.sock.recv_into(view[self.end:self.end + self.recv_size])
+        if n == 0:
+            return False
+        
+        self.recv_calls += 1
+        self.bytes_in += n
+        self.end += n
+        self.adapt(n)
+        self.split_frames()
+        return True
+    
+    def reserve(self, size):
+        """Make room for `size` more bytes after `end`, compacting or growing the buffer"""
+        if len(self.buffer) - self.end >= size:
+            return
+        pending = self.end - self.start
+        if self.start and len(self.buffer) - pending >= size:
+            # Slide the partial frame to the front instead of reallocating
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+        else:
+            grown = bytearray(max(len(self.buffer) * 2, pending + size))
+            grown[:pending] = self.buffer[self.start:self.end]
+            self.buffer = grown
+        self.scanned -= self.start
+        self.start = 0
+        self.end = pending
+    
+    def adapt(self, n):
+        """Grow the receive window on full reads, shrink it after a run of small ones"""
+        if n == self.recv_size and self.recv_size < self.max_size:
+            self.recv_size = min(self.recv_size * 2, self.max_size)
+            self.small_reads = 0
+        elif n < self.recv_size // 4 and self.recv_size > self.min_size:
+            self.small_reads += 1
+            if self.small_reads >= SHRINK_AFTER:
+                self.recv_size = max(self.recv_size // 2, self.min_size)
+                self.small_reads = 0
+        else:
+            self.small_reads = 0
+    
+    def split_frames(self):
+        """Move every newline-terminated frame in the buffer onto the frame queue"""
+        buffer = self.buffer
+        while True:
+            newline = buffer.find(b'\n', max(self.scanned, self.start), self.end)
+            if newline < 0:
+                break
+            if self.max_frame and newline - self.start > self.max_frame:
+                raise FrameTooLarge(f"Frame of {newline - self.start} bytes exceeds {self.max_frame}")
+            # One copy per frame; json.loads skips surrounding whitespace itself
+            frame = buffer[self.start:newline]
+            self.start = newline + 1
+            if frame and not frame.isspace():
+                self.frames.append(frame)
+        self.scanned = self.end
+        if self.max_frame and self.end - self.start > self.max_frame:
+            raise FrameTooLarge(f"Unterminated frame exceeds {self.max_frame} bytes")
+        
+        if self.start == self.end:
+            self.start = self.end = self.scanned = 0
+            if len(self.buffer) > 2 * self.recv_size:
+                # A burst is over; give back memory the window no longer needs
+                self.buffer = bytearray(self.recv_size)
+        elif self.end - self.start < COMPAT_FRAME_LIMIT:
+            # Older peers send some frames without a newline; accept a
+            # complete JSON object sitting alone in the buffer
+            pending = buffer[self.start:self.end]
+            try:
+                json.loads(pending)
+            except (ValueError, UnicodeDecodeError):
+                return
+            self.frames.append(pending)
+            self.start = self.end = self.scanned = 0
+    
+    def pending_bytes(self):
+        """Number of received bytes not yet returned as frames"""
+        return self.end - self.start
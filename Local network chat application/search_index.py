@@ -0,0 +1,190 @@
+import json
+import os
+import queue
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+# Most leapfrog steps one search may take. Keyword lists that rarely overlap
+# can otherwise be walked end to end; past this the search returns what it
+# has found so far, marked incomplete. Under 10 ms at a million messages.
+MAX_SEARCH_STEPS = 4000
+
+def tokenize(text):
+    """Split text into lowercase keyword tokens"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+def _intersect_newest(lists, lo, hi, max_steps):
+    """Yield the ids in [lo, hi) present in every sorted list, newest first.
+    
+    Leapfrog join: each list in turn binary searches for the newest id at or
+    below the current target and lowers the target to it, so runs of ids
+    missing from any one list are skipped in a single step. The last value
+    yielded is None if `max_steps` ran out before the range was exhausted.
+    """
+    ends = [bisect_left(postings, hi) for postings in lists]
+    target = hi - 1
+    for _ in range(max_steps):
+        matched = True
+        for k, postings in enumerate(lists):
+            j = bisect_right(postings, target, 0, ends[k]) - 1
+            if j < 0 or postings[j] < lo:
+                return
+            ends[k] = j + 1
+            if postings[j] < target:
+                target = postings[j]
+                matched = False
+        if matched:
+            yield target
+            target -= 1
+    yield None
+
+class MessageIndex:
+    """In-memory inverted index over chat messages, persisted to an append-only log.
+    
+    Message ids are assigned in arrival order, so every postings list stays
+    sorted and time ranges map to id ranges with a binary search.
+    """
+    
+    def __init__(self, path='chat_history.jsonl'):
+        self.path = path
+        # Parallel arrays indexed by message id
+        self.timestamps = []
+        self.usernames = []
+        self.texts = []
+        self.postings = {}       # token -> sorted list of message ids
+        self.user_postings = {}  # lowercased username -> sorted list of message ids
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()
+        self.log_file = None
+        self.thread = None
+    
+    def start(self, background=True):
+        """Load persisted history and start the background indexer.
+        
+        With `background=False` no thread is started and queued messages are
+        indexed whenever `drain()` is called (used by the simulated network).
+        A `path` of None keeps the index in memory only.
+        """
+        self.load()
+        if self.path:
+            self.log_file = open(self.path, 'a', encoding='utf-8')
+        if background:
+            self.thread = threading.Thread(target=self.run_indexer, daemon=True)
+            self.thread.start()
+    
+    def load(self):
+        """Rebuild the index from the history log"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    self.index_message(entry['username'], entry['message'], entry['ts'])
+                except (json.JSONDecodeError, KeyError):
+                    # Torn write from a previous crash - skip it
+                    continue
+        print(f"Loaded {len(self.texts)} messages into search index")
+    
+    def add(self, username, text, timestamp=None):
+        """Queue a message for indexing (cheap, safe to call from the broadcast path)"""
+        self.pending.put((username, text, timestamp if timestamp is not None else time.time()))
+    
+    def run_indexer(self):
+        """Index queued messages as they arrive"""
+        while True:
+            # Take the whole backlog so the log is flushed once per batch
+            batch = [self.pending.get()] + self.take_pending()
+            self.index_batch(batch)
+    
+    def drain(self):
+        """Index everything queued so far on the calling thread"""
+        self.index_batch(self.take_pending())
+    
+    def take_pending(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.pending.get_nowait())
+            except queue.Empty:
+                return batch
+    
+    def index_batch(self, batch):
+        """Index queued messages and append them to the history log"""
+        for username, text, timestamp in batch:
+            with self.lock:
+                timestamp = self.index_message(username, text, timestamp)
+            if self.log_file:
+                self.log_file.write(json.dumps({
+                    'ts': timestamp,
+                    'username': username,
+                    'message': text
+                }) + '\n')
+        if batch and self.log_file:
+            self.log_file.flush()
+    
+    def index_message(self, username, text, timestamp):
+        """Add one message to the in-memory index and return its stored timestamp"""
+        # Keep timestamps monotonic so time ranges can be binary searched
+        if self.timestamps and timestamp < self.timestamps[-1]:
+            timestamp = self.timestamps[-1]
+        
+        message_id = len(self.texts)
+        self.timestamps.append(timestamp)
+        self.usernames.append(username)
+        self.texts.append(text)
+        
+        for token in set(tokenize(text)):
+            self.postings.setdefault(token, []).append(message_id)
+        self.user_postings.setdefault(username.lower(), []).append(message_id)
+        return timestamp
+    
+    def search(self, query='', username=None, since=None, until=None, limit=50, max_steps=MAX_SEARCH_STEPS):
+        """Return (matching messages newest first, complete).
+        
+        All query keywords must match. `since` and `until` are epoch seconds.
+        `complete` is False when the search gave up after `max_steps` with
+        fewer than `limit` results; older matches may exist.
+        """
+        tokens = set(tokenize(query or ''))
+        results = []
+        
+        with self.lock:
+            lo = bisect_left(self.timestamps, since) if since is not None else 0
+            hi = bisect_right(self.timestamps, until) if until is not None else len(self.timestamps)
+            if lo >= hi or limit <= 0:
+                return results, True
+            
+            lists = [self.postings.get(token, []) for token in tokens]
+            if username:
+                lists.append(self.user_postings.get(username.lower(), []))
+            
+            if lists:
+                # The rarest list sets the first target and is usually the one that skips furthest
+                lists.sort(key=len)
+                candidates = _intersect_newest(lists, lo, hi, max_steps)
+            else:
+                candidates = iter(range(hi - 1, lo - 1, -1))
+            
+            for message_id in candidates:
+                if message_id is None:
+                    return results, False
+                results.append({
+                    'username': self.usernames[message_id],
+                    'message': self.texts[message_id],
+                    'ts': self.timestamps[message_id]
+                })
+                if len(results) >= limit:
+                    break
+        
+        return results, True
+    
+    def close(self):
+        """Close the history log"""
+        if self.log_file:
+            self.log_file.close()
+            self.log_file = None
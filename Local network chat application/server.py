@@ -1,7 +1,25 @@
+import ipaddress
+import os
 import socket
 import threading
 import json
+from collections import deque
 from datetime import datetime
+from itertools import islice
+from search_index import MessageIndex
+from presence import PresenceCoalescer
+from protocol import FrameTooLarge, encode_frame
+from connection import ClientConnection, MemoryBudget, DEFAULT_RATE, DEFAULT_BURST, MEMORY_BUDGET, THREAD_STACK_SIZE
+from admin import AdminServer
+from federation import Federation
+from transport import Clock, SocketTransport
+
+DEFAULT_ROOM = 'general'  # Single shared room; frames may name another one
+RATE_LIMITED_TYPES = ('message', 'search', 'gap_fill')
+REPLAY_BUFFER = 1000  # Recent frames kept per room for gap fills and resumed logins
+UNSEQUENCED_TYPES = ('typing', 'user_list')  # Superseded by the next one: not numbered, not replayed, droppable
+PEER_SECRET_ENV = 'CHAT_PEER_SECRET'  # Shared secret for server-to-server links when run as a script
+KICK_LINGER = 2.0  # Seconds a kicked client gets to take the notice before its socket is shut down
 
 def get_local_ip():
     """Get the local IP address of this machine"""
@@ -23,176 +41,455 @@ def get_local_ip():
         return '127.0.0.1'
 
 class ChatServer:
-    def __init__(self, host='0.0.0.0', port=5555):
+    def __init__(self, host='0.0.0.0', port=5555, history_path='chat_history.jsonl', admin_port=5556,
+                 transport=None, clock=None, server_id=None, peers=(), peer_secret=None, memory_budget=MEMORY_BUDGET):
         self.host = host
         self.port = port
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.clients = {}
+        self.transport = transport or SocketTransport()
+        self.clock = clock or Clock()
+        self.socket = None
+        self.clients = {}  # address -> ClientConnection (logged in only)
         self.lock = threading.Lock()
+        self.epoch = int(self.clock.time() * 1000)  # Identifies this run; sequence numbers restart with it
+        self.room_seq = {}  # room -> last sequence number assigned
+        self.replay = {}    # room -> deque of (seq, encoded frame), oldest first
+        self.index = MessageIndex(history_path)
+        self.presence = PresenceCoalescer(self.broadcast, clock=self.clock)
+        self.rate_limit = (DEFAULT_RATE, DEFAULT_BURST)
+        self.budget = MemoryBudget(memory_budget)
+        self.banned_ips = set()
+        self.banned_users = set()
+        self.admin = AdminServer(self, port=admin_port) if admin_port else None
+        self.federation = Federation(self, server_id or f'{get_local_ip()}:{port}', peers, peer_secret)
         
     def start(self):
-        self.socket.bind((self.host, self.port))
-        self.socket.listen()
+        # Two threads per connection; the default 8 MB stack reservation each is far more than they use
+        threading.stack_size(THREAD_STACK_SIZE)
+        self.open()
         local_ip = get_local_ip()
         print(f"Server started on {self.host}:{self.port}")
         print(f"Local IP address: {local_ip}:{self.port}")
         print("Waiting for clients...")
         print(f"Connect using: {local_ip}:{self.port} (from other devices on your network)")
-        
+        self.serve_forever()
+    
+    def open(self, background=True):
+        """Start supporting services and listen on the transport"""
+        self.index.start(background)
+        self.presence.start()
+        if self.admin:
+            self.admin.start()
+        self.socket = self.transport.listen(self.host, self.port)
+        self.federation.start()
+    
+    def serve_forever(self):
+        """Accept clients and handle each one on its own thread"""
         while True:
             client_socket, address = self.socket.accept()
-            print(f"New connection from {address}")
-            thread = threading.Thread(target=self.handle_client, args=(client_socket, address))
-            thread.daemon = True
-            thread.start()
+            conn = self.accept(client_socket, address)
+            if conn:
+                self.serve_connection(conn)
     
-    def handle_client(self, client_socket, address):
-        username = None
+    def serve_connection(self, conn):
+        """Run handle_client for a connection on its own thread"""
+        thread = threading.Thread(target=self.handle_client, args=(conn,))
+        thread.daemon = True
+        thread.start()
+    
+    def accept(self, client_socket, address):
+        """Wrap a new socket in a ClientConnection, or refuse it if banned"""
+        if address[0] in self.banned_ips:
+            print(f"Rejected banned address {address}")
+            client_socket.close()
+            return None
+        print(f"New connection from {address}")
+        return ClientConnection(client_socket, address, *self.rate_limit, clock=self.clock, budget=self.budget)
+    
+    def handle_client(self, conn):
+        """Blocking per-connection loop used by serve_forever"""
+        conn.start()
         try:
-            # Receive username
-            data = client_socket.recv(1024).decode('utf-8')
-            message = json.loads(data)
-            
-            if message['type'] == 'login':
-                username = message['username']
-                
-                # Check if username already exists
-                with self.lock:
-                    if username in [u for u, _ in self.clients.values()]:
-                        client_socket.send(json.dumps({
-                            'type': 'error',
-                            'message': 'Username already taken'
-                        }).encode('utf-8'))
-                        client_socket.close()
-                        return
-                    
-                    self.clients[address] = (username, client_socket)
-                
-                # Send successful login
-                client_socket.send((json.dumps({
-                    'type': 'login_success',
-                    'message': f'Welcome to the chat, {username}!'
-                }) + '\n').encode('utf-8'))
-                
-                # Broadcast user joined (to other clients, not the new one)
-                self.broadcast({
-                    'type': 'user_joined',
-                    'username': username,
-                    'message': f'{username} joined the chat',
-                    'timestamp': datetime.now().strftime('%H:%M:%S')
-                }, exclude=address)
-                
-                # Send current user list
-                user_list = [u for u, _ in self.clients.values()]
-                client_socket.send((json.dumps({
-                    'type': 'user_list',
-                    'users': user_list
-                }) + '\n').encode('utf-8'))
-                
-                print(f"{username} connected from {address}")
-            
-            # Handle messages with buffer for partial/incomplete data
-            buffer = ""
+            # Frames are split out of the reader's buffer only once complete
             while True:
-                try:
-                    data = client_socket.recv(1024).decode('utf-8')
-                    if not data:
-                        break
-                    
-                    buffer += data
-                    
-                    # Process all complete messages in buffer (newline-delimited)
-                    while '\n' in buffer:
-                        line, buffer = buffer.split('\n', 1)
-                        line = line.strip()
-                        if not line:
-                            continue
-                        
-                        try:
-                            message = json.loads(line)
-                            if message['type'] == 'message':
-                                # Broadcast message to all clients (including sender)
-                                broadcast_msg = {
-                                    'type': 'message',
-                                    'username': username,
-                                    'message': message['message'],
-                                    'timestamp': datetime.now().strftime('%H:%M:%S')
-                                }
-                                self.broadcast(broadcast_msg)
-                                print(f"{username}: {message['message']}")
-                            elif message['type'] == 'disconnect':
-                                return  # Exit the while loop
-                        except json.JSONDecodeError as e:
-                            print(f"JSON decode error for {username}: {e}, line: {line[:50]}")
-                            continue
-                    
-                    # If buffer is getting too large, try to parse it anyway (backward compatibility)
-                    if len(buffer) > 0 and len(buffer) < 2048:  # Reasonable max size
-                        try:
-                            message = json.loads(buffer.strip())
-                            if message['type'] == 'message':
-                                broadcast_msg = {
-                                    'type': 'message',
-                                    'username': username,
-                                    'message': message['message'],
-                                    'timestamp': datetime.now().strftime('%H:%M:%S')
-                                }
-                                self.broadcast(broadcast_msg)
-                                print(f"{username}: {message['message']}")
-                            elif message['type'] == 'disconnect':
-                                return
-                            buffer = ""  # Clear buffer after successful parse
-                        except json.JSONDecodeError:
-                            # Partial message, keep in buffer for next recv
-                            pass
-                            
-                except (ConnectionResetError, ConnectionAbortedError):
+                frame = conn.next_frame()
+                if frame is None:
+                    break
+                if not self.receive(conn, frame):
                     break
-                    
-        except (ConnectionResetError, ConnectionAbortedError, json.JSONDecodeError):
+        except FrameTooLarge as e:
+            print(f"Closing {conn.address}: {e}")
+            conn.send({
+                'type': 'error',
+                'message': 'Message too large'
+            })
+        except (ConnectionResetError, ConnectionAbortedError):
+            pass
+        except OSError:
+            # Socket shut down underneath us (kick, ban or failed write)
             pass
         except Exception as e:
-            print(f"Error handling client {address}: {e}")
+            print(f"Error handling client {conn.address}: {e}")
         finally:
-            # Remove client and broadcast disconnect
-            if username:
-                with self.lock:
-                    if address in self.clients:
-                        del self.clients[address]
-                
-                self.broadcast({
-                    'type': 'user_left',
-                    'username': username,
-                    'message': f'{username} left the chat',
-                    'timestamp': datetime.now().strftime('%H:%M:%S')
+            self.disconnect(conn)
+    
+    def receive(self, conn, frame):
+        """Process one raw frame from a connection. Returns False when it should be closed."""
+        conn.frames_handled += 1
+        if conn.closed:
+            return False  # Kicked or shutting down; whatever it still sends is not relayed
+        try:
+            message = json.loads(frame)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            print(f"JSON decode error for {conn.username}: {e}, line: {frame[:50]}")
+            return True
+        if not isinstance(message, dict) or not isinstance(message.get('type'), str):
+            print(f"Invalid frame from {conn.username or conn.address}: {frame[:50]}")
+            conn.send({
+                'type': 'error',
+                'message': 'Invalid frame'
+            })
+            return True
+        
+        if conn.peer:
+            return self.federation.receive(conn.peer, message)
+        if conn.username is None:
+            if message.get('type') == 'peer_hello':
+                if conn.frames_handled > 1:
+                    # A peer link opens with its hello; this connection already spoke as a client
+                    print(f"Refusing peer_hello from {conn.address} after other frames")
+                    return False
+                return self.federation.accept(conn, message)
+            return self.login(conn, message)
+        return self.handle_frame(conn, message)
+    
+    def login(self, conn, message):
+        """Handle the first frame of a connection. Returns False if the login is refused."""
+        if message.get('type') != 'login':
+            return False
+        requested = message.get('username')
+        if not isinstance(requested, str) or not requested.strip():
+            conn.send({
+                'type': 'error',
+                'message': 'Invalid username'
+            })
+            return False
+        
+        # Check if username is banned or already exists
+        with self.lock:
+            error = None
+            if requested in self.banned_users:
+                error = 'You are banned from this server'
+            elif self.budget.exceeded():
+                error = 'Server is busy, please try again later'
+            elif requested in [c.username for c in self.clients.values()] or self.federation.has_user(requested):
+                error = 'Username already taken'
+            if error:
+                conn.send({
+                    'type': 'error',
+                    'message': error
                 })
-                
-                print(f"{username} disconnected from {address}")
+                return False
             
-            client_socket.close()
+            username = conn.username = requested
+            self.clients[conn.address] = conn
+            
+            # Send successful login
+            conn.send({
+                'type': 'login_success',
+                'message': f'Welcome to the chat, {username}!',
+                'epoch': self.epoch
+            })
+            
+            # Broadcast user joined (to other clients, not the new one)
+            joined = {
+                'type': 'user_joined',
+                'username': username,
+                'message': f'{username} joined the chat',
+                'timestamp': self.timestamp()
+            }
+            self.fan_out(joined, exclude=conn.address)
+            
+            # Send current user list (including users on peer servers). Its seq is the
+            # client's starting cursor; nothing can be broadcast in between while we hold the lock.
+            conn.send({
+                'type': 'user_list',
+                'users': [c.username for c in self.clients.values()] + self.federation.remote_usernames(),
+                'room': DEFAULT_ROOM,
+                'seq': self.room_seq.get(DEFAULT_ROOM, 0)
+            })
+            
+            # A returning client names the last seq it saw per room; replay what it missed,
+            # unless those numbers came from an earlier run of the server
+            since = message.get('since')
+            if isinstance(since, dict) and message.get('epoch', self.epoch) == self.epoch:
+                for room, seq in since.items():
+                    if isinstance(seq, int):
+                        self.send_replay(conn, room, seq + 1)
+        
+        self.federation.publish(joined)
+        
+        print(f"{username} connected from {conn.address}")
+        return True
+    
+    def disconnect(self, conn):
+        """Remove a connection and tell everyone else it left"""
+        if conn.peer:
+            self.federation.remove_link(conn.peer)
+            conn.close()
+            return
+        
+        with self.lock:
+            removed = self.clients.get(conn.address) is conn
+            if removed:
+                del self.clients[conn.address]
+        
+        if removed:
+            username = conn.username
+            self.presence.remove_user(username)
+            
+            left = {
+                'type': 'user_left',
+                'username': username,
+                'message': f'{username} left the chat',
+                'timestamp': self.timestamp()
+            }
+            self.broadcast(left)
+            self.federation.publish(left)
+            
+            print(f"{username} disconnected from {conn.address}")
+        
+        conn.close()
+    
+    def timestamp(self, seconds=None):
+        """Format a display timestamp from the server clock"""
+        return datetime.fromtimestamp(self.clock.time() if seconds is None else seconds).strftime('%H:%M:%S')
+    
+    def handle_frame(self, conn, message):
+        """Dispatch one frame from a logged-in client. Returns False on disconnect."""
+        username = conn.username
+        room = message.get('room', DEFAULT_ROOM)
+        if not isinstance(room, str) or (message['type'] == 'message' and not isinstance(message.get('message'), str)):
+            conn.send({
+                'type': 'error',
+                'message': f"Invalid {message['type']} request"
+            })
+            return True
+        if message['type'] in RATE_LIMITED_TYPES and not conn.limiter.allow():
+            conn.dropped += 1
+            if not conn.throttled:
+                # Tell the client once per burst rather than once per dropped frame
+                conn.throttled = True
+                conn.send({
+                    'type': 'error',
+                    'message': 'You are sending messages too fast. Please slow down.'
+                })
+            return True
+        conn.throttled = False
+        
+        if message['type'] == 'message':
+            # Broadcast message to all clients (including sender)
+            now = self.clock.time()
+            broadcast_msg = {
+                'type': 'message',
+                'username': username,
+                'message': message['message'],
+                'timestamp': self.timestamp(now)
+            }
+            self.broadcast(broadcast_msg)
+            self.federation.publish(broadcast_msg, now)
+            self.index.add(username, message['message'], now)
+            # Sending a message ends the sender's typing state
+            self.presence.update(room, username, False, now)
+            print(f"{username}: {message['message']}")
+        elif message['type'] == 'typing':
+            typing = {
+                'type': 'typing_update',
+                'room': room,
+                'username': username,
+                'typing': bool(message.get('typing', True))
+            }
+            self.presence.update(typing['room'], username, typing['typing'])
+            self.federation.publish(typing)
+        elif message['type'] == 'search':
+            self.handle_search(conn, message)
+        elif message['type'] == 'gap_fill':
+            self.handle_gap_fill(conn, message)
+        elif message['type'] == 'ack':
+            # Cumulative: the client has every frame in the room up to this seq
+            if isinstance(message.get('seq'), int) and message['seq'] > conn.acked.get(room, 0):
+                conn.acked[room] = message['seq']
+        elif message['type'] == 'disconnect':
+            return False
+        return True
+    
+    def handle_search(self, conn, message):
+        """Answer a search frame with matching messages from the history index"""
+        try:
+            limit = min(int(message.get('limit', 50)), 200)
+            results, complete = self.index.search(
+                query=message.get('query', ''),
+                username=message.get('username'),
+                since=message.get('since'),
+                until=message.get('until'),
+                limit=limit
+            )
+        except (AttributeError, TypeError, ValueError):
+            conn.send({
+                'type': 'error',
+                'message': 'Invalid search request'
+            })
+            return
+        
+        for result in results:
+            result['timestamp'] = datetime.fromtimestamp(result['ts']).strftime('%Y-%m-%d %H:%M:%S')
+        conn.send({
+            'type': 'search_results',
+            'query': message.get('query', ''),
+            'results': results,
+            'complete': complete
+        })
+    
+    def handle_gap_fill(self, conn, message):
+        """Resend buffered room frames a client reports missing ('from'..'to', inclusive)"""
+        try:
+            first = int(message['from'])
+            last = int(message['to']) if message.get('to') is not None else None
+        except (KeyError, TypeError, ValueError):
+            conn.send({
+                'type': 'error',
+                'message': 'Invalid gap_fill request'
+            })
+            return
+        with self.lock:
+            self.send_replay(conn, message.get('room', DEFAULT_ROOM), first, last)
+    
+    def send_replay(self, conn, room, first, last=None):
+        """Queue buffered frames first..last for one client, then a replay_done marker. Caller holds self.lock."""
+        current = self.room_seq.get(room, 0)
+        last = current if last is None else min(last, current)
+        buffered = self.replay.get(room, ())
+        oldest = buffered[0][0] if buffered else current + 1
+        # Sequence numbers in the buffer are contiguous, so the offset is a direct index
+        start = max(first, oldest)
+        for _, frame in islice(buffered, start - oldest, max(start - oldest, last - oldest + 1)):
+            conn.send_frame(frame)
+        conn.send({
+            'type': 'replay_done',
+            'room': room,
+            'from': first,
+            'to': last,
+            'lost': max(0, min(oldest, last + 1) - first),  # Too old to replay
+            'seq': current
+        })
+    
+    def apply_remote(self, event, ts):
+        """Apply an event replicated from a peer server to our own clients"""
+        event_type = event.get('type')
+        if event_type == 'typing_update':
+            self.presence.update(event['room'], event['username'], event['typing'])
+            return
+        
+        if event_type == 'user_left':
+            self.presence.remove_user(event['username'])
+        elif event_type == 'message':
+            now = ts if ts is not None else self.clock.time()
+            self.index.add(event['username'], event['message'], now)
+            # Sending a message ends the sender's typing state
+            self.presence.update(event.get('room', DEFAULT_ROOM), event['username'], False, now)
+            print(f"{event['username']} (remote): {event['message']}")
+        self.broadcast(event)
+    
+    def usernames(self):
+        """Everyone in the chat: local users first, then users on peer servers"""
+        with self.lock:
+            local = [c.username for c in self.clients.values()]
+        return local + self.federation.remote_usernames()
     
     def broadcast(self, message, exclude=None):
         """Broadcast message to all connected clients (optionally excluding sender)"""
-        message_json = json.dumps(message)
-        disconnected = []
+        with self.lock:
+            self.fan_out(message, exclude)
+    
+    def fan_out(self, message, exclude=None):
+        """Number a room frame, keep it for replay and queue it for every client. Caller holds self.lock."""
+        room = message.get('room', DEFAULT_ROOM)
+        # Typing updates are stale within seconds and the first thing to shed when memory runs
+        # short, so they stay outside the sequence: a burst of them must not use up seq numbers
+        # and replay slots, or push real messages out of the replay window. The same goes for
+        # directory updates, and a numbered user_list would be read as a login cursor
+        droppable = message['type'] in UNSEQUENCED_TYPES
+        if droppable:
+            frame = encode_frame(dict(message, room=room))
+        else:
+            # Numbering and queueing under one lock means every client sees a room's frames in seq order
+            seq = self.room_seq.get(room, 0) + 1
+            self.room_seq[room] = seq
+            # Encode once; each connection's writer thread does the actual send
+            frame = encode_frame(dict(message, room=room, seq=seq))
+            if room not in self.replay:
+                self.replay[room] = deque(maxlen=REPLAY_BUFFER)
+            self.replay[room].append((seq, frame))
         
+        for address, conn in self.clients.items():
+            if address != exclude:
+                conn.send_frame(frame, droppable)
+    
+    def connections(self):
+        """Snapshot of logged-in connections (cheap; safe to call from admin threads)"""
         with self.lock:
-            for address, (username, client_socket) in self.clients.items():
-                if address != exclude:
-                    try:
-                        # Send message with newline delimiter to help with parsing
-                        client_socket.send((message_json + '\n').encode('utf-8'))
-                    except:
-                        disconnected.append(address)
-            
-            # Remove disconnected clients
-            for address in disconnected:
-                if address in self.clients:
-                    del self.clients[address]
+            return list(self.clients.values())
+    
+    def find_connection(self, username):
+        with self.lock:
+            for conn in self.clients.values():
+                if conn.username == username:
+                    return conn
+        return None
+    
+    def kick(self, username, reason='You have been disconnected by an administrator'):
+        """Disconnect a user. Returns False if they are not connected."""
+        conn = self.find_connection(username)
+        if not conn:
+            return False
+        conn.send({'type': 'error', 'message': reason})
+        conn.close(linger=KICK_LINGER)
+        # Drop them now: a client that stopped reading keeps its threads busy until the linger runs out
+        self.disconnect(conn)
+        print(f"Kicked {username} ({reason})")
+        return True
+    
+    def ban(self, target):
+        """Ban a username or IP address and disconnect anyone matching it"""
+        conn = self.find_connection(target)
+        if conn:
+            self.banned_users.add(target)
+            self.banned_ips.add(conn.address[0])
+        else:
+            try:
+                ipaddress.ip_address(target)
+                self.banned_ips.add(target)
+            except ValueError:
+                self.banned_users.add(target)
+        
+        for conn in self.connections():
+            if conn.username in self.banned_users or conn.address[0] in self.banned_ips:
+                self.kick(conn.username, 'You are banned from this server')
+    
+    def unban(self, target):
+        """Lift a username or IP ban. Returns False if nothing matched."""
+        found = target in self.banned_users or target in self.banned_ips
+        self.banned_users.discard(target)
+        self.banned_ips.discard(target)
+        return found
+    
+    def set_rate_limit(self, rate, burst):
+        """Change the chat rate limit for current and future connections"""
+        self.rate_limit = (rate, burst)
+        for conn in self.connections():
+            conn.limiter.configure(rate, burst)
 
 if __name__ == '__main__':
-    server = ChatServer()
+    server = ChatServer(peer_secret=os.environ.get(PEER_SECRET_ENV))
     try:
         server.start()
     except KeyboardInterrupt:
@@ -0,0 +1,205 @@
+"""
+Deterministic in-process driver for ChatServer.
+
+Everything runs on the calling thread: the loopback transport replaces
+sockets, a SimulatedClock replaces wall time, and run_until_idle() pumps
+frames between virtual clients and the server in a fixed order. The same
+script therefore always produces the same frames in the same order, which
+makes throughput and ordering measurements repeatable.
+
+Faults can be injected on the way to the virtual clients: with `loss` or
+`reorder` set, each sequenced room frame is dropped or swapped with the
+next one with that probability, using a Random seeded from `seed`. Only
+sequenced frames are touched, since those are what a client can detect
+missing and recover with gap_fill.
+
+Example:
+    net = SimulatedNetwork()
+    alice = net.connect('alice')
+    bob = net.connect('bob')
+    net.run_until_idle()
+    alice.say('hi')
+    net.run_until_idle()
+    assert bob.messages()[-1]['message'] == 'hi'
+"""
+
+import io
+import json
+import queue
+import random
+from contextlib import nullcontext, redirect_stdout
+
+from protocol import FrameReader, FrameTooLarge, encode_frame
+from server import ChatServer
+from transport import LoopbackTransport, SimulatedClock
+
+CURSOR_TYPES = ('user_list', 'replay_done')  # Their seq is a room cursor, not a number of their own
+
+def sequenced(message):
+    """True for room frames numbered by the server's fan-out"""
+    return message.get('seq') is not None and message.get('type') not in CURSOR_TYPES
+
+class VirtualClient:
+    """A scripted client on the loopback transport"""
+    
+    def __init__(self, sock, username, faults=None):
+        self.socket = sock
+        self.socket.setblocking(False)
+        self.username = username
+        self.reader = FrameReader(sock)
+        self.faults = faults  # Callable applied to each batch of received messages
+        self.received = []  # Every message received, in arrival order
+        self.closed = False
+    
+    def send(self, message):
+        self.socket.sendall(encode_frame(message))
+    
+    def say(self, text):
+        self.send({'type': 'message', 'message': text})
+    
+    def disconnect(self):
+        self.send({'type': 'disconnect'})
+    
+    def poll(self):
+        """Collect whatever the server has delivered. Returns the number of new messages."""
+        frames, eof = self.reader.read_available()
+        messages = [json.loads(frame) for frame in frames]
+        if self.faults:
+            messages = self.faults(messages)
+        self.received.extend(messages)
+        if eof:
+            self.closed = True
+        return len(messages)
+    
+    def messages(self, msg_type='message'):
+        return [m for m in self.received if m.get('type') == msg_type]
+    
+    def missing(self, room='general', upto=None):
+        """Sequence numbers in `room` since login, up to `upto` (default: the highest received), that never arrived"""
+        start = next((m['seq'] for m in self.received if m.get('type') == 'user_list' and m.get('room') == room), 0)
+        seen = {m['seq'] for m in self.received if m.get('room') == room and sequenced(m)}
+        if upto is None:
+            upto = max(seen, default=start)
+        return sorted(set(range(start + 1, upto + 1)) - seen)
+    
+    def fill_gaps(self, room='general', upto=None):
+        """Ask the server to resend every missing frame in `room`, one gap_fill per run"""
+        missing = self.missing(room, upto)
+        runs = []
+        for seq in missing:
+            if runs and runs[-1][1] == seq - 1:
+                runs[-1][1] = seq
+            else:
+                runs.append([seq, seq])
+        for first, last in runs:
+            self.send({'type': 'gap_fill', 'room': room, 'from': first, 'to': last})
+        return len(missing)
+
+class SimulatedNetwork:
+    """A ChatServer plus any number of VirtualClients, stepped on one thread"""
+    
+    def __init__(self, quiet=True, loss=0.0, reorder=0.0, seed=0, **server_options):
+        server_options.setdefault('server_id', 'sim')
+        self.loss = loss
+        self.reorder = reorder
+        self.random = random.Random(seed)
+        self.clock = SimulatedClock()
+        self.transport = LoopbackTransport()
+        self.server = ChatServer('sim', 5555, history_path=None, admin_port=None,
+                                 transport=self.transport, clock=self.clock, **server_options)
+        self.quiet = quiet
+        self.connections = []  # Server-side connections, in accept order
+        self.clients = []
+        with self.output():
+            self.server.open(background=False)
+    
+    def output(self):
+        """Swallow the server's console logging unless quiet=False"""
+        return redirect_stdout(io.StringIO()) if self.quiet else nullcontext()
+    
+    def connect(self, username, login=True):
+        sock = self.transport.connect(self.server.host, self.server.port)
+        client = VirtualClient(sock, username, self.inject_faults if self.loss or self.reorder else None)
+        self.clients.append(client)
+        if login:
+            client.send({'type': 'login', 'username': username})
+        return client
+    
+    def inject_faults(self, messages):
+        """Drop and swap sequenced room frames at the configured rates"""
+        kept = [m for m in messages if not sequenced(m) or self.random.random() >= self.loss]
+        for i in range(len(kept) - 1):
+            if sequenced(kept[i]) and sequenced(kept[i + 1]) and self.random.random() < self.reorder:
+                kept[i], kept[i + 1] = kept[i + 1], kept[i]
+        return kept
+    
+    def accept_pending(self):
+        accepted = False
+        while True:
+            try:
+                sock, address = self.server.socket.accept_nowait()
+            except queue.Empty:
+                return accepted
+            sock.setblocking(False)
+            conn = self.server.accept(sock, address)
+            if conn:
+                self.connections.append(conn)
+            accepted = True
+    
+    def step(self):
+        """One deterministic pass over every connection. Returns (progressed, frames delivered)."""
+        progressed = self.accept_pending()
+        
+        for conn in list(self.connections):
+            try:
+                frames, eof = conn.read_available()
+            except FrameTooLarge:
+                conn.send({'type': 'error', 'message': 'Message too large'})
+                frames, eof = [], True
+            for frame in frames:
+                try:
+                    keep_open = self.server.receive(conn, frame)
+                except Exception as e:
+                    # As in handle_client: a frame that breaks the server closes its connection, not the run
+                    print(f"Error handling client {conn.address}: {e}")
+                    keep_open = False
+                if not keep_open:
+                    eof = True
+                    break
+            if eof:
+                self.server.disconnect(conn)
+                self.connections.remove(conn)
+            progressed = progressed or bool(frames) or eof
+        
+        self.server.index.drain()
+        
+        delivered = 0
+        for conn in list(self.connections):
+            try:
+                delivered += conn.flush()
+            except OSError:
+                # The virtual client went away; treat it like a reset
+                self.server.disconnect(conn)
+                self.connections.remove(conn)
+                progressed = True
+        
+        for client in self.clients:
+            client.poll()
+        return progressed or delivered > 0, delivered
+    
+    def run_until_idle(self, max_steps=100000):
+        """Pump frames until nothing moves. Returns the number of frames delivered."""
+        total = 0
+        with self.output():
+            for _ in range(max_steps):
+                progressed, delivered = self.step()
+                total += delivered
+                if not progressed:
+                    return total
+        raise RuntimeError("Simulation did not go idle")
+    
+    def advance(self, seconds):
+        """Move the simulated clock forward (firing timers) and settle the network"""
+        with self.output():
+            self.clock.advance(seconds)
+        return self.run_until_idle()
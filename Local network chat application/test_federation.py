@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Tests for linked chat servers, on the in-memory loopback transport
+"""
+
+import io
+import os
+import sys
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import MagicMock
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from client import ChatClient
+from server import ChatServer
+from simulation import VirtualClient
+from transport import LoopbackTransport
+
+SECRET = 'test peer secret'
+
+def wait_until(condition, clients, timeout=5.0):
+    """Poll the virtual clients until condition() holds"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for client in clients:
+            client.poll()
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError("Timed out waiting for the servers")
+
+class TestFederation(unittest.TestCase):
+    """Test cases for two peered ChatServers"""
+    
+    def setUp(self):
+        self.output = redirect_stdout(io.StringIO())
+        self.output.__enter__()
+        self.transport = LoopbackTransport()
+        self.servers = []
+        for server_id, port in (('a', 6001), ('b', 6002)):
+            server = ChatServer(server_id, port, history_path=None, admin_port=None, transport=self.transport,
+                                server_id=server_id, peer_secret=SECRET)
+            server.open()
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.servers.append(server)
+    
+    def tearDown(self):
+        self.output.__exit__(None, None, None)
+    
+    def connect(self, server, username):
+        client = VirtualClient(self.transport.connect(server.host, server.port), username)
+        client.send({'type': 'login', 'username': username})
+        return client
+    
+    def test_peering_leaves_no_gap(self):
+        """The user list sent when servers peer is not a numbered room frame, so clients see no gap"""
+        alice = self.connect(self.servers[0], 'alice')
+        bob = self.connect(self.servers[1], 'bob')
+        clients = [alice, bob]
+        wait_until(lambda: all(client.messages('user_list') for client in clients), clients)
+        alice.say('before peering')
+        wait_until(lambda: alice.messages(), clients)
+        
+        self.assertTrue(self.servers[0].federation.add_peer(self.servers[1].host, self.servers[1].port))
+        wait_until(lambda: all(len(client.messages('user_list')) == 2 for client in clients), clients)
+        for client in clients:
+            self.assertEqual(sorted(client.messages('user_list')[-1]['users']), ['alice', 'bob'])
+        
+        alice.say('after peering')
+        bob.say('hello alice')
+        wait_until(lambda: len(alice.messages()) == 3 and len(bob.messages()) == 2, clients)
+        for client in clients:
+            self.assertEqual(client.missing(), [])
+            # Replay what arrived through the real client's sequence tracking
+            tracker = ChatClient()
+            tracker.network = MagicMock()
+            for message in client.received:
+                tracker.track_sequence(message)
+            self.assertFalse(tracker.missing.get('general'))
+            tracker.network.send.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
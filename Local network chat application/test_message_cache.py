@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Tests for the client's on-disk message cache
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import message_cache
+from message_cache import CacheWriter, MessageCache
+
+class TestMessageCache(unittest.TestCase):
+    """Test cases for MessageCache and RoomCache"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def open(self):
+        return MessageCache('192.168.1.10', 5555, directory=self.temp_dir)
+    
+    def fill(self, room, count, first_seq=1):
+        for seq in range(first_seq, first_seq + count):
+            room.append(seq, {'seq': seq, 'username': 'alice', 'message': f'message {seq} ' + 'x' * 100})
+    
+    def test_similar_room_names_kept_apart(self):
+        """Room names that sanitize to the same filename keep their own logs and cursors"""
+        cache = self.open()
+        self.fill(cache.room('team/a'), 3)
+        cache.room('team/a').set_cursor(1, 3)
+        self.fill(cache.room('team:a'), 5)
+        cache.room('team:a').set_cursor(1, 5)
+        cache.close()
+        
+        cache = self.open()
+        self.assertEqual(cache.resume_point(), (1, {'team/a': 3, 'team:a': 5}))
+        self.assertEqual(len(cache.room('team/a').page()[0]), 3)
+        self.assertEqual(len(cache.room('team:a').page()[0]), 5)
+        cache.close()
+    
+    def test_compacts_over_size_limit(self):
+        """A log over MAX_ROOM_BYTES is cut to the newest messages when the room is next opened"""
+        original = message_cache.MAX_ROOM_BYTES
+        message_cache.MAX_ROOM_BYTES = 64 * 1024
+        try:
+            cache = self.open()
+            room = cache.room('general')
+            self.fill(room, 1000)
+            room.set_cursor(1, 1000)
+            cache.close()
+            
+            cache = self.open()
+            room = cache.room('general')
+            log_path, _ = room.files(room.generation)
+            self.assertLessEqual(os.path.getsize(log_path), 64 * 1024 * message_cache.COMPACT_RATIO)
+            messages, start = room.page(limit=10000)
+            self.assertEqual(start, 0)
+            self.assertEqual(messages[-1]['seq'], 1000)
+            self.assertEqual([m['seq'] for m in messages], list(range(1001 - len(messages), 1001)))
+            self.assertEqual(cache.resume_point(), (1, {'general': 1000}))
+            self.assertEqual(len(os.listdir(self.temp_dir)), 3)  # Only the current generation is left
+            # New messages still go into the compacted log
+            self.fill(room, 1, 1001)
+            self.assertEqual(room.page(limit=1)[0][0]['seq'], 1001)
+            cache.close()
+        finally:
+            message_cache.MAX_ROOM_BYTES = original
+    
+    def test_compacts_old_messages(self):
+        """Messages older than MAX_AGE are dropped, newer ones kept"""
+        cache = self.open()
+        room = cache.room('general')
+        self.fill(room, 10)
+        room.compact(now=time.time() + message_cache.MAX_AGE + 60)
+        self.assertEqual(room.count, 0)
+        self.fill(room, 5, 11)
+        self.assertEqual([m['seq'] for m in room.page()[0]], [11, 12, 13, 14, 15])
+        cache.close()
+    
+    def test_writer_keeps_disk_off_the_caller(self):
+        """CacheWriter opens new rooms and writes on its own thread; close() waits for what was queued"""
+        cache = self.open()
+        cache.room('general')
+        writer = CacheWriter(cache)
+        opened_on = []
+        open_room = cache.open_room
+        
+        def record_thread(name):
+            opened_on.append(threading.current_thread())
+            return open_room(name)
+        
+        with patch.object(cache, 'open_room', side_effect=record_thread):
+            for seq in range(1, 101):
+                writer.append('general', seq, {'seq': seq, 'message': f'message {seq}'})
+            writer.append('random', 1, {'seq': 1, 'message': 'elsewhere'})
+            writer.set_cursor('general', 7, 100)
+            writer.set_cursor('random', 7, 1)
+            writer.close()
+        self.assertEqual(opened_on, [writer.thread])
+        
+        cache = self.open()
+        self.assertEqual(cache.resume_point(), (7, {'general': 100, 'random': 1}))
+        writer = CacheWriter(cache)
+        messages, start = writer.page('general')
+        self.assertEqual([m['seq'] for m in messages], list(range(51, 101)))
+        self.assertEqual(writer.page('general', start)[0][0]['seq'], 1)
+        writer.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Tests for the chat history search index
+"""
+
+import os
+import random
+import sys
+import time
+import unittest
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from search_index import MessageIndex, tokenize
+
+class TestMessageIndex(unittest.TestCase):
+    """Test cases for MessageIndex.search"""
+    
+    def build(self, lines):
+        index = MessageIndex(None)
+        for i, (username, text) in enumerate(lines):
+            index.index_message(username, text, 1000 + i)
+        return index
+    
+    def brute_force(self, lines, query, username=None, since=None, limit=50):
+        tokens = set(tokenize(query))
+        matches = []
+        for i in range(len(lines) - 1, -1, -1):
+            user, text = lines[i]
+            if since is not None and 1000 + i < since:
+                continue
+            if username and user.lower() != username.lower():
+                continue
+            if tokens <= set(tokenize(text)):
+                matches.append(text)
+        return matches[:limit]
+    
+    def test_matches_brute_force(self):
+        """Keyword, user and time filters agree with a linear scan"""
+        rng = random.Random(7)
+        words = ['alpha', 'beta', 'gamma', 'delta', 'lunch', 'the']
+        lines = [(f'user{rng.randrange(5)}', ' '.join(rng.sample(words, 3))) for _ in range(3000)]
+        index = self.build(lines)
+        for query, username, since in [
+            ('alpha', None, None),
+            ('alpha beta', None, None),
+            ('alpha beta gamma', 'user2', None),
+            ('lunch the', None, 2500),
+            ('', 'user4', 3000),
+            ('missing', None, None),
+        ]:
+            results, complete = index.search(query, username, since, limit=40)
+            self.assertTrue(complete)
+            self.assertEqual([r['message'] for r in results], self.brute_force(lines, query, username, since, 40))
+    
+    def test_sparse_intersection_is_bounded(self):
+        """Common keywords that never meet stop after the step budget instead of scanning everything"""
+        lines = [('user', 'odd' if i % 2 else 'even') for i in range(200000)]
+        index = self.build(lines)
+        start = time.perf_counter()
+        results, complete = index.search('odd even')
+        elapsed = time.perf_counter() - start
+        self.assertEqual(results, [])
+        self.assertFalse(complete)
+        self.assertLess(elapsed, 0.1)
+    
+    def test_clustered_keywords_skip_runs(self):
+        """A match far back is found by skipping whole runs, without using up the budget"""
+        lines = [('user', 'deploy')] * 50000 + [('user', 'deploy rollback')] + [('user', 'rollback')] * 50000
+        index = self.build(lines)
+        results, complete = index.search('deploy rollback', max_steps=10)
+        self.assertTrue(complete)
+        self.assertEqual([r['message'] for r in results], ['deploy rollback'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Tests for the chat server on real sockets, where a client can stop reading
+"""
+
+import io
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import server
+from protocol import FrameReader, encode_frame
+from server import ChatServer
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError("Timed out waiting for the server")
+
+class TestKick(unittest.TestCase):
+    """Test cases for kicking clients"""
+    
+    def setUp(self):
+        self.output = redirect_stdout(io.StringIO())
+        self.output.__enter__()
+        self.server = ChatServer('127.0.0.1', 0, history_path=None, admin_port=None)
+        self.server.open()
+        self.port = self.server.socket.getsockname()[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.sockets = []
+    
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+        wait_until(lambda: not self.server.connections())
+        self.output.__exit__(None, None, None)
+    
+    def login(self, username):
+        sock = socket.create_connection(('127.0.0.1', self.port))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.sendall(encode_frame({'type': 'login', 'username': username}))
+        self.sockets.append(sock)
+        wait_until(lambda: self.server.find_connection(username))
+        return sock
+    
+    def test_kick_client_that_stopped_reading(self):
+        """A kicked client whose writer is stuck leaves the chat at once, and its socket is shut down"""
+        watcher = self.login('watcher')
+        stuck = self.login('stuck')
+        conn = self.server.find_connection('stuck')
+        # Fill the socket buffers; 'stuck' never reads, so the writer blocks in sendall
+        conn.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        conn.send_frame(b'x' * (512 * 1024) + b'\n')
+        wait_until(lambda: conn.outbound.empty())
+        time.sleep(0.2)
+        self.assertTrue(conn.writer.is_alive())
+        
+        with patch.object(server, 'KICK_LINGER', 0.5):
+            self.assertTrue(self.server.kick('stuck'))
+        self.assertNotIn('stuck', self.server.usernames())
+        stuck.sendall(encode_frame({'type': 'message', 'message': 'still here'}))
+        
+        conn.writer.join(5)
+        self.assertFalse(conn.writer.is_alive())
+        self.assertTrue(conn.released)
+        
+        watcher.settimeout(1.0)
+        reader = FrameReader(watcher)
+        received = []
+        try:
+            while True:
+                frame = reader.next_frame()
+                if frame is None:
+                    break
+                received.append(json.loads(frame))
+        except socket.timeout:
+            pass
+        self.assertIn('user_left', [m['type'] for m in received])
+        self.assertNotIn('still here', [m.get('message') for m in received])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Tests for the chat server, driven through the deterministic simulated network
+"""
+
+import os
+import sys
+import unittest
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulation import SimulatedNetwork
+
+def chat(net, clients, rounds):
+    """Every client says one line per round, with a simulated second between rounds"""
+    for round_number in range(rounds):
+        for client in clients:
+            client.say(f'{client.username} round {round_number}')
+        net.advance(1.0)
+
+class TestSimulatedNetwork(unittest.TestCase):
+    """Test cases for ChatServer on the simulated network"""
+    
+    def run_scenario(self, seed, loss=0.0, reorder=0.0):
+        net = SimulatedNetwork(loss=loss, reorder=reorder, seed=seed)
+        clients = [net.connect(f'user{i}') for i in range(5)]
+        net.run_until_idle()
+        chat(net, clients, 10)
+        return net, clients
+    
+    def test_same_seed_same_frames(self):
+        """Two runs of one seeded scenario deliver identical frames to every client"""
+        first = [c.received for c in self.run_scenario(seed=3, loss=0.1, reorder=0.1)[1]]
+        second = [c.received for c in self.run_scenario(seed=3, loss=0.1, reorder=0.1)[1]]
+        self.assertEqual(first, second)
+        other = [c.received for c in self.run_scenario(seed=4, loss=0.1, reorder=0.1)[1]]
+        self.assertNotEqual(first, other)
+    
+    def test_every_client_sees_one_order(self):
+        """Without faults, every client receives the chat in the same seq order"""
+        _, clients = self.run_scenario(seed=0)
+        orders = {tuple((m['seq'], m['message']) for m in c.messages()) for c in clients}
+        self.assertEqual(len(orders), 1)
+        seqs = [seq for seq, _ in orders.pop()]
+        self.assertEqual(seqs, sorted(seqs))
+        self.assertEqual(len(seqs), 50)
+    
+    def test_loss_recovered_by_gap_fill(self):
+        """Frames dropped on the way to clients are detected from seq and resent on gap_fill"""
+        net, clients = self.run_scenario(seed=1, loss=0.2)
+        last = net.server.room_seq['general']
+        self.assertTrue(all(c.missing(upto=last) for c in clients))
+        # Resent frames can be lost too, so keep asking until nothing is missing
+        for _ in range(20):
+            if not sum(c.fill_gaps(upto=last) for c in clients):
+                break
+            net.advance(1.0)
+        lines = {f'user{i} round {r}' for i in range(5) for r in range(10)}
+        for client in clients:
+            self.assertEqual(client.missing(upto=last), [])
+            self.assertEqual({m['message'] for m in client.messages()}, lines)
+    
+    def test_reorder_restored_by_seq(self):
+        """Swapped frames arrive out of order but sort back into the server's order"""
+        net, clients = self.run_scenario(seed=2, reorder=0.3)
+        reference = [(m['seq'], m['message']) for m in clients[0].messages()]
+        shuffled = False
+        for client in clients:
+            received = [(m['seq'], m['message']) for m in client.messages()]
+            shuffled = shuffled or received != sorted(received)
+            self.assertEqual(sorted(received), sorted(reference))
+        self.assertTrue(shuffled)
+    
+    def test_typing_is_not_sequenced(self):
+        """Typing updates reach clients without using up seq numbers or replay slots"""
+        net = SimulatedNetwork()
+        alice, bob = net.connect('alice'), net.connect('bob')
+        net.run_until_idle()
+        alice.say('before')
+        net.run_until_idle()
+        seq = net.server.room_seq['general']
+        for i in range(30):
+            alice.send({'type': 'typing', 'typing': i % 2 == 0})
+            net.advance(1.0)
+        typing = bob.messages('typing')
+        self.assertTrue(typing)
+        self.assertTrue(all('seq' not in m for m in typing))
+        self.assertEqual(net.server.room_seq['general'], seq)
+        self.assertEqual(len(net.server.replay['general']), seq)
+        alice.say('after')
+        net.run_until_idle()
+        self.assertEqual(bob.messages()[-1]['seq'], seq + 1)
+        self.assertEqual(bob.missing(), [])
+    
+    def test_malformed_frames_get_errors(self):
+        """Frames without a type, non-object JSON and bad fields are answered with errors, not a crash"""
+        net = SimulatedNetwork()
+        alice, bob = net.connect('alice'), net.connect('bob')
+        net.run_until_idle()
+        for frame in (b'{}\n', b'[1, 2]\n', b'"hello"\n', b'42\n', b'{"type": null}\n',
+                      b'{"type": "message"}\n', b'{"type": "message", "message": ["x"]}\n',
+                      b'{"type": "typing", "room": {"a": 1}}\n', b'{"type": "search", "query": 5}\n',
+                      b'{"type": "gap_fill", "from": "x"}\n', b'{"type": "ack", "seq": "x"}\n'):
+            alice.socket.sendall(frame)
+            net.advance(1.0)
+        alice.say('still here')
+        net.run_until_idle()
+        self.assertFalse(alice.closed)
+        self.assertEqual(len(alice.messages('error')), 10)
+        self.assertEqual(bob.messages()[-1]['message'], 'still here')
+    
+    def test_malformed_login_is_refused(self):
+        """A login frame without a usable username closes only that connection"""
+        net = SimulatedNetwork()
+        bob = net.connect('bob')
+        bad = net.connect('bad', login=False)
+        bad.send({'type': 'login'})
+        net.run_until_idle()
+        self.assertTrue(bad.closed)
+        self.assertEqual(bad.messages('error')[0]['message'], 'Invalid username')
+        bob.say('hello')
+        net.run_until_idle()
+        self.assertEqual(bob.messages()[-1]['message'], 'hello')
+
+if __name__ == '__main__':
+    unittest.main()
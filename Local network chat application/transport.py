@@ -0,0 +1,186 @@
+import heapq
+import queue
+import socket
+import threading
+import time
+
+class Clock:
+    """Real time, with periodic callbacks run on background threads"""
+    
+    def time(self):
+        return time.time()
+    
+    def monotonic(self):
+        return time.monotonic()
+    
+    def every(self, interval, callback):
+        """Call `callback()` every `interval` seconds until the process exits"""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"Error in periodic task {getattr(callback, '__name__', callback)}: {e}")
+        threading.Thread(target=run, daemon=True).start()
+
+class SimulatedClock:
+    """Manually advanced clock. Periodic callbacks fire inside `advance`, in due order."""
+    
+    def __init__(self, start=1700000000.0):
+        self.now = start
+        self.timers = []  # heap of (due, sequence, interval, callback)
+        self.sequence = 0
+    
+    def time(self):
+        return self.now
+    
+    def monotonic(self):
+        return self.now
+    
+    def every(self, interval, callback):
+        self.sequence += 1
+        heapq.heappush(self.timers, (self.now + interval, self.sequence, interval, callback))
+    
+    def advance(self, seconds):
+        """Move time forward, running every timer that falls due on the way"""
+        target = self.now + seconds
+        while self.timers and self.timers[0][0] <= target:
+            due, sequence, interval, callback = heapq.heappop(self.timers)
+            self.now = due
+            callback()
+            heapq.heappush(self.timers, (due + interval, sequence, interval, callback))
+        self.now = target
+
+class SocketTransport:
+    """TCP sockets (the default transport)"""
+    
+    def listen(self, host, port):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, port))
+        listener.listen()
+        return listener
+    
+    def connect(self, host, port, timeout=None):
+        return socket.create_connection((host, port), timeout)
+
+class LoopbackSocket:
+    """One end of an in-memory stream connection with the socket methods the chat code uses"""
+    
+    def __init__(self, local_address, peer_address):
+        self.local_address = local_address
+        self.peer_address = peer_address
+        self.peer = None
+        self.inbound = bytearray()
+        self.condition = threading.Condition()
+        self.eof = False      # Peer will send nothing more
+        self.closed = False   # We may not send any more
+        self.timeout = None   # None blocks forever, 0.0 is non-blocking
+    
+    def settimeout(self, timeout):
+        self.timeout = timeout
+    
+    def setblocking(self, flag):
+        self.timeout = None if flag else 0.0
+    
+    def getpeername(self):
+        return self.peer_address
+    
+    def getsockname(self):
+        return self.local_address
+    
+    def pending(self):
+        """Bytes waiting to be received"""
+        return len(self.inbound)
+    
+    def recv_into(self, buffer, nbytes=0):
+        with self.condition:
+            while not self.inbound and not self.eof:
+                if self.timeout == 0.0:
+                    raise BlockingIOError("No data available")
+                if not self.condition.wait(self.timeout):
+                    raise socket.timeout("timed out")
+            n = min(nbytes or len(buffer), len(self.inbound))
+            buffer[:n] = self.inbound[:n]
+            del self.inbound[:n]
+            return n
+    
+    def recv(self, bufsize):
+        data = bytearray(bufsize)
+        n = self.recv_into(data)
+        return bytes(data[:n])
+    
+    def sendall(self, data):
+        if self.closed or self.peer.eof:
+            raise BrokenPipeError("Loopback connection closed")
+        self.peer.deliver(data)
+    
+    def send(self, data):
+        self.sendall(data)
+        return len(data)
+    
+    def deliver(self, data):
+        with self.condition:
+            self.inbound += data
+            self.condition.notify_all()
+    
+    def hang_up(self):
+        with self.condition:
+            self.eof = True
+            self.condition.notify_all()
+    
+    def shutdown(self, how):
+        self.closed = True
+        self.peer.hang_up()
+        if how in (socket.SHUT_RD, socket.SHUT_RDWR):
+            self.hang_up()
+    
+    def close(self):
+        self.shutdown(socket.SHUT_RDWR)
+
+def loopback_pair(address_a, address_b):
+    """Create two connected LoopbackSockets"""
+    a = LoopbackSocket(address_a, address_b)
+    b = LoopbackSocket(address_b, address_a)
+    a.peer, b.peer = b, a
+    return a, b
+
+class LoopbackListener:
+    """Listening end of the loopback transport"""
+    
+    def __init__(self, address):
+        self.address = address
+        self.pending = queue.Queue()
+    
+    def accept(self):
+        return self.pending.get()
+    
+    def accept_nowait(self):
+        return self.pending.get_nowait()
+    
+    def close(self):
+        pass
+
+class LoopbackTransport:
+    """In-memory transport: no file descriptors, no kernel buffers, no real network"""
+    
+    def __init__(self):
+        self.listeners = {}
+        self.next_port = 40000
+    
+    def listen(self, host, port):
+        listener = LoopbackListener((host, port))
+        self.listeners[port] = listener
+        return listener
+    
+    def connect(self, host, port, timeout=None):
+        listener = self.listeners.get(port)
+        if listener is None:
+            raise ConnectionRefusedError(f"Nothing listening on loopback port {port}")
+        self.next_port += 1
+        client_address = ('127.0.0.1', self.next_port)
+        client, server = loopback_pair(client_address, listener.address)
+        client.settimeout(timeout)
+        listener.pending.put((server, client_address))
+        return client
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the password manager's hot paths.
+
+Run with:  python benchmark.py
+"""
+
+import random
+import string
+import time
+
+from cryptography.fernet import Fernet
+from ciphers import RowCipher
+from password_utils import PasswordGenerator, SYMBOLS
+
+def legacy_generate(length=16):
+    """The generator used before the secrets-based one: one random.choice per character"""
+    characters = string.ascii_lowercase + string.ascii_uppercase + string.digits + SYMBOLS
+    return ''.join(random.choice(characters) for _ in range(length))
+
+def best_time(func, repeat=3):
+    """Fastest of a few runs, in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def benchmark_generate(count=20000, length=16):
+    print(f"Password generation: {count} passwords of {length} characters (passphrases: 6 words)")
+    print(f"{'':<32} {'ms':>9} {'per second':>12}")
+    runs = [
+        ("random.choice per character", lambda: [legacy_generate(length) for _ in range(count)]),
+        ("secrets, generate() each", lambda: [PasswordGenerator.generate(length) for _ in range(count)]),
+        ("secrets, generate_many()", lambda: PasswordGenerator.generate_many(count, length)),
+        ("secrets, passphrases()", lambda: PasswordGenerator.passphrases(count)),
+    ]
+    for name, func in runs:
+        elapsed = best_time(func)
+        print(f"{name:<32} {elapsed * 1000:>9.1f} {count / elapsed:>12.0f}")
+
+def benchmark_ciphers(count=20000, length=16):
+    """Row decryption throughput and stored size for cipher version 1 (Fernet) and 2 (AES-GCM)"""
+    data_key = Fernet.generate_key()
+    fernet = Fernet(data_key)
+    cipher = RowCipher(data_key)
+    passwords = PasswordGenerator.generate_many(count, length)
+    formats = [
+        ("v1 Fernet (TEXT)", [fernet.encrypt(password.encode()).decode() for password in passwords]),
+        ("v2 AES-GCM (BLOB)", [cipher.encrypt(password, 'password_encrypted') for password in passwords]),
+    ]
+    print(f"Row ciphers: {count} passwords of {length} characters")
+    print(f"{'':<20} {'bytes/row':>10} {'decrypt ms':>11} {'rows/s':>10}")
+    for name, values in formats:
+        size = sum(len(value) for value in values) / count
+        elapsed = best_time(lambda: [cipher.decrypt(value, 'password_encrypted') for value in values])
+        print(f"{name:<20} {size:>10.0f} {elapsed * 1000:>11.1f} {count / elapsed:>10.0f}")
+
+if __name__ == '__main__':
+    benchmark_generate()
+    print()
+    benchmark_ciphers()
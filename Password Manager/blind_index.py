@@ -0,0 +1,79 @@
+"""
+Keyed search tokens for encrypted site names and usernames.
+
+With metadata encryption on, the database holds no readable website or
+username. Instead each entry gets a set of tokens, HMAC-SHA256 under a key
+derived from the vault's data key, one per prefix of each word of its
+normalized domain and username. Searching a word means computing its two
+tokens (as a site word and as a username word) and looking them up in an
+indexed table, so search stays a B-tree lookup without decrypting rows.
+
+Without the key the tokens reveal only which entries share a word prefix
+(and roughly how long their words are), not what the words are.
+"""
+
+import hashlib
+import hmac
+import re
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+TOKEN_SIZE = 16    # Bytes of each HMAC kept; plenty to make accidental matches negligible
+MIN_PREFIX = 2     # Shorter query words are checked after decryption instead
+MAX_PREFIX = 12    # Words are indexed up to this many characters; longer queries are refined after decryption
+
+WORD_SPLIT = re.compile(r'[\W_]+')
+
+def normalize_site(website):
+    """'https://www.GitHub.com:443/login' -> 'github.com'. Text that is not a URL is just lowercased."""
+    site = website.strip().lower()
+    site = re.sub(r'^[a-z][a-z0-9+.-]*://', '', site)
+    site = re.split(r'[/?#]', site, maxsplit=1)[0]
+    site = site.rsplit('@', 1)[-1]
+    site = re.sub(r':\d+$', '', site)
+    if site.startswith('www.'):
+        site = site[4:]
+    return site or website.strip().lower()
+
+def words(text):
+    return [word for word in WORD_SPLIT.split(text.lower()) if word]
+
+def site_words(website):
+    return words(normalize_site(website))
+
+def query_words(query):
+    """The words an entry must all match (each as a prefix of one of its words)"""
+    result = []
+    for part in query.split():
+        result.extend(site_words(part) if '/' in part else words(part))
+    return result
+
+def matches(entry, query):
+    """Whether a decrypted entry matches a query, by the same rule the index uses"""
+    entry_words = site_words(entry['website']) + words(entry['username'])
+    return all(any(word.startswith(q) for word in entry_words) for q in query_words(query))
+
+class BlindIndex:
+    """Computes the search tokens for one vault"""
+    
+    def __init__(self, data_key):
+        hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b'password-manager blind index')
+        self.key = hkdf.derive(data_key)
+    
+    def token(self, kind, term):
+        digest = hmac.new(self.key, f'{kind}:{term}'.encode(), hashlib.sha256).digest()
+        return digest[:TOKEN_SIZE]
+    
+    def entry_tokens(self, website, username):
+        """Tokens for every indexed prefix of the entry's site and username words"""
+        tokens = set()
+        for kind, terms in (('site', site_words(website)), ('user', words(username))):
+            for term in terms:
+                for length in range(MIN_PREFIX, min(len(term), MAX_PREFIX) + 1):
+                    tokens.add(self.token(kind, term[:length]))
+        return tokens
+    
+    def word_tokens(self, word):
+        """An entry has one of these tokens if the word prefixes one of its site or username words"""
+        word = word[:MAX_PREFIX]
+        return [self.token('site', word), self.token('user', word)]
@@ -0,0 +1,234 @@
+"""
+Offline breached-password checks against a local copy of the Have I Been
+Pwned SHA-1 password list.
+
+`python breach.py build SOURCE` converts a download into a compact binary
+corpus. SOURCE is either the full "ordered by hash" text file (lines of
+HASH:COUNT) or a directory of range files as written by the HIBP
+downloader (files named by a 5-hex-digit prefix, lines of SUFFIX:COUNT).
+Either way the hashes arrive sorted, so the corpus is written in one
+streaming pass.
+
+Corpus layout: a header, a fan-out table of 65537 offsets (record index
+of the first hash starting with each 2-byte prefix), then fixed 24-byte
+records (20-byte SHA-1, 4-byte big-endian count). The file is memory
+mapped; a lookup is a binary search inside one fan-out bucket, so only a
+handful of pages are touched. `--bloom` also writes a Bloom filter that
+answers most "not breached" lookups without touching the corpus at all.
+"""
+
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+CORPUS_FILE = 'breach_corpus.bin'
+MAGIC = b'PWNDSHA1'
+BLOOM_MAGIC = b'PWNDBLOM'
+HEADER = struct.Struct('<8sQ')        # magic, record count
+BLOOM_HEADER = struct.Struct('<8sQI')  # magic, bits, hash functions
+FANOUT_SIZE = 65537
+DIGEST_SIZE = 20
+RECORD = struct.Struct('>20sI')
+DATA_OFFSET = HEADER.size + FANOUT_SIZE * 8
+
+BLOOM_BITS_PER_ENTRY = 10  # About a 1% false positive rate
+BLOOM_HASHES = 7
+
+class BloomFilter:
+    """Memory-mapped Bloom filter over SHA-1 digests (the digest bits are already uniform)"""
+    
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.bits, self.hashes = BLOOM_HEADER.unpack_from(self.map)
+        if magic != BLOOM_MAGIC:
+            raise ValueError(f"{path} is not a breach Bloom filter")
+    
+    @staticmethod
+    def positions(digest, bits, hashes):
+        # Double hashing from two independent 64-bit slices of the digest
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + i * h2) % bits for i in range(hashes)]
+    
+    def might_contain(self, digest):
+        for position in self.positions(digest, self.bits, self.hashes):
+            if not self.map[BLOOM_HEADER.size + position // 8] & (1 << (position % 8)):
+                return False
+        return True
+    
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+class BreachCorpus:
+    """Looks up how often a password appears in the breach corpus"""
+    
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a breach corpus; build one with breach.py build")
+        self.fanout = array('Q', self.map[HEADER.size:DATA_OFFSET])
+        if sys.byteorder != 'little':
+            self.fanout.byteswap()
+        bloom_path = path + '.bloom'
+        self.bloom = BloomFilter(bloom_path) if os.path.exists(bloom_path) else None
+    
+    def occurrences(self, password):
+        """Times the password was seen in breaches (0 if never)"""
+        return self.occurrences_of_hash(hashlib.sha1(password.encode('utf-8')).digest())
+    
+    def occurrences_of_hash(self, digest):
+        if self.bloom and not self.bloom.might_contain(digest):
+            return 0
+        bucket = int.from_bytes(digest[:2], 'big')
+        lo, hi = self.fanout[bucket], self.fanout[bucket + 1]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = DATA_OFFSET + mid * RECORD.size
+            found = self.map[offset:offset + DIGEST_SIZE]
+            if found < digest:
+                lo = mid + 1
+            elif found > digest:
+                hi = mid
+            else:
+                return RECORD.unpack_from(self.map, offset)[1]
+        return 0
+    
+    def close(self):
+        if self.bloom:
+            self.bloom.close()
+        self.map.close()
+        self.file.close()
+
+def load_corpus(path=CORPUS_FILE):
+    """The corpus at `path`, or None if none has been built"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return BreachCorpus(path)
+    except (OSError, ValueError) as e:
+        print(f"Breach corpus unavailable: {e}")
+        return None
+
+def audit_vault(db, corpus, progress=None):
+    """Every decryptable entry whose password is in the corpus, as (entry, occurrences), worst first"""
+    entries = db.get_all_passwords()
+    counts = {}
+    breached = []
+    for done, entry in enumerate(entries, 1):
+        password = entry['password']
+        if password not in counts:
+            counts[password] = corpus.occurrences(password)
+        if counts[password]:
+            breached.append(({key: value for key, value in entry.items() if key != 'password'}, counts[password]))
+        if progress and done % 100 == 0:
+            progress(done, len(entries))
+    breached.sort(key=lambda item: -item[1])
+    return breached
+
+def read_source(source):
+    """Yield (digest, count) in hash order from a HIBP text file or range directory"""
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            prefix = name.split('.')[0].upper()
+            if len(prefix) != 5:
+                continue
+            with open(os.path.join(source, name), encoding='ascii') as f:
+                for line in f:
+                    yield parse_line(prefix + line)
+    else:
+        with open(source, encoding='ascii') as f:
+            for line in f:
+                yield parse_line(line)
+
+def parse_line(line):
+    digest, _, count = line.strip().partition(':')
+    return bytes.fromhex(digest), int(count or 1)
+
+def build_corpus(source, output=CORPUS_FILE, bloom=False):
+    """Write a corpus (and optionally its Bloom filter) from a sorted HIBP download. Returns the record count."""
+    buckets = array('Q', bytes(8 * FANOUT_SIZE))
+    count = 0
+    previous = b''
+    tmp_path = output + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(bytes(DATA_OFFSET))
+            for digest, occurrences in read_source(source):
+                if len(digest) != DIGEST_SIZE:
+                    continue
+                if digest <= previous:
+                    raise ValueError("The source must be sorted by hash (use the 'ordered by hash' download)")
+                f.write(RECORD.pack(digest, min(occurrences, 0xFFFFFFFF)))
+                buckets[int.from_bytes(digest[:2], 'big') + 1] += 1
+                previous = digest
+                count += 1
+            
+            # Fan-out entries are the running totals of the bucket sizes
+            for i in range(1, FANOUT_SIZE):
+                buckets[i] += buckets[i - 1]
+            if sys.byteorder != 'little':
+                buckets.byteswap()
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, count))
+            f.write(buckets.tobytes())
+        os.replace(tmp_path, output)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    
+    if bloom:
+        build_bloom(output, count)
+    elif os.path.exists(output + '.bloom'):
+        os.remove(output + '.bloom')  # Built for an older corpus
+    return count
+
+def build_bloom(corpus_path, count):
+    bits = max(8, count * BLOOM_BITS_PER_ENTRY)
+    filter_bits = bytearray((bits + 7) // 8)
+    with open(corpus_path, 'rb') as f:
+        f.seek(DATA_OFFSET)
+        while True:
+            chunk = f.read(RECORD.size * 4096)
+            if not chunk:
+                break
+            for offset in range(0, len(chunk), RECORD.size):
+                digest = chunk[offset:offset + DIGEST_SIZE]
+                for position in BloomFilter.positions(digest, bits, BLOOM_HASHES):
+                    filter_bits[position // 8] |= 1 << (position % 8)
+    tmp_path = corpus_path + '.bloom.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(BLOOM_HEADER.pack(BLOOM_MAGIC, bits, BLOOM_HASHES))
+        f.write(filter_bits)
+    os.replace(tmp_path, corpus_path + '.bloom')
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the offline breached-password corpus")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="convert a HIBP download into " + CORPUS_FILE)
+    build.add_argument('source', help="HIBP 'ordered by hash' text file, or a directory of range files")
+    build.add_argument('--output', default=CORPUS_FILE)
+    build.add_argument('--bloom', action='store_true', help="also write a Bloom filter (about 1.2 bytes per hash)")
+    check = commands.add_parser('check', help="look up one password")
+    check.add_argument('password')
+    check.add_argument('--corpus', default=CORPUS_FILE)
+    args = parser.parse_args()
+    
+    if args.command == 'build':
+        count = build_corpus(args.source, args.output, args.bloom)
+        print(f"Wrote {count} hashes to {args.output}")
+    else:
+        corpus = load_corpus(args.corpus)
+        if corpus is None:
+            sys.exit(f"No corpus at {args.corpus}")
+        print(corpus.occurrences(args.password))
+
+if __name__ == "__main__":
+    main()
@@ -1,198 +1,719 @@
 import sqlite3
 import os
-from cryptography.fernet import Fernet
+import json
+import threading
+from contextlib import contextmanager
+from itertools import groupby
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 import hashlib
 import base64
+import blind_index
+import health
+import migrations
+from blind_index import BlindIndex, normalize_site
+from ciphers import RowCipher
+from health import HealthIndex
+
+# scrypt cost for deriving the key-encryption key from the master password
+# (~0.1s and 32 MB per unlock). Stored with each vault, so it can be raised later.
+KDF_PARAMS = {'n': 2 ** 15, 'r': 8, 'p': 1}
+SALT_SIZE = 16
+
+# Format written to the *_encrypted columns (see ciphers.py). Rows with an
+# older cipher_version may hold older formats; upgrade_ciphertext rewrites them.
+CIPHER_VERSION = RowCipher.version
+ENCRYPTED_COLUMNS = ('password_encrypted', 'metadata_encrypted', 'notes_encrypted')
+
+LOOKUP_BATCH = 500  # Ids per IN (...) query in get_passwords
+
+# Columns entry_from_row expects, optionally followed by password_encrypted
+ENTRY_COLUMNS = 'id, website, username, metadata_encrypted'
+
+BUSY_TIMEOUT = 5.0        # Seconds to wait for another process's write lock
+CACHED_STATEMENTS = 128   # Prepared statements kept per connection
+FUZZY_CANDIDATES = 200    # Rows fetched for a typo-tolerant search before they are scored
+HEALTH_BATCH = 500        # Rows fingerprinted per transaction by assess_missing
+CIPHER_UPGRADE_BATCH = 500  # Rows re-encrypted per call to upgrade_ciphertext
 
 class Database:
     def __init__(self, db_path="password_manager.db"):
         self.db_path = db_path
+        self.data_key = None  # The vault's data key while unlocked
+        self.cipher = None    # RowCipher under the data key
+        self.index = None     # Blind index tokens under a key derived from the data key
+        self.health = None    # Password fingerprints and scores for the health report
+        self.metadata_encrypted = False  # Whether website and username are stored encrypted
+        self.has_vault = False  # Once a vault exists it stays, so a True answer is never looked up again
+        self.upgraded_from = None  # Schema version found on open, if the schema was then upgraded
+        self.conn = None
+        self.conn_lock = threading.RLock()  # Guards the shared connection; lock() is the vault lock
+        self.fts = False  # Whether the trigram search index is available
         self.init_database()
     
     def get_connection(self):
-        """Create and return a database connection"""
-        return sqlite3.connect(self.db_path)
+        """Return the database's connection, opening it on first use.
+        
+        One connection lives as long as the Database, so statements stay
+        prepared between calls. It runs in autocommit mode; writes are grouped
+        with `transaction()`. WAL lets reads proceed while a write commits, and
+        synchronous=NORMAL only syncs at checkpoints, which WAL keeps safe
+        against corruption (a power cut may lose the last commit, nothing more).
+        """
+        with self.conn_lock:
+            if self.conn is None:
+                conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                                       check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+                conn.execute('PRAGMA journal_mode = WAL')
+                conn.execute('PRAGMA synchronous = NORMAL')
+                conn.execute(f'PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}')
+                self.conn = conn
+            return self.conn
+    
+    @contextmanager
+    def transaction(self):
+        """Run a block of writes as one transaction and yield its cursor.
+        
+        Commits when the block finishes and rolls back if it raises. The write
+        lock is taken up front (BEGIN IMMEDIATE) so a read-then-write block
+        cannot fail halfway with SQLITE_BUSY.
+        """
+        with self.conn_lock:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                yield cursor
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+    
+    def open_reader(self):
+        """A separate read-only connection, for searches run on another thread.
+        
+        WAL lets it read while the main connection writes, and it can be
+        interrupted without disturbing anything else.
+        """
+        self.get_connection()  # Make sure the database exists and is in WAL mode
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                               check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+        conn.execute('PRAGMA query_only = ON')
+        return conn
+    
+    def query(self, sql, params=()):
+        """Run a read-only statement and return all rows"""
+        with self.conn_lock:
+            return self.get_connection().execute(sql, params).fetchall()
+    
+    def query_one(self, sql, params=()):
+        """Run a read-only statement and return its first row (or None)"""
+        with self.conn_lock:
+            return self.get_connection().execute(sql, params).fetchone()
+    
+    def close(self):
+        """Close the connection (it reopens on next use)"""
+        with self.conn_lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
     
     def init_database(self):
         """Initialize the database with required tables"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.transaction() as cursor:
+            self.create_tables(cursor)
+    
+    def create_tables(self, cursor):
+        """Create or upgrade the schema (see migrations.py) and load the vault's settings"""
+        previous = migrations.migrate(cursor)
+        if previous < migrations.SCHEMA_VERSION:
+            self.upgraded_from = previous
+        
+        cursor.execute("SELECT value FROM settings WHERE name = 'metadata_encrypted'")
+        setting = cursor.fetchone()
+        self.metadata_encrypted = bool(setting and setting[0] == '1')
+        self.fts = self.create_search_index(cursor)
+    
+    def create_search_index(self, cursor):
+        """Trigram full-text index over website and username, kept in sync by triggers.
+        
+        Returns False if this SQLite build lacks FTS5 or the trigram tokenizer;
+        searches then fall back to a LIKE scan.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'passwords_fts'")
+        exists = cursor.fetchone() is not None
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS passwords_fts USING fts5(
+                    website, username,
+                    content='passwords', content_rowid='id', tokenize='trigram'
+                )
+            ''')
+        except sqlite3.OperationalError:
+            return False
         
-        # Create master password table
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS master_password (
-                id INTEGER PRIMARY KEY,
-                password_hash TEXT NOT NULL
-            )
+            CREATE TRIGGER IF NOT EXISTS passwords_fts_insert AFTER INSERT ON passwords BEGIN
+                INSERT INTO passwords_fts (rowid, website, username) VALUES (new.id, new.website, new.username);
+            END
         ''')
-        
-        # Create passwords table
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS passwords (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                website TEXT NOT NULL,
-                username TEXT NOT NULL,
-                password_encrypted TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
+            CREATE TRIGGER IF NOT EXISTS passwords_fts_delete AFTER DELETE ON passwords BEGIN
+                INSERT INTO passwords_fts (passwords_fts, rowid, website, username)
+                VALUES ('delete', old.id, old.website, old.username);
+            END
         ''')
-        
-        conn.commit()
-        conn.close()
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS passwords_fts_update AFTER UPDATE OF website, username ON passwords BEGIN
+                INSERT INTO passwords_fts (passwords_fts, rowid, website, username)
+                VALUES ('delete', old.id, old.website, old.username);
+                INSERT INTO passwords_fts (rowid, website, username) VALUES (new.id, new.website, new.username);
+            END
+        ''')
+        if not exists:
+            # Index the rows that were there before the index was
+            cursor.execute("INSERT INTO passwords_fts (passwords_fts) VALUES ('rebuild')")
+        return True
     
-    def set_master_password(self, password_hash):
-        """Set or update the master password hash"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def has_master_password(self):
+        """Check if master password exists.
         
-        cursor.execute('SELECT COUNT(*) FROM master_password')
-        count = cursor.fetchone()[0]
+        Only looked up until a vault is found or unlocked: after that the login
+        screen can ask without waiting on a job that holds the connection.
+        """
+        if not self.has_vault:
+            count = self.query_one('SELECT (SELECT COUNT(*) FROM vault) + (SELECT COUNT(*) FROM master_password)')[0]
+            self.has_vault = count > 0
+        return self.has_vault
+    
+    def get_vault(self):
+        """Return (kdf_salt, kdf_params, wrapped_key) or None if no vault was created yet"""
+        result = self.query_one('SELECT kdf_salt, kdf_params, wrapped_key FROM vault WHERE id = 1')
+        if not result:
+            return None
+        return result[0], json.loads(result[1]), result[2]
+    
+    def save_vault(self, cursor, salt, params, wrapped_key):
+        cursor.execute('''
+            INSERT OR REPLACE INTO vault (id, kdf, kdf_salt, kdf_params, wrapped_key)
+            VALUES (1, 'scrypt', ?, ?, ?)
+        ''', (salt, json.dumps(params), wrapped_key))
+    
+    def derive_key(self, master_password, salt, params):
+        """Derive the key-encryption key from the master password (deliberately slow)"""
+        kdf = Scrypt(salt=salt, length=32, n=params['n'], r=params['r'], p=params['p'])
+        return base64.urlsafe_b64encode(kdf.derive(master_password.encode()))
+    
+    def wrap_key(self, data_key, master_password):
+        """Encrypt the data key under a freshly salted master key. Returns (salt, params, wrapped_key)."""
+        salt = os.urandom(SALT_SIZE)
+        params = dict(KDF_PARAMS)
+        wrapped_key = Fernet(self.derive_key(master_password, salt, params)).encrypt(data_key).decode()
+        return salt, params, wrapped_key
+    
+    def unwrap_key(self, master_password):
+        """Return the vault's data key, or None if the master password is wrong"""
+        vault = self.get_vault()
+        if not vault:
+            return None
+        salt, params, wrapped_key = vault
+        try:
+            return Fernet(self.derive_key(master_password, salt, params)).decrypt(wrapped_key.encode())
+        except InvalidToken:
+            return None
+    
+    def create_vault(self, master_password):
+        """Set up a new vault: a random data key wrapped by the master password. Leaves it unlocked."""
+        data_key = Fernet.generate_key()
+        wrapped = self.wrap_key(data_key, master_password)
+        with self.transaction() as cursor:
+            self.save_vault(cursor, *wrapped)
+        self.use_key(data_key)
+    
+    def unlock(self, master_password):
+        """Unlock the vault for this session. Returns False if the master password is wrong."""
+        if not self.get_vault():
+            return self.upgrade_legacy_vault(master_password)
+        data_key = self.unwrap_key(master_password)
+        if data_key is None:
+            return False
+        self.use_key(data_key)
+        return True
+    
+    def use_key(self, data_key):
+        self.has_vault = True
+        self.data_key = data_key
+        self.cipher = RowCipher(data_key)
+        self.index = BlindIndex(data_key)
+        self.health = HealthIndex(data_key)
+    
+    def session_key(self):
+        """The unlocked data key, for handing to worker processes"""
+        if self.data_key is None:
+            raise RuntimeError("Vault is locked")
+        return self.data_key
+    
+    def lock(self):
+        """Forget the data key"""
+        self.data_key = None
+        self.cipher = None
+        self.index = None
+        self.health = None
+    
+    def is_unlocked(self):
+        return self.cipher is not None
+    
+    def change_master_password(self, old_password, new_password):
+        """Re-wrap the data key under a new master password. Rows are untouched."""
+        data_key = self.unwrap_key(old_password)
+        if data_key is None:
+            return False
+        wrapped = self.wrap_key(data_key, new_password)
+        with self.transaction() as cursor:
+            self.save_vault(cursor, *wrapped)
+        return True
+    
+    def upgrade_legacy_vault(self, master_password):
+        """Move a vault from the old scheme (SHA-256 password hash, key = SHA-256 of the
+        master password) to a wrapped data key. Every row is re-encrypted once."""
+        stored_hash = self.get_master_password_hash()
+        if not stored_hash or self.hash_password(master_password) != stored_hash:
+            return False
         
-        if count == 0:
-            cursor.execute('INSERT INTO master_password (password_hash) VALUES (?)', (password_hash,))
-        else:
-            cursor.execute('UPDATE master_password SET password_hash = ? WHERE id = 1', (password_hash,))
+        legacy = Fernet(self.get_encryption_key(master_password))
+        data_key = Fernet.generate_key()
+        cipher = RowCipher(data_key)
+        wrapped = self.wrap_key(data_key, master_password)
         
-        conn.commit()
-        conn.close()
+        # One transaction: either every row moves to the new key or none does
+        with self.transaction() as cursor:
+            cursor.execute('SELECT id, password_encrypted FROM passwords')
+            rows = []
+            for password_id, encrypted in cursor.fetchall():
+                try:
+                    password = legacy.decrypt(encrypted.encode()).decode()
+                except InvalidToken:
+                    continue  # Unreadable under the old key too; leave it as it is
+                rows.append((cipher.encrypt(password, 'password_encrypted'), CIPHER_VERSION, password_id))
+            cursor.executemany('UPDATE passwords SET password_encrypted = ?, cipher_version = ? WHERE id = ?', rows)
+            self.save_vault(cursor, *wrapped)
+            # The unsalted hash made offline guessing cheap; the wrapped key replaces it
+            cursor.execute('DELETE FROM master_password')
+        self.use_key(data_key)
+        return True
     
     def get_master_password_hash(self):
-        """Retrieve the master password hash"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT password_hash FROM master_password LIMIT 1')
-        result = cursor.fetchone()
-        conn.close()
-        
+        """Retrieve the legacy master password hash"""
+        result = self.query_one('SELECT password_hash FROM master_password LIMIT 1')
         return result[0] if result else None
     
-    def has_master_password(self):
-        """Check if master password exists"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT COUNT(*) FROM master_password')
-        count = cursor.fetchone()[0]
-        conn.close()
-        
-        return count > 0
-    
     def hash_password(self, password):
-        """Hash a password using SHA-256"""
+        """Hash a password using SHA-256 (legacy vaults only)"""
         return hashlib.sha256(password.encode()).hexdigest()
     
     def get_encryption_key(self, master_password):
-        """Generate encryption key from master password"""
+        """Generate the legacy encryption key from master password (used only to upgrade old vaults)"""
         # Use SHA-256 to derive a key, then encode to base64 for Fernet
         key = hashlib.sha256(master_password.encode()).digest()
         return base64.urlsafe_b64encode(key)
     
-    def encrypt_password(self, password, master_password):
-        """Encrypt a password using the master password"""
-        key = self.get_encryption_key(master_password)
-        fernet = Fernet(key)
-        encrypted = fernet.encrypt(password.encode())
-        return encrypted.decode()
+    def encrypt_password(self, password, column='password_encrypted'):
+        """Encrypt a password (or other text stored in `column`) with the session's data key"""
+        if self.cipher is None:
+            raise RuntimeError("Vault is locked")
+        return self.cipher.encrypt(password, column)
     
-    def decrypt_password(self, encrypted_password, master_password):
-        """Decrypt a password using the master password"""
+    def decrypt_password(self, encrypted_password, column='password_encrypted'):
+        """Decrypt a value of any cipher version with the session's data key. None if it cannot be read."""
+        if self.cipher is None:
+            raise RuntimeError("Vault is locked")
         try:
-            key = self.get_encryption_key(master_password)
-            fernet = Fernet(key)
-            decrypted = fernet.decrypt(encrypted_password.encode())
-            return decrypted.decode()
+            return self.cipher.decrypt(encrypted_password, column)
         except Exception:
             return None
     
-    def add_password(self, website, username, password, master_password):
-        """Add a new password entry"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def add_password(self, website, username, password):
+        """Add a new password entry. Returns how many other entries use the same password."""
+        self.add_passwords([(website, username, password)])
+        return self.reuse_count(password) - 1
+    
+    def add_passwords(self, entries):
+        """Add many (website, username, password) entries in one transaction"""
+        rows = [(website, username, self.encrypt_password(password), *self.assess_password(password))
+                for website, username, password in entries]
+        with self.transaction() as cursor:
+            self.insert_rows(cursor, rows)
+    
+    def assess_password(self, password):
+        """(fingerprint, strength score) stored with a password for the health report"""
+        if self.health is None:
+            raise RuntimeError("Vault is locked")
+        return self.health.assess(password)
+    
+    def insert_rows(self, cursor, rows):
+        """Insert (website, username, password_encrypted, fingerprint, strength) rows whose
+        password is already encrypted and assessed"""
+        if not self.metadata_encrypted:
+            cursor.executemany('''
+                INSERT INTO passwords (website, username, password_encrypted, fingerprint, strength, domain, cipher_version)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', ((*row, normalize_site(row[0]), CIPHER_VERSION) for row in rows))
+            return
+        for website, username, encrypted_password, fingerprint, strength in rows:
+            cursor.execute('''
+                INSERT INTO passwords (website, username, password_encrypted, metadata_encrypted, fingerprint, strength,
+                                       cipher_version)
+                VALUES ('', '', ?, ?, ?, ?, ?)
+            ''', (encrypted_password, self.encrypt_metadata(website, username), fingerprint, strength, CIPHER_VERSION))
+            self.index_entry(cursor, cursor.lastrowid, website, username)
+    
+    def encrypt_metadata(self, website, username):
+        return self.encrypt_password(json.dumps([website, username]), 'metadata_encrypted')
+    
+    def decrypt_metadata(self, encrypted_metadata):
+        """(website, username) from encrypt_metadata's output. Placeholders if it cannot be read."""
+        decrypted = self.decrypt_password(encrypted_metadata, 'metadata_encrypted')
+        if decrypted is None:
+            return '(unreadable)', ''
+        website, username = json.loads(decrypted)
+        return website, username
+    
+    def index_entry(self, cursor, password_id, website, username):
+        """Replace an entry's blind index tokens"""
+        if self.index is None:
+            raise RuntimeError("Vault is locked")
+        cursor.execute('DELETE FROM blind_index WHERE password_id = ?', (password_id,))
+        cursor.executemany('INSERT INTO blind_index (token, password_id) VALUES (?, ?)',
+                           [(token, password_id) for token in self.index.entry_tokens(website, username)])
+    
+    def set_metadata_encryption(self, enabled):
+        """Encrypt (or decrypt) every entry's website and username in place.
         
-        encrypted_password = self.encrypt_password(password, master_password)
+        Turning it on also rebuilds the search index and vacuums the file, so
+        no plaintext site names are left behind in free pages.
+        """
+        if self.cipher is None:
+            raise RuntimeError("Vault is locked")
+        if enabled == self.metadata_encrypted:
+            return
+        with self.transaction() as cursor:
+            cursor.execute('SELECT id, website, username, metadata_encrypted FROM passwords')
+            for row in cursor.fetchall():
+                entry = self.entry_from_row(row)
+                if enabled:
+                    cursor.execute('''
+                        UPDATE passwords SET website = '', username = '', domain = NULL, metadata_encrypted = ?
+                        WHERE id = ?
+                    ''', (self.encrypt_metadata(entry['website'], entry['username']), entry['id']))
+                    self.index_entry(cursor, entry['id'], entry['website'], entry['username'])
+                else:
+                    cursor.execute('''
+                        UPDATE passwords SET website = ?, username = ?, domain = ?, metadata_encrypted = NULL
+                        WHERE id = ?
+                    ''', (entry['website'], entry['username'], normalize_site(entry['website']), entry['id']))
+            if not enabled:
+                cursor.execute('DELETE FROM blind_index')
+            cursor.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('metadata_encrypted', ?)",
+                           ('1' if enabled else '0',))
+            if self.fts:
+                cursor.execute("INSERT INTO passwords_fts (passwords_fts) VALUES ('rebuild')")
+            self.metadata_encrypted = enabled
+        if enabled:
+            with self.conn_lock:
+                conn = self.get_connection()
+                conn.execute('VACUUM')
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    
+    def list_passwords(self):
+        """Every entry's id, website and username. Reads no password ciphertext.
         
-        cursor.execute('''
-            INSERT INTO passwords (website, username, password_encrypted)
-            VALUES (?, ?, ?)
-        ''', (website, username, encrypted_password))
+        With metadata encryption on, each entry's metadata is decrypted here.
+        """
+        rows = self.query(f'SELECT {ENTRY_COLUMNS} FROM passwords')
+        return [self.entry_from_row(row) for row in rows]
+    
+    def get_password(self, password_id, decrypt=False):
+        """One entry by id, or None. Metadata only unless `decrypt` is set.
         
-        conn.commit()
-        conn.close()
+        With `decrypt`, the entry also carries 'password', which is None if the
+        ciphertext cannot be read.
+        """
+        columns = ENTRY_COLUMNS + ', password_encrypted' if decrypt else ENTRY_COLUMNS
+        row = self.query_one(f'SELECT {columns} FROM passwords WHERE id = ?', (password_id,))
+        return self.entry_from_row(row) if row else None
+    
+    def get_passwords(self, password_ids, decrypt=False):
+        """Entries for many ids, in the order given. Ids that no longer exist are skipped."""
+        password_ids = list(password_ids)
+        columns = ENTRY_COLUMNS + ', password_encrypted' if decrypt else ENTRY_COLUMNS
+        with self.conn_lock:
+            rows = self.rows_by_id(self.get_connection(), columns, password_ids)
+        found = {row[0]: self.entry_from_row(row) for row in rows}
+        return [found[password_id] for password_id in password_ids if password_id in found]
     
-    def get_all_passwords(self, master_password):
-        """Retrieve all password entries"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def rows_by_id(self, conn, columns, password_ids):
+        """Rows for many ids, fetched LOOKUP_BATCH at a time, in no particular order"""
+        rows = []
+        for i in range(0, len(password_ids), LOOKUP_BATCH):
+            batch = password_ids[i:i + LOOKUP_BATCH]
+            placeholders = ', '.join('?' * len(batch))
+            rows.extend(conn.execute(f'SELECT {columns} FROM passwords WHERE id IN ({placeholders})', batch))
+        return rows
+    
+    def entry_from_row(self, row):
+        """Entry dict for a row of ENTRY_COLUMNS[, password_encrypted], decrypting what is encrypted"""
+        entry = {'id': row[0], 'website': row[1], 'username': row[2]}
+        if row[3] is not None:
+            entry['website'], entry['username'] = self.decrypt_metadata(row[3])
+        if len(row) > 4:
+            entry['password'] = self.decrypt_password(row[4])
+        return entry
+    
+    def get_all_passwords(self):
+        """Retrieve all password entries, decrypted (decrypts the whole vault; listing uses list_passwords)"""
+        rows = self.query(f'SELECT {ENTRY_COLUMNS}, password_encrypted FROM passwords')
+        entries = [self.entry_from_row(row) for row in rows]
+        return [entry for entry in entries if entry['password']]
+    
+    def search_passwords(self, query, conn=None):
+        """Search entries by website or username. Like list_passwords, returns metadata only.
         
-        cursor.execute('SELECT id, website, username, password_encrypted FROM passwords')
-        rows = cursor.fetchall()
-        conn.close()
+        Entries whose website or username starts with the query come first,
+        then other substring matches by relevance. If nothing contains the
+        query, entries sharing most of its trigrams are returned instead, so
+        small typos still find something. `conn` is a reader from open_reader();
+        by default the main connection is used.
+        """
+        if conn is None:
+            with self.conn_lock:
+                return self.search_passwords(query, self.get_connection())
         
-        passwords = []
-        for row in rows:
-            decrypted = self.decrypt_password(row[3], master_password)
-            if decrypted:
-                passwords.append({
-                    'id': row[0],
-                    'website': row[1],
-                    'username': row[2],
-                    'password': decrypted
-                })
-        
-        return passwords
-    
-    def search_passwords(self, query, master_password):
-        """Search passwords by website or username"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        query = query.strip()
+        if not query:
+            rows = conn.execute(f'SELECT {ENTRY_COLUMNS} FROM passwords').fetchall()
+            return [self.entry_from_row(row) for row in rows]
+        if self.metadata_encrypted:
+            return self.blind_search(conn, query)
         
-        cursor.execute('''
-            SELECT id, website, username, password_encrypted 
-            FROM passwords 
-            WHERE website LIKE ? OR username LIKE ?
-        ''', (f'%{query}%', f'%{query}%'))
+        escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        prefix = escaped + '%'
+        if self.fts and len(query) >= 3:
+            rows = conn.execute('''
+                SELECT p.id, p.website, p.username, p.metadata_encrypted
+                FROM passwords_fts JOIN passwords p ON p.id = passwords_fts.rowid
+                WHERE passwords_fts MATCH ?
+                ORDER BY (p.website LIKE ? ESCAPE '\\' OR p.username LIKE ? ESCAPE '\\') DESC, bm25(passwords_fts)
+            ''', (self.fts_phrase(query), prefix, prefix)).fetchall()
+            if not rows and len(query) >= 4:
+                rows = self.fuzzy_search(conn, query)
+        else:
+            # Too short for trigrams (or no index): plain scan
+            rows = conn.execute(f'''
+                SELECT {ENTRY_COLUMNS}
+                FROM passwords
+                WHERE website LIKE ? ESCAPE '\\' OR username LIKE ? ESCAPE '\\'
+                ORDER BY (website LIKE ? ESCAPE '\\' OR username LIKE ? ESCAPE '\\') DESC
+            ''', (f'%{escaped}%', f'%{escaped}%', prefix, prefix)).fetchall()
+        return [self.entry_from_row(row) for row in rows]
+    
+    def blind_search(self, conn, query):
+        """Search encrypted metadata: every query word must prefix a word of the site or username.
         
-        rows = cursor.fetchall()
-        conn.close()
+        Candidates come from the blind index; only they are decrypted, to
+        drop the rare false match and to check words the index cannot
+        (shorter than MIN_PREFIX or longer than MAX_PREFIX).
+        """
+        if self.index is None:
+            raise RuntimeError("Vault is locked")
+        candidates = None
+        for word in blind_index.query_words(query):
+            if len(word) < blind_index.MIN_PREFIX:
+                continue
+            ids = {row[0] for row in conn.execute('SELECT password_id FROM blind_index WHERE token IN (?, ?)',
+                                                  self.index.word_tokens(word))}
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return []
+        if candidates is None:
+            rows = conn.execute(f'SELECT {ENTRY_COLUMNS} FROM passwords').fetchall()
+        else:
+            rows = self.rows_by_id(conn, ENTRY_COLUMNS, sorted(candidates))
+        entries = [entry for entry in map(self.entry_from_row, rows) if blind_index.matches(entry, query)]
+        entries.sort(key=lambda entry: (entry['website'].lower(), entry['id']))
+        return entries
+    
+    def fts_phrase(self, text):
+        """Quote text as an FTS5 string so its punctuation is matched literally"""
+        return '"' + text.replace('"', '""') + '"'
+    
+    def fuzzy_search(self, conn, query):
+        """Rows sharing at least half of the query's trigrams, most shared first"""
+        trigrams = {query[i:i + 3].lower() for i in range(len(query) - 2)}
+        rows = conn.execute('''
+            SELECT p.id, p.website, p.username, p.metadata_encrypted
+            FROM passwords_fts JOIN passwords p ON p.id = passwords_fts.rowid
+            WHERE passwords_fts MATCH ?
+            ORDER BY bm25(passwords_fts)
+            LIMIT ?
+        ''', (' OR '.join(map(self.fts_phrase, trigrams)), FUZZY_CANDIDATES)).fetchall()
         
-        passwords = []
+        scored = []
         for row in rows:
-            decrypted = self.decrypt_password(row[3], master_password)
-            if decrypted:
-                passwords.append({
-                    'id': row[0],
-                    'website': row[1],
-                    'username': row[2],
-                    'password': decrypted
-                })
+            text = f'{row[1]} {row[2]}'.lower()
+            shared = sum(trigram in text for trigram in trigrams)
+            if shared * 2 >= len(trigrams):
+                scored.append((-shared, row))
+        scored.sort(key=lambda item: item[0])
+        return [row for _, row in scored]
+    
+    def update_password(self, password_id, website, username, password):
+        """Update an existing password entry. Returns how many other entries use the same password."""
+        encrypted_password = self.encrypt_password(password)
+        fingerprint, strength = self.assess_password(password)
         
-        return passwords
+        with self.transaction() as cursor:
+            if self.metadata_encrypted:
+                cursor.execute('''
+                    UPDATE passwords
+                    SET password_encrypted = ?, metadata_encrypted = ?, fingerprint = ?, strength = ?,
+                        cipher_version = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (encrypted_password, self.encrypt_metadata(website, username), fingerprint, strength,
+                      CIPHER_VERSION, password_id))
+                self.index_entry(cursor, password_id, website, username)
+            else:
+                cursor.execute('''
+                    UPDATE passwords
+                    SET website = ?, username = ?, domain = ?, password_encrypted = ?, fingerprint = ?, strength = ?,
+                        cipher_version = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (website, username, normalize_site(website), encrypted_password, fingerprint, strength,
+                      CIPHER_VERSION, password_id))
+        return self.reuse_count(password) - 1
     
-    def update_password(self, password_id, website, username, password, master_password):
-        """Update an existing password entry"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def reuse_count(self, password):
+        """How many entries store this password (an indexed lookup; nothing is decrypted)"""
+        if self.health is None:
+            raise RuntimeError("Vault is locked")
+        return self.query_one('SELECT COUNT(*) FROM passwords WHERE fingerprint = ?',
+                              (self.health.fingerprint(password),))[0]
+    
+    def assess_missing(self, progress=None):
+        """Fingerprint and score entries stored before the health report existed. Returns how many.
         
-        encrypted_password = self.encrypt_password(password, master_password)
+        Only rows without a fingerprint are read, HEALTH_BATCH per
+        transaction, so after the first run this is a single indexed query.
+        Rows that cannot be decrypted are left for the next run.
+        """
+        if self.health is None:
+            raise RuntimeError("Vault is locked")
+        total = self.query_one('SELECT COUNT(*) FROM passwords WHERE fingerprint IS NULL')[0]
+        done = 0
+        last_id = 0
+        while True:
+            rows = self.query('''
+                SELECT id, password_encrypted FROM passwords
+                WHERE fingerprint IS NULL AND id > ? ORDER BY id LIMIT ?
+            ''', (last_id, HEALTH_BATCH))
+            if not rows:
+                return done
+            updates = []
+            for password_id, encrypted in rows:
+                password = self.decrypt_password(encrypted)
+                if password is not None:
+                    updates.append((*self.health.assess(password), password_id))
+            with self.transaction() as cursor:
+                # Only rows still unassessed: one saved meanwhile already has current values
+                cursor.executemany('UPDATE passwords SET fingerprint = ?, strength = ? WHERE id = ? AND fingerprint IS NULL',
+                                   updates)
+            done += len(updates)
+            last_id = rows[-1][0]
+            if progress:
+                progress(done, total)
+    
+    def upgrade_ciphertext(self, after_id=0):
+        """Re-encrypt the next CIPHER_UPGRADE_BATCH rows after `after_id` that use an older format.
         
-        cursor.execute('''
-            UPDATE passwords 
-            SET website = ?, username = ?, password_encrypted = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (website, username, encrypted_password, password_id))
+        Returns the last id looked at, to pass back in for the next batch, or
+        None once no older rows remain. Each call is one short transaction,
+        so saves queued between batches are not held up. Rows that cannot be
+        decrypted are skipped and left as they are.
+        """
+        if self.cipher is None:
+            raise RuntimeError("Vault is locked")
+        rows = self.query(f'''
+            SELECT id, {', '.join(ENCRYPTED_COLUMNS)} FROM passwords
+            WHERE cipher_version < ? AND id > ? ORDER BY id LIMIT ?
+        ''', (CIPHER_VERSION, after_id, CIPHER_UPGRADE_BATCH))
+        if not rows:
+            return None
         
-        conn.commit()
-        conn.close()
+        updates = []
+        for password_id, *values in rows:
+            try:
+                upgraded = [None if value is None else self.cipher.encrypt(self.cipher.decrypt(value, column), column)
+                            for value, column in zip(values, ENCRYPTED_COLUMNS)]
+            except InvalidToken:
+                continue
+            updates.append((*upgraded, CIPHER_VERSION, password_id, CIPHER_VERSION))
+        with self.transaction() as cursor:
+            cursor.executemany(f'''
+                UPDATE passwords SET {', '.join(f'{column} = ?' for column in ENCRYPTED_COLUMNS)}, cipher_version = ?
+                WHERE id = ? AND cipher_version < ?
+            ''', updates)
+        return rows[-1][0]
     
-    def delete_password(self, password_id):
-        """Delete a password entry"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def health_report(self):
+        """Reused, weak and stale passwords from the stored fingerprints and scores.
+        
+        Returns a dict: 'total', 'unassessed' (rows assess_missing has not
+        reached), 'reused' (lists of entries sharing a password, biggest
+        first), 'weak' ((entry, score) pairs), 'stale' ((entry, days) pairs,
+        oldest first) and 'ages' ((label, count) per health.AGE_BUCKETS).
+        No password is decrypted.
+        """
+        total, unassessed = self.query_one('SELECT COUNT(*), COUNT(*) - COUNT(fingerprint) FROM passwords')
+        
+        rows = self.query(f'''
+            SELECT {ENTRY_COLUMNS}, fingerprint FROM passwords
+            WHERE fingerprint IN (
+                SELECT fingerprint FROM passwords WHERE fingerprint IS NOT NULL
+                GROUP BY fingerprint HAVING COUNT(*) > 1
+            )
+            ORDER BY fingerprint, id
+        ''')
+        reused = [[self.entry_from_row(row[:4]) for row in group] for _, group in groupby(rows, key=lambda row: row[4])]
+        reused.sort(key=len, reverse=True)
         
-        cursor.execute('DELETE FROM passwords WHERE id = ?', (password_id,))
+        rows = self.query(f'SELECT {ENTRY_COLUMNS}, strength FROM passwords WHERE strength <= ? ORDER BY strength, id',
+                          (health.WEAK_SCORE,))
+        weak = [(self.entry_from_row(row[:4]), row[4]) for row in rows]
         
-        conn.commit()
-        conn.close()
+        days = "CAST(julianday('now') - julianday(updated_at) AS INTEGER)"
+        ages = [0] * len(health.AGE_BUCKETS)
+        for age, count in self.query(f'SELECT {days} AS age, COUNT(*) FROM passwords GROUP BY age'):
+            ages[health.age_bucket(age or 0)] += count
+        rows = self.query(f'''
+            SELECT {ENTRY_COLUMNS}, {days} FROM passwords
+            WHERE updated_at < datetime('now', ?) ORDER BY updated_at
+        ''', (f'-{health.STALE_DAYS} days',))
+        stale = [(self.entry_from_row(row[:4]), row[4]) for row in rows]
+        
+        return {
+            'total': total,
+            'unassessed': unassessed,
+            'reused': reused,
+            'weak': weak,
+            'stale': stale,
+            'ages': [(label, count) for (_, label), count in zip(health.AGE_BUCKETS, ages)]
+        }
+    
+    def delete_password(self, password_id):
+        """Delete a password entry"""
+        self.delete_passwords([password_id])
+    
+    def delete_passwords(self, password_ids):
+        """Delete many password entries in one transaction"""
+        with self.transaction() as cursor:
+            cursor.executemany('DELETE FROM passwords WHERE id = ?', [(password_id,) for password_id in password_ids])
 
@@ -0,0 +1,55 @@
+"""
+Fingerprints and strength scores behind the vault health report.
+
+Every entry stores a fingerprint of its password (HMAC-SHA256 under a key
+derived from the vault's data key) and its strength score from strength.py.
+Both are computed when the password is written, so the report is a few
+queries over those columns and updated_at: reuse is a lookup on the
+fingerprint index and nothing is decrypted except the site names listed.
+
+Without the data key a fingerprint cannot be tested against guesses; it
+only shows which entries share a password.
+"""
+
+import hashlib
+import hmac
+import threading
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from strength import Estimator
+
+FINGERPRINT_SIZE = 16  # Bytes of each HMAC kept
+WEAK_SCORE = 2         # Scores up to this (Fair) are reported as weak
+STALE_DAYS = 365       # Passwords unchanged for longer are reported as stale
+
+# Report buckets for time since a password was last changed, as (up to days, label)
+AGE_BUCKETS = (
+    (30, "Under a month"),
+    (90, "1-3 months"),
+    (365, "3-12 months"),
+    (None, "Over a year"),
+)
+
+class HealthIndex:
+    """Computes the fingerprint and score stored with each of one vault's passwords"""
+    
+    def __init__(self, data_key):
+        hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b'password-manager health fingerprint')
+        self.key = hkdf.derive(data_key)
+        self.estimator = Estimator()
+        self.lock = threading.Lock()  # Estimator keeps per-call state
+    
+    def fingerprint(self, password):
+        return hmac.new(self.key, password.encode(), hashlib.sha256).digest()[:FINGERPRINT_SIZE]
+    
+    def assess(self, password):
+        """(fingerprint, strength score 0-4) for a password"""
+        with self.lock:
+            score = self.estimator.estimate(password)['score']
+        return self.fingerprint(password), score
+
+def age_bucket(days):
+    """Index into AGE_BUCKETS for a password last changed `days` ago"""
+    for index, (limit, _) in enumerate(AGE_BUCKETS):
+        if limit is None or days < limit:
+            return index
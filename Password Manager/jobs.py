@@ -0,0 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor
+
+POLL_MS = 20  # How often the Tk thread checks on running jobs
+
+class JobRunner:
+    """Runs database and crypto work off the Tk thread.
+    
+    Jobs run one at a time on a single worker thread, in the order they
+    were submitted, so a save is always finished before the refresh queued
+    after it. Results come back on the Tk thread: `on_done(result)` or
+    `on_error(exception)` are called from `root.after`, never from the
+    worker.
+    
+    Jobs submitted with the same `key` coalesce: a newer one cancels the
+    older if it has not started, and the older one's result is dropped if
+    it has. `cancel_all` drops everything pending, e.g. on logout.
+    """
+    
+    def __init__(self, root):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='vault-jobs')
+        self.latest = {}      # key -> newest Future for that key
+        self.generation = 0   # Bumped by cancel_all; older jobs are ignored
+    
+    def submit(self, func, *args, on_done=None, on_error=None, on_progress=None, key=None):
+        """Run func(*args) in the background and return its Future.
+        
+        With `on_progress`, func is also passed `progress=callback`; whatever
+        it last reported is handed to on_progress on the Tk thread.
+        """
+        kwargs = {}
+        reported = []
+        if on_progress:
+            kwargs['progress'] = lambda *state: reported.append(state)
+        if key is not None and key in self.latest:
+            self.latest[key].cancel()
+        future = self.executor.submit(func, *args, **kwargs)
+        if key is not None:
+            self.latest[key] = future
+        self.root.after(POLL_MS, self.check, future, key, self.generation, on_done, on_error, on_progress, reported)
+        return future
+    
+    def check(self, future, key, generation, on_done, on_error, on_progress, reported):
+        """Tk thread: deliver progress and the outcome of one job"""
+        if generation != self.generation or future.cancelled():
+            return
+        if key is not None and self.latest.get(key) is not future:
+            return  # Superseded
+        if reported and on_progress:
+            on_progress(*reported[-1])
+            reported.clear()
+        if not future.done():
+            self.root.after(POLL_MS, self.check, future, key, generation, on_done, on_error, on_progress, reported)
+            return
+        
+        if key is not None:
+            del self.latest[key]
+        error = future.exception()
+        if error is not None:
+            if on_error:
+                on_error(error)
+            else:
+                print(f"Background job failed: {error!r}")
+        elif on_done:
+            on_done(future.result())
+    
+    def cancel(self, key):
+        """Drop the pending job for `key`, if any"""
+        future = self.latest.pop(key, None)
+        if future:
+            future.cancel()
+    
+    def cancel_all(self):
+        """Drop every pending job. Jobs already running finish, but their results are ignored."""
+        self.generation += 1
+        for future in self.latest.values():
+            future.cancel()
+        self.latest.clear()
+    
+    def shutdown(self):
+        """Stop accepting jobs and wait for queued writes to finish"""
+        self.cancel_all()
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,176 @@
+"""
+Versioned schema migrations for the vault database.
+
+The schema version lives in SQLite's `user_version` header field. When
+the database is opened, every migration past that version runs in order,
+inside the same transaction that bumps the version, so an interrupted
+upgrade leaves the old schema intact. To change the schema, append a
+function to MIGRATIONS; never edit one that has shipped.
+
+Migrations only change the schema and cheap derived columns. Rewriting
+ciphertext is done lazily, row by row, using the cipher_version column
+(see CIPHER_VERSION in database.py), so no migration holds the write lock
+for a full re-encryption.
+"""
+
+import sqlite3
+from blind_index import normalize_site
+
+def create_baseline(cursor):
+    """The schema as it was before versioning, including the columns earlier
+    releases added on the fly. Idempotent, since unversioned databases may
+    have any part of it."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS master_password (
+            id INTEGER PRIMARY KEY,
+            password_hash TEXT NOT NULL
+        )
+    ''')
+    
+    # Data key wrapped under the master password, with the KDF salt and parameters
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vault (
+            id INTEGER PRIMARY KEY,
+            kdf TEXT NOT NULL,
+            kdf_salt BLOB NOT NULL,
+            kdf_params TEXT NOT NULL,
+            wrapped_key TEXT NOT NULL
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS passwords (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            website TEXT NOT NULL,
+            username TEXT NOT NULL,
+            password_encrypted TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    add_missing_columns(cursor, 'passwords', (
+        ('metadata_encrypted', 'TEXT'),
+        ('fingerprint', 'BLOB'),
+        ('strength', 'INTEGER'),
+    ))
+    # Reused passwords share a fingerprint (see health.py)
+    cursor.execute('CREATE INDEX IF NOT EXISTS passwords_fingerprint ON passwords (fingerprint)')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+    
+    # Keyed tokens for searching encrypted metadata (see blind_index.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS blind_index (
+            token BLOB NOT NULL,
+            password_id INTEGER NOT NULL,
+            PRIMARY KEY (token, password_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS blind_index_password ON blind_index (password_id)')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS blind_index_delete AFTER DELETE ON passwords BEGIN
+            DELETE FROM blind_index WHERE password_id = old.id;
+        END
+    ''')
+
+def add_entry_columns(cursor):
+    """Domain, folder, tags and notes columns, the cipher version, and lookup indexes"""
+    cursor.execute('ALTER TABLE passwords ADD COLUMN domain TEXT')   # normalize_site(website); NULL if metadata is encrypted
+    cursor.execute('ALTER TABLE passwords ADD COLUMN folder TEXT')
+    cursor.execute('ALTER TABLE passwords ADD COLUMN tags TEXT')     # Comma-separated
+    cursor.execute('ALTER TABLE passwords ADD COLUMN notes_encrypted TEXT')
+    # Format of password_encrypted (and the other *_encrypted columns); 1 is Fernet
+    cursor.execute('ALTER TABLE passwords ADD COLUMN cipher_version INTEGER NOT NULL DEFAULT 1')
+    
+    cursor.execute('SELECT id, website FROM passwords WHERE metadata_encrypted IS NULL')
+    cursor.executemany('UPDATE passwords SET domain = ? WHERE id = ?',
+                       [(normalize_site(website), password_id) for password_id, website in cursor.fetchall()])
+    
+    cursor.execute('CREATE INDEX passwords_website ON passwords (website)')
+    cursor.execute('CREATE INDEX passwords_username ON passwords (username)')
+    cursor.execute('CREATE INDEX passwords_updated_at ON passwords (updated_at)')
+    cursor.execute('CREATE INDEX passwords_domain ON passwords (domain)')
+    cursor.execute('CREATE INDEX passwords_folder ON passwords (folder)')
+    cursor.execute('CREATE INDEX passwords_cipher_version ON passwords (cipher_version)')
+
+def store_ciphertext_as_blob(cursor):
+    """Declare the *_encrypted columns BLOB instead of TEXT.
+    
+    They hold a mix of formats (see ciphers.py): rows at cipher_version 1
+    keep their Fernet tokens as TEXT, version 2 rows store bytes as BLOB.
+    SQLite cannot change a column's type in place, so the table is copied;
+    BLOB affinity leaves both kinds of value exactly as they were.
+    """
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'passwords'")
+    sequence = cursor.fetchone()
+    cursor.execute('''
+        CREATE TABLE passwords_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            website TEXT NOT NULL,
+            username TEXT NOT NULL,
+            password_encrypted BLOB NOT NULL,   -- TEXT (Fernet) at cipher_version 1, BLOB after
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            metadata_encrypted BLOB,
+            fingerprint BLOB,
+            strength INTEGER,
+            domain TEXT,
+            folder TEXT,
+            tags TEXT,
+            notes_encrypted BLOB,
+            cipher_version INTEGER NOT NULL DEFAULT 1
+        )
+    ''')
+    columns = ('id, website, username, password_encrypted, created_at, updated_at, metadata_encrypted, '
+               'fingerprint, strength, domain, folder, tags, notes_encrypted, cipher_version')
+    cursor.execute(f'INSERT INTO passwords_new ({columns}) SELECT {columns} FROM passwords')
+    # Dropping the table drops its indexes and triggers; the search index triggers are recreated by Database
+    cursor.execute('DROP TABLE passwords')
+    cursor.execute('ALTER TABLE passwords_new RENAME TO passwords')
+    if sequence:
+        # Keep ids of deleted entries from being reused
+        cursor.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'passwords'", sequence)
+    
+    cursor.execute('CREATE INDEX passwords_fingerprint ON passwords (fingerprint)')
+    cursor.execute('CREATE INDEX passwords_website ON passwords (website)')
+    cursor.execute('CREATE INDEX passwords_username ON passwords (username)')
+    cursor.execute('CREATE INDEX passwords_updated_at ON passwords (updated_at)')
+    cursor.execute('CREATE INDEX passwords_domain ON passwords (domain)')
+    cursor.execute('CREATE INDEX passwords_folder ON passwords (folder)')
+    cursor.execute('CREATE INDEX passwords_cipher_version ON passwords (cipher_version)')
+    cursor.execute('''
+        CREATE TRIGGER blind_index_delete AFTER DELETE ON passwords BEGIN
+            DELETE FROM blind_index WHERE password_id = old.id;
+        END
+    ''')
+
+MIGRATIONS = [
+    create_baseline,
+    add_entry_columns,
+    store_ciphertext_as_blob,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def add_missing_columns(cursor, table, columns):
+    cursor.execute(f'PRAGMA table_info({table})')
+    existing = {column[1] for column in cursor.fetchall()}
+    for name, column_type in columns:
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+
+def migrate(cursor):
+    """Bring the schema up to SCHEMA_VERSION. Returns the version the database was at."""
+    cursor.execute('PRAGMA user_version')
+    version = cursor.fetchone()[0]
+    if version > SCHEMA_VERSION:
+        raise sqlite3.DatabaseError(f"The database uses schema version {version}; "
+                                    f"this version of the app only knows up to {SCHEMA_VERSION}")
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        migration(cursor)
+        cursor.execute(f'PRAGMA user_version = {number}')
+    return version
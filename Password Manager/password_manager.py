@@ -1,8 +1,24 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
+from tkinter import ttk, messagebox, simpledialog, filedialog
 from database import Database
+from search import VaultSearch
+from vault_list import VaultList
+from jobs import JobRunner
+import breach
+import migrations
+import strength
+import transfer
 from password_utils import PasswordGenerator, PasswordStrength
 
+# Shown in place of every password in the list. Fixed width, so the list
+# needs no decryption and does not hint at password lengths.
+PASSWORD_MASK = "•" * 8
+
+SEARCH_DELAY_MS = 150   # Typing pause before a search runs
+SEARCH_POLL_MS = 25     # How often the UI checks for search results
+
+PASSPHRASE_WORDS = 6    # About 66 bits
+
 class PasswordManagerApp:
     def __init__(self, root):
         self.root = root
@@ -11,7 +27,13 @@ class PasswordManagerApp:
         self.root.configure(bg="#f0f0f0")
         
         self.db = Database()
-        self.master_password = None
+        if self.db.upgraded_from is not None:
+            print(f"Database schema upgraded from version {self.db.upgraded_from} to {migrations.SCHEMA_VERSION}")
+        self.jobs = JobRunner(self.root)
+        self.breaches = breach.load_corpus()  # None until a corpus is built with breach.py
+        self.searcher = VaultSearch(self.db)
+        self.search_job = None
+        self.search_poll = None
         self.current_password_id = None
         
         self.show_login_screen()
@@ -61,6 +83,10 @@ class PasswordManagerApp:
         button_frame = tk.Frame(main_frame, bg="#f0f0f0")
         button_frame.pack(pady=20)
         
+        self.login_status = tk.Label(main_frame, text="", font=("Arial", 10), bg="#f0f0f0", fg="#666666")
+        self.login_status.pack()
+        self.login_busy = False
+        
         if self.db.has_master_password():
             login_btn = tk.Button(
                 button_frame,
@@ -107,36 +133,59 @@ class PasswordManagerApp:
             messagebox.showerror("Error", "Passwords do not match")
             return
         
-        # Hash and store master password
-        password_hash = self.db.hash_password(password)
-        self.db.set_master_password(password_hash)
-        self.master_password = password
-        
+        # Create the vault; it stays unlocked for this session
+        self.set_login_busy("Creating vault...")
+        self.jobs.submit(self.db.create_vault, password, on_done=self.on_vault_created, on_error=self.on_login_error)
+    
+    def on_vault_created(self, result):
         messagebox.showinfo("Success", "Master password set successfully!")
         self.show_main_screen()
     
+    def set_login_busy(self, status=None):
+        """Show what the login screen is waiting for, and ignore input meanwhile"""
+        self.login_busy = status is not None
+        self.login_status.config(text=status or "")
+        self.master_password_entry.config(state="disabled" if self.login_busy else "normal")
+    
+    def on_login_error(self, error):
+        self.set_login_busy()
+        messagebox.showerror("Error", f"Could not open the vault: {error}")
+    
     def authenticate(self):
         """Authenticate user with master password"""
+        if self.login_busy:
+            return
         password = self.master_password_entry.get()
         
         if not password:
             messagebox.showerror("Error", "Please enter master password")
             return
         
-        stored_hash = self.db.get_master_password_hash()
-        if not stored_hash:
+        if not self.db.has_master_password():
             messagebox.showerror("Error", "No master password found")
             return
         
-        password_hash = self.db.hash_password(password)
-        
-        if password_hash == stored_hash:
-            self.master_password = password
+        # Derive the master key once (slow on purpose, so in the background);
+        # rows are then decrypted with the cached data key
+        self.set_login_busy("Unlocking...")
+        self.jobs.submit(self.db.unlock, password, on_done=self.on_unlock, on_error=self.on_login_error)
+    
+    def on_unlock(self, unlocked):
+        if unlocked:
             self.show_main_screen()
+            # Entries saved before the health report existed get their fingerprints once
+            self.jobs.submit(self.db.assess_missing)
+            self.continue_ciphertext_upgrade(0)
         else:
+            self.set_login_busy()
             messagebox.showerror("Error", "Incorrect master password")
             self.master_password_entry.delete(0, tk.END)
     
+    def continue_ciphertext_upgrade(self, last_id):
+        """Re-encrypt older rows in the current format, one batch per job, so user actions queue in between"""
+        if last_id is not None and self.db.is_unlocked():
+            self.jobs.submit(self.db.upgrade_ciphertext, last_id, on_done=self.continue_ciphertext_upgrade)
+    
     def show_main_screen(self):
         """Display the main password management screen"""
         # Clear the window
@@ -172,6 +221,58 @@ class PasswordManagerApp:
         )
         logout_btn.pack(side=tk.RIGHT)
         
+        change_master_btn = tk.Button(
+            header_frame,
+            text="Change Master Password",
+            font=("Arial", 10),
+            bg="#607D8B",
+            fg="white",
+            padx=15,
+            pady=5,
+            cursor="hand2",
+            command=self.change_master_password
+        )
+        change_master_btn.pack(side=tk.RIGHT, padx=5)
+        
+        export_btn = tk.Button(
+            header_frame,
+            text="Export",
+            font=("Arial", 10),
+            bg="#607D8B",
+            fg="white",
+            padx=15,
+            pady=5,
+            cursor="hand2",
+            command=self.export_passwords
+        )
+        export_btn.pack(side=tk.RIGHT, padx=5)
+        
+        import_btn = tk.Button(
+            header_frame,
+            text="Import",
+            font=("Arial", 10),
+            bg="#607D8B",
+            fg="white",
+            padx=15,
+            pady=5,
+            cursor="hand2",
+            command=self.import_passwords
+        )
+        import_btn.pack(side=tk.RIGHT, padx=5)
+        
+        self.metadata_btn = tk.Button(
+            header_frame,
+            text=self.metadata_button_text(),
+            font=("Arial", 10),
+            bg="#607D8B",
+            fg="white",
+            padx=15,
+            pady=5,
+            cursor="hand2",
+            command=self.toggle_metadata_encryption
+        )
+        self.metadata_btn.pack(side=tk.RIGHT, padx=5)
+        
         # Search frame
         search_frame = tk.Frame(container, bg="#f0f0f0")
         search_frame.pack(fill=tk.X, pady=(0, 10))
@@ -190,7 +291,7 @@ class PasswordManagerApp:
             width=30
         )
         self.search_entry.pack(side=tk.LEFT, padx=5)
-        self.search_entry.bind("<KeyRelease>", lambda e: self.search_passwords())
+        self.search_entry.bind("<KeyRelease>", lambda e: self.schedule_search())
         
         refresh_btn = tk.Button(
             search_frame,
@@ -240,6 +341,11 @@ class PasswordManagerApp:
         
         self.password_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         self.password_tree.bind("<Double-1>", self.on_item_select)
+        self.vault_list = VaultList(
+            self.password_tree,
+            scrollbar,
+            lambda pwd: (pwd['website'], pwd['username'], PASSWORD_MASK)
+        )
         
         # Buttons frame for view tab
         view_buttons = tk.Frame(view_frame, bg="#f0f0f0")
@@ -284,6 +390,32 @@ class PasswordManagerApp:
         )
         view_btn.pack(side=tk.LEFT, padx=5)
         
+        audit_btn = tk.Button(
+            view_buttons,
+            text="Breach Audit",
+            font=("Arial", 10, "bold"),
+            bg="#607D8B",
+            fg="white",
+            padx=20,
+            pady=5,
+            cursor="hand2",
+            command=self.audit_breaches
+        )
+        audit_btn.pack(side=tk.RIGHT, padx=5)
+        
+        health_btn = tk.Button(
+            view_buttons,
+            text="Health Report",
+            font=("Arial", 10, "bold"),
+            bg="#607D8B",
+            fg="white",
+            padx=20,
+            pady=5,
+            cursor="hand2",
+            command=self.show_health_report
+        )
+        health_btn.pack(side=tk.RIGHT, padx=5)
+        
         # Add password tab
         add_frame = tk.Frame(notebook, bg="#f0f0f0")
         notebook.add(add_frame, text="Add/Edit Password")
@@ -462,6 +594,19 @@ class PasswordManagerApp:
         )
         generate_btn.pack(side=tk.LEFT, padx=10)
         
+        passphrase_btn = tk.Button(
+            gen_options_frame,
+            text="Passphrase",
+            font=("Arial", 10, "bold"),
+            bg="#9C27B0",
+            fg="white",
+            padx=15,
+            pady=5,
+            cursor="hand2",
+            command=self.generate_passphrase
+        )
+        passphrase_btn.pack(side=tk.LEFT)
+        
         # Submit button
         submit_frame = tk.Frame(form_frame, bg="#f0f0f0")
         submit_frame.pack(pady=30)
@@ -495,37 +640,46 @@ class PasswordManagerApp:
         # Load passwords
         self.refresh_passwords()
     
+    def schedule_search(self):
+        """Search once typing pauses, rather than on every keystroke"""
+        if self.search_job:
+            self.root.after_cancel(self.search_job)
+        self.search_job = self.root.after(SEARCH_DELAY_MS, self.search_passwords)
+    
     def search_passwords(self):
-        """Search passwords based on query"""
-        query = self.search_entry.get().strip()
-        
-        if query:
-            passwords = self.db.search_passwords(query, self.master_password)
-        else:
-            passwords = self.db.get_all_passwords(self.master_password)
-        
-        self.populate_tree(passwords)
+        """Search passwords based on query (in the background)"""
+        self.search_job = None
+        self.jobs.cancel('list')
+        self.searcher.submit(self.search_entry.get())
+        if self.search_poll is None:
+            self.poll_search()
+    
+    def poll_search(self):
+        """Show search results once they arrive"""
+        self.search_poll = None
+        passwords = self.searcher.latest()
+        if passwords is not None:
+            self.populate_tree(passwords, reset=True)
+        elif self.searcher.pending():
+            self.search_poll = self.root.after(SEARCH_POLL_MS, self.poll_search)
+    
+    def cancel_search(self):
+        """Drop any pending or running search"""
+        for job in (self.search_job, self.search_poll):
+            if job:
+                self.root.after_cancel(job)
+        self.search_job = self.search_poll = None
+        self.searcher.cancel()
     
     def refresh_passwords(self):
         """Refresh the password list"""
+        self.cancel_search()
         self.search_entry.delete(0, tk.END)
-        passwords = self.db.get_all_passwords(self.master_password)
-        self.populate_tree(passwords)
-    
-    def populate_tree(self, passwords):
-        """Populate the treeview with password entries"""
-        # Clear existing items
-        for item in self.password_tree.get_children():
-            self.password_tree.delete(item)
-        
-        # Add passwords
-        for pwd in passwords:
-            self.password_tree.insert(
-                "",
-                tk.END,
-                text=pwd['id'],
-                values=(pwd['website'], pwd['username'], "•" * len(pwd['password']))
-            )
+        self.jobs.submit(self.db.list_passwords, key='list', on_done=self.populate_tree)
+    
+    def populate_tree(self, passwords, reset=False):
+        """Show password entries, updating only rows that changed"""
+        self.vault_list.show(passwords, reset)
     
     def on_item_select(self, event):
         """Handle double-click on password item"""
@@ -543,10 +697,16 @@ class PasswordManagerApp:
         item = self.password_tree.item(selection[0])
         password_id = int(item['text'])
         
-        passwords = self.db.get_all_passwords(self.master_password)
-        password = next((p for p in passwords if p['id'] == password_id), None)
-        
+        # Only the opened entry is decrypted, on the job runner: an import can hold the connection for a while
+        self.jobs.submit(self.db.get_password, password_id, True, key='open', on_done=self.show_password_details)
+    
+    def show_password_details(self, password):
+        """Show one decrypted entry in a dialog"""
         if password:
+            if password['password'] is None:
+                messagebox.showerror("Error", "This entry could not be decrypted")
+                return
+            
             details_window = tk.Toplevel(self.root)
             details_window.title("Password Details")
             details_window.geometry("400x200")
@@ -623,7 +783,9 @@ class PasswordManagerApp:
         item = self.password_tree.item(selection[0])
         password_id = int(item['text'])
         
-        self.db.delete_password(password_id)
+        self.jobs.submit(self.db.delete_password, password_id, on_done=self.on_deleted, on_error=self.on_save_error)
+    
+    def on_deleted(self, result):
         messagebox.showinfo("Success", "Password deleted successfully")
         self.refresh_passwords()
     
@@ -637,11 +799,16 @@ class PasswordManagerApp:
         item = self.password_tree.item(selection[0])
         password_id = int(item['text'])
         
-        passwords = self.db.get_all_passwords(self.master_password)
-        password = next((p for p in passwords if p['id'] == password_id), None)
-        
+        self.jobs.submit(self.db.get_password, password_id, True, key='open', on_done=self.load_password_form)
+    
+    def load_password_form(self, password):
+        """Put one decrypted entry into the edit form"""
         if password:
-            self.current_password_id = password_id
+            if password['password'] is None:
+                messagebox.showerror("Error", "This entry could not be decrypted")
+                return
+            
+            self.current_password_id = password['id']
             self.website_entry.delete(0, tk.END)
             self.website_entry.insert(0, password['website'])
             self.username_entry.delete(0, tk.END)
@@ -666,26 +833,43 @@ class PasswordManagerApp:
         
         if self.current_password_id:
             # Update existing
-            self.db.update_password(
+            self.jobs.submit(
+                self.db.update_password,
                 self.current_password_id,
                 website,
                 username,
                 password,
-                self.master_password
+                on_done=lambda reused: self.on_saved("Password updated successfully", reused),
+                on_error=self.on_save_error
             )
-            messagebox.showinfo("Success", "Password updated successfully")
             self.current_password_id = None
         else:
             # Add new
-            self.db.add_password(
+            self.jobs.submit(
+                self.db.add_password,
                 website,
                 username,
                 password,
-                self.master_password
+                on_done=lambda reused: self.on_saved("Password saved successfully", reused),
+                on_error=self.on_save_error
             )
-            messagebox.showinfo("Success", "Password saved successfully")
         
+        # The job has its own copy of the values; clearing now also stops a double save
         self.clear_form()
+    
+    def on_saved(self, message, reused=0):
+        if reused:
+            messagebox.showwarning(
+                "Password Reused",
+                f"{message}\n\nThis password is also used for {reused} other "
+                f"{'entry' if reused == 1 else 'entries'}. Use a different password for each site."
+            )
+        else:
+            messagebox.showinfo("Success", message)
+        self.refresh_passwords()
+    
+    def on_save_error(self, error):
+        messagebox.showerror("Error", f"Could not save changes: {error}")
         self.refresh_passwords()
     
     def clear_form(self):
@@ -713,13 +897,26 @@ class PasswordManagerApp:
         except ValueError as e:
             messagebox.showerror("Error", str(e))
     
+    def generate_passphrase(self):
+        """Generate a random passphrase, with a capital and a digit for sites that require them"""
+        passphrase = PasswordGenerator.passphrase(words=PASSPHRASE_WORDS, capitalize=True, include_number=True)
+        self.password_entry.delete(0, tk.END)
+        self.password_entry.insert(0, passphrase)
+        self.update_strength_indicator()
+    
     def update_strength_indicator(self):
         """Update password strength indicator"""
         password = self.password_entry.get()
         if password:
-            score, strength, color, feedback = PasswordStrength.analyze(password)
+            estimate = PasswordStrength.estimate(password)
+            text = f"{estimate['strength']} (~{estimate['bits']:.0f} bits)"
+            color = estimate['color']
+            breached = self.breaches.occurrences(password) if self.breaches else 0
+            if breached:
+                text = f"Breached: seen {breached:,} times in known leaks"
+                color = "#FF0000"
             self.strength_label.config(
-                text=f"{strength} ({score}/9)",
+                text=text,
                 fg=color,
                 bg="#f0f0f0"
             )
@@ -741,9 +938,249 @@ class PasswordManagerApp:
         self.root.clipboard_append(text)
         messagebox.showinfo("Copied", "Password copied to clipboard!")
     
+    def change_master_password(self):
+        """Change the master password (re-wraps the vault key; stored passwords are not re-encrypted)"""
+        old_password = simpledialog.askstring("Change Master Password", "Current master password:", show="*")
+        if not old_password:
+            return
+        new_password = simpledialog.askstring("Change Master Password", "New master password:", show="*")
+        if not new_password:
+            return
+        if len(new_password) < 8:
+            messagebox.showerror("Error", "Master password must be at least 8 characters long")
+            return
+        confirm = simpledialog.askstring("Change Master Password", "Re-enter new master password:", show="*")
+        if new_password != confirm:
+            messagebox.showerror("Error", "Passwords do not match")
+            return
+        
+        self.jobs.submit(
+            self.db.change_master_password,
+            old_password,
+            new_password,
+            on_done=self.on_master_password_changed,
+            on_error=self.on_save_error
+        )
+    
+    def on_master_password_changed(self, changed):
+        if changed:
+            messagebox.showinfo("Success", "Master password changed successfully")
+        else:
+            messagebox.showerror("Error", "Incorrect master password")
+    
+    def metadata_button_text(self):
+        return "Site Names: Encrypted" if self.db.metadata_encrypted else "Site Names: Plain"
+    
+    def toggle_metadata_encryption(self):
+        """Switch between plaintext and encrypted website/username storage"""
+        enable = not self.db.metadata_encrypted
+        if enable:
+            question = ("Encrypt website names and usernames in the database file?\n\n"
+                        "Search then matches the start of words only (no typo tolerance).")
+        else:
+            question = "Store website names and usernames as plain text again?"
+        if not messagebox.askyesno("Site Names", question):
+            return
+        
+        window, progress = self.show_progress("Updating vault")
+        
+        def done(result):
+            window.destroy()
+            self.metadata_btn.config(text=self.metadata_button_text())
+            self.refresh_passwords()
+        
+        def failed(error):
+            window.destroy()
+            messagebox.showerror("Error", f"Could not update the vault: {error}")
+        
+        self.jobs.submit(self.db.set_metadata_encryption, enable, on_done=done, on_error=failed)
+    
+    def audit_breaches(self):
+        """Check every stored password against the local breach corpus"""
+        if self.breaches is None:
+            messagebox.showinfo(
+                "Breach Audit",
+                "No breach corpus found.\n\nDownload the Have I Been Pwned password hashes (SHA-1) and run:\n"
+                f"python breach.py build <download>\n\nto create {breach.CORPUS_FILE} next to the app."
+            )
+            return
+        
+        window, progress = self.show_progress("Checking passwords")
+        
+        def done(breached):
+            window.destroy()
+            self.show_audit_results(breached)
+        
+        def failed(error):
+            window.destroy()
+            messagebox.showerror("Error", f"Audit failed: {error}")
+        
+        self.jobs.submit(breach.audit_vault, self.db, self.breaches,
+                         on_done=done, on_error=failed, on_progress=progress)
+    
+    def show_audit_results(self, breached):
+        """List entries whose password appears in the breach corpus"""
+        if not breached:
+            messagebox.showinfo("Breach Audit", "None of your passwords appear in the breach corpus.")
+            return
+        
+        results_window = tk.Toplevel(self.root)
+        results_window.title("Breach Audit")
+        results_window.geometry("600x350")
+        results_window.configure(bg="#f0f0f0")
+        
+        tk.Label(
+            results_window,
+            text=f"{len(breached)} passwords appear in known breaches. Change them.",
+            font=("Arial", 11),
+            bg="#f0f0f0",
+            fg="#FF0000"
+        ).pack(pady=10)
+        
+        tree = ttk.Treeview(results_window, columns=("Website", "Username", "Seen"), show="headings")
+        tree.heading("Website", text="Website")
+        tree.heading("Username", text="Username")
+        tree.heading("Seen", text="Times Seen")
+        tree.column("Seen", width=100, anchor="e")
+        for entry, count in breached:
+            tree.insert("", tk.END, values=(entry['website'], entry['username'], f"{count:,}"))
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+    
+    def show_health_report(self):
+        """Reused, weak and stale passwords, from the fingerprints and scores kept with each entry"""
+        def failed(error):
+            messagebox.showerror("Error", f"Could not build the report: {error}")
+        
+        self.jobs.submit(self.db.health_report, on_done=self.show_health_results, on_error=failed)
+    
+    def show_health_results(self, report):
+        results_window = tk.Toplevel(self.root)
+        results_window.title("Health Report")
+        results_window.geometry("650x450")
+        results_window.configure(bg="#f0f0f0")
+        
+        reused_entries = sum(len(group) for group in report['reused'])
+        summary = [
+            f"{report['total']} entries: {reused_entries} share a password, "
+            f"{len(report['weak'])} are weak, {len(report['stale'])} unchanged for over a year",
+            "Last changed: " + ", ".join(f"{label} {count}" for label, count in report['ages'])
+        ]
+        if report['unassessed']:
+            summary.append(f"{report['unassessed']} entries are still being checked; reopen the report shortly")
+        tk.Label(
+            results_window,
+            text="\n".join(summary),
+            font=("Arial", 10),
+            bg="#f0f0f0",
+            justify=tk.LEFT
+        ).pack(pady=10)
+        
+        tree = ttk.Treeview(results_window, columns=("Website", "Username", "Issue"), show="headings")
+        tree.heading("Website", text="Website")
+        tree.heading("Username", text="Username")
+        tree.heading("Issue", text="Issue")
+        for group in report['reused']:
+            for entry in group:
+                tree.insert("", tk.END, values=(entry['website'], entry['username'],
+                                                f"Same password as {len(group) - 1} other(s)"))
+        for entry, score in report['weak']:
+            tree.insert("", tk.END, values=(entry['website'], entry['username'],
+                                            f"Weak ({strength.LEVELS[score][0]})"))
+        for entry, days in report['stale']:
+            tree.insert("", tk.END, values=(entry['website'], entry['username'],
+                                            f"Unchanged for {days // 365} year(s)"))
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+    
+    def show_progress(self, title):
+        """Small window counting through a long operation. Returns (window, progress callback)."""
+        window = tk.Toplevel(self.root)
+        window.title(title)
+        window.geometry("300x80")
+        window.configure(bg="#f0f0f0")
+        window.transient(self.root)
+        
+        label = tk.Label(window, text="Starting...", font=("Arial", 10), bg="#f0f0f0")
+        label.pack(pady=(15, 5))
+        bar = ttk.Progressbar(window, mode="indeterminate", length=250)
+        bar.pack()
+        
+        def progress(done, total):
+            if total:
+                bar.config(mode="determinate", maximum=total, value=done)
+                label.config(text=f"{done} of {total} entries")
+            else:
+                bar.step()
+                label.config(text=f"{done} entries")
+        
+        return window, progress
+    
+    def import_passwords(self):
+        """Import entries from a browser, another password manager or an export"""
+        path = filedialog.askopenfilename(
+            title="Import Passwords",
+            filetypes=[("Password exports", "*.csv *.json *.pmx"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+        password = None
+        if transfer.is_encrypted_export(path):
+            password = simpledialog.askstring("Import", "Export password:", show="*")
+            if password is None:
+                return
+        
+        window, progress = self.show_progress("Importing")
+        
+        def done(count):
+            window.destroy()
+            messagebox.showinfo("Success", f"Imported {count} passwords")
+            self.refresh_passwords()
+        
+        def failed(error):
+            window.destroy()
+            messagebox.showerror("Error", f"Import failed: {error}")
+        
+        self.jobs.submit(transfer.import_entries, self.db, path, password,
+                         on_done=done, on_error=failed, on_progress=progress)
+    
+    def export_passwords(self):
+        """Export the vault to a file encrypted with its own password"""
+        path = filedialog.asksaveasfilename(
+            title="Export Passwords",
+            defaultextension=".pmx",
+            filetypes=[("Password Manager export", "*.pmx")]
+        )
+        if not path:
+            return
+        password = simpledialog.askstring("Export", "Password for the export file:", show="*")
+        if not password:
+            return
+        if len(password) < 8:
+            messagebox.showerror("Error", "Export password must be at least 8 characters long")
+            return
+        confirm = simpledialog.askstring("Export", "Re-enter the export password:", show="*")
+        if password != confirm:
+            messagebox.showerror("Error", "Passwords do not match")
+            return
+        
+        window, progress = self.show_progress("Exporting")
+        
+        def done(count):
+            window.destroy()
+            messagebox.showinfo("Success", f"Exported {count} passwords")
+        
+        def failed(error):
+            window.destroy()
+            messagebox.showerror("Error", f"Export failed: {error}")
+        
+        self.jobs.submit(transfer.export_entries, self.db, path, password,
+                         on_done=done, on_error=failed, on_progress=progress)
+    
     def logout(self):
         """Logout and return to login screen"""
-        self.master_password = None
+        self.cancel_search()
+        self.jobs.cancel_all()
+        # Queued behind any pending saves, which still need the key
+        self.jobs.submit(self.db.lock)
         self.show_login_screen()
 
 
@@ -751,6 +1188,11 @@ def main():
     root = tk.Tk()
     app = PasswordManagerApp(root)
     root.mainloop()
+    app.searcher.close()
+    app.jobs.shutdown()
+    if app.breaches:
+        app.breaches.close()
+    app.db.close()
 
 
 if __name__ == "__main__":
@@ -1,30 +1,153 @@
-import random
+import os
+import secrets
 import string
 import re
+from array import array
+from functools import lru_cache
+from strength import Estimator
+
+SYMBOLS = "!@#$%^&*()_+-=[]{}|;:,.<>?"
+WORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'passphrase_words.txt')
+
+@lru_cache(maxsize=16)
+def byte_mapping(alphabet):
+    """bytes.translate arguments mapping a random byte to a character of `alphabet`.
+    
+    Byte b becomes alphabet[b % len(alphabet)]. Bytes at or above the largest
+    multiple of len(alphabet) are deleted instead (rejection sampling), so no
+    character is more likely than another.
+    """
+    size = len(alphabet)
+    limit = 256 - 256 % size
+    table = bytes(ord(alphabet[b % size]) for b in range(256))
+    return table, bytes(range(limit, 256)), limit
+
+def random_text(alphabet, count):
+    """`count` characters drawn uniformly from `alphabet` (at most 256 ASCII characters).
+    
+    Random bytes come from `secrets` in one call per batch and are mapped in C
+    by bytes.translate, instead of one random call per character.
+    """
+    table, rejected, limit = byte_mapping(alphabet)
+    chunks = []
+    have = 0
+    while have < count:
+        # Enough bytes to survive the expected rejections, plus a little slack
+        wanted = (count - have) * 256 // limit + 16
+        chunk = secrets.token_bytes(wanted).translate(table, rejected)
+        chunks.append(chunk)
+        have += len(chunk)
+    return b''.join(chunks)[:count].decode('ascii')
+
+def random_indices(size, count):
+    """`count` integers drawn uniformly from range(size), for size up to 65536"""
+    limit = 65536 - 65536 % size
+    result = []
+    while len(result) < count:
+        wanted = (count - len(result)) * 65536 // limit + 4
+        samples = array('H', secrets.token_bytes(2 * wanted))
+        result.extend(sample % size for sample in samples if sample < limit)
+    return result[:count]
 
 class PasswordGenerator:
+    wordlist = None  # Passphrase words, loaded on first use
+    
     @staticmethod
     def generate(length=16, include_uppercase=True, include_lowercase=True, 
                  include_numbers=True, include_symbols=True):
         """Generate a random password with specified criteria"""
-        characters = ""
+        return PasswordGenerator.generate_many(1, length, include_uppercase, include_lowercase,
+                                               include_numbers, include_symbols)[0]
+    
+    @staticmethod
+    def generate_many(count, length=16, include_uppercase=True, include_lowercase=True,
+                      include_numbers=True, include_symbols=True):
+        """Generate `count` random passwords, each with at least one character of every selected type.
         
+        Characters are drawn uniformly from the combined alphabet using the
+        `secrets` CSPRNG. A password missing a selected type is thrown away
+        and drawn again, which keeps every qualifying password equally likely
+        (forcing one character per type would not).
+        """
+        classes = []
         if include_lowercase:
-            characters += string.ascii_lowercase
+            classes.append(string.ascii_lowercase)
         if include_uppercase:
-            characters += string.ascii_uppercase
+            classes.append(string.ascii_uppercase)
         if include_numbers:
-            characters += string.digits
+            classes.append(string.digits)
         if include_symbols:
-            characters += "!@#$%^&*()_+-=[]{}|;:,.<>?"
+            classes.append(SYMBOLS)
         
-        if not characters:
+        if not classes:
             raise ValueError("At least one character type must be selected")
+        if length < len(classes):
+            raise ValueError(f"Length must be at least {len(classes)} to include every selected character type")
+        
+        alphabet = ''.join(classes)
+        class_sets = [frozenset(characters) for characters in classes]
+        passwords = []
+        while len(passwords) < count:
+            text = random_text(alphabet, (count - len(passwords)) * length)
+            for start in range(0, len(text), length):
+                password = text[start:start + length]
+                if all(not characters.isdisjoint(password) for characters in class_sets):
+                    passwords.append(password)
+        return passwords
+    
+    @classmethod
+    def load_words(cls):
+        if cls.wordlist is None:
+            with open(WORDS_FILE, encoding='utf-8') as f:
+                cls.wordlist = tuple(line.strip() for line in f if line.strip())
+        return cls.wordlist
+    
+    @classmethod
+    def passphrase(cls, words=6, separator='-', capitalize=False, include_number=False):
+        """Generate a diceware-style passphrase of random words"""
+        return cls.passphrases(1, words, separator, capitalize, include_number)[0]
+    
+    @classmethod
+    def passphrases(cls, count, words=6, separator='-', capitalize=False, include_number=False):
+        """Generate `count` passphrases of `words` words from passphrase_words.txt.
         
-        password = ''.join(random.choice(characters) for _ in range(length))
-        return password
+        Each word adds about 11 bits (2044 words). `capitalize` capitalises
+        every word and `include_number` appends a digit to the last one, for
+        sites that insist on those character types.
+        """
+        if words < 1:
+            raise ValueError("A passphrase needs at least one word")
+        wordlist = cls.load_words()
+        picks = random_indices(len(wordlist), count * words)
+        digits = random_text(string.digits, count) if include_number else ''
+        
+        results = []
+        for i in range(count):
+            chosen = [wordlist[index] for index in picks[i * words:(i + 1) * words]]
+            if capitalize:
+                chosen = [word.capitalize() for word in chosen]
+            if include_number:
+                chosen[-1] += digits[i]
+            results.append(separator.join(chosen))
+        return results
 
 class PasswordStrength:
+    estimator = None  # Shared by estimate(); created on first use
+    
+    @classmethod
+    def estimate(cls, password):
+        """Estimate how many guesses the password would take (see strength.py).
+        
+        Returns a dict with guesses, bits, score (0-4), strength, color and
+        feedback. Successive calls reuse the work for the unchanged start of
+        the password, so this is cheap enough for every keystroke. Call it
+        from the Tk thread only; other threads should use their own
+        strength.Estimator.
+        """
+        if cls.estimator is None:
+            cls.estimator = Estimator()
+        return cls.estimator.estimate(password)
+    
     @staticmethod
     def analyze(password):
         """Analyze password strength and return score and feedback"""
@@ -0,0 +1,108 @@
+import queue
+import sqlite3
+import threading
+
+class VaultSearch:
+    """Runs vault searches on a background thread so typing never waits on SQLite.
+    
+    The thread has its own read connection. Each `submit` supersedes the
+    previous query: a query still running is interrupted, queued ones are
+    skipped, and results that arrive late are thrown away. The Tk thread
+    collects the newest results with `latest`. A query that fails for any
+    other reason (the vault locked under it, unreadable metadata) answers
+    with no results, and the thread carries on with the next one.
+    """
+    
+    def __init__(self, db):
+        self.db = db
+        self.conn = None
+        self.thread = None
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.generation = 0    # Bumped by every submit and cancel
+        self.running = None    # Generation of the query on the connection right now
+        self.wanted = None     # Generation whose results the UI is still waiting for
+        self.lock = threading.Lock()
+    
+    def submit(self, query):
+        """Search in the background, abandoning any earlier query"""
+        with self.lock:
+            self.generation += 1
+            self.wanted = generation = self.generation
+            self.interrupt()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.requests.put((generation, query))
+    
+    def cancel(self):
+        """Forget any query in flight"""
+        with self.lock:
+            self.generation += 1
+            self.wanted = None
+            self.interrupt()
+    
+    def interrupt(self):
+        # Caller holds the lock
+        if self.running is not None and self.running != self.generation and self.conn is not None:
+            self.conn.interrupt()
+    
+    def pending(self):
+        return self.wanted is not None
+    
+    def latest(self):
+        """Results of the newest query once they have arrived, else None"""
+        found = None
+        while True:
+            try:
+                generation, results = self.results.get_nowait()
+            except queue.Empty:
+                break
+            with self.lock:
+                if generation == self.wanted:
+                    self.wanted = None
+                    found = results
+        return found
+    
+    def run(self):
+        """Search thread: answer the newest request, skipping any it superseded"""
+        while True:
+            request = self.requests.get()
+            while request is not None:
+                try:
+                    newer = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                request = newer
+            if request is None:
+                break
+            
+            generation, query = request
+            results = None
+            while results is None:
+                with self.lock:
+                    if generation != self.generation:
+                        break
+                    self.running = generation
+                try:
+                    if self.conn is None:
+                        self.conn = self.db.open_reader()
+                    results = self.db.search_passwords(query, self.conn)
+                except sqlite3.OperationalError as e:
+                    if 'interrupt' not in str(e):
+                        print(f"Search failed: {e}")
+                        results = []
+                    # Interrupted: retried below unless a newer query came in meanwhile
+                except Exception as e:
+                    print(f"Search failed: {e!r}")
+                    results = []
+                with self.lock:
+                    self.running = None
+            if results is not None:
+                self.results.put((generation, results))
+        if self.conn is not None:
+            self.conn.close()
+    
+    def close(self):
+        self.cancel()
+        self.requests.put(None)
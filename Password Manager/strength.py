@@ -0,0 +1,400 @@
+"""
+Password strength estimation in the style of zxcvbn.
+
+A password is rated by how an attacker would guess it: as the cheapest
+sequence of patterns that spells it out. The patterns are dictionary words
+(common passwords, English words, first names and surnames, allowing for
+capitals and l33t substitutions), keyboard walks, sequences like "abc" or
+"9753", repeats and years. Characters not covered by a pattern cost 10
+guesses each. The estimate is the product of the guesses along the
+cheapest split; its log2 is reported as bits and it sets the 0-4 score.
+
+The word lists in strength_words.txt are compiled on first use into one
+sorted array of reversed words. Every word ending at a position is found
+by walking back from it, one bisect per character, stopping as soon as no
+word ends with the text walked so far.
+
+Matching only ever looks backwards from each position, so the work done
+for a prefix of the password stays valid as it grows. Estimator keeps that
+work between calls and only matches the positions after the common prefix
+with the previous password, which makes a keystroke cost one position.
+"""
+
+import bisect
+import math
+import os
+import threading
+from datetime import date
+from functools import lru_cache
+
+WORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'strength_words.txt')
+
+BRUTEFORCE_CARDINALITY = 10   # Guesses per character not covered by a pattern
+MIN_SUBMATCH_GUESSES = 50     # Floor for a pattern that is only part of the password, so splits don't get too cheap
+MAX_SEQUENCE_DELTA = 5        # "aceg" is a sequence, "amz" is not
+MIN_YEAR_SPACE = 20
+REFERENCE_YEAR = date.today().year
+
+# Score n needs at least SCORE_THRESHOLDS[n - 1] guesses
+SCORE_THRESHOLDS = (1e3, 1e6, 1e8, 1e10)
+LEVELS = (
+    ("Very Weak", "#FF0000"),
+    ("Weak", "#FF6600"),
+    ("Fair", "#FFCC00"),
+    ("Good", "#66CC00"),
+    ("Strong", "#00CC00"),
+)
+
+L33T_TABLE = {
+    'a': '4@', 'b': '8', 'c': '({[<', 'e': '3', 'g': '69', 'i': '1!|', 'l': '1|7',
+    'o': '0', 's': '$5', 't': '+7', 'x': '%', 'z': '2',
+}
+
+def invert_l33t(table):
+    """Character -> the letters it may stand for, itself first"""
+    letters = {}
+    for letter, subs in table.items():
+        for sub in subs:
+            letters.setdefault(sub, [sub]).append(letter)
+    return letters
+
+UNL33T = invert_l33t(L33T_TABLE)
+
+# Keyboard rows as (column offset, keys); each key lists its unshifted then shifted character
+QWERTY = (
+    (0, '`~ 1! 2@ 3# 4$ 5% 6^ 7& 8* 9( 0) -_ =+'),
+    (1, 'qQ wW eE rR tT yY uU iI oO pP [{ ]} \\|'),
+    (1, 'aA sS dD fF gG hH jJ kK lL ;: \'"'),
+    (1, 'zZ xX cC vV bB nN mM ,< .> /?'),
+)
+KEYPAD = (
+    (1, '/ * -'),
+    (0, '7 8 9 +'),
+    (0, '4 5 6'),
+    (0, '1 2 3'),
+    (1, '0 .'),
+)
+# Neighbour offsets (row, column). Staggered rows give qwerty keys six neighbours.
+SLANTED = ((0, -1), (0, 1), (-1, 0), (-1, 1), (1, -1), (1, 0))
+ALIGNED = ((0, -1), (0, 1), (-1, -1), (-1, 0), (-1, 1), (1, -1), (1, 0), (1, 1))
+
+SECTION_FEEDBACK = {
+    'passwords': "This is similar to a commonly used password",
+    'english': "A word by itself is easy to guess",
+    'names': "Names and surnames by themselves are easy to guess",
+    'surnames': "Names and surnames by themselves are easy to guess",
+}
+PATTERN_FEEDBACK = {
+    'spatial': "Keyboard patterns like qwerty or zxcvb are easy to guess",
+    'sequence': "Sequences like abc or 6543 are easy to guess",
+    'repeat': "Repeated characters or blocks like aaa or abcabc are easy to guess",
+    'year': "Recent years are easy to guess",
+}
+
+def variations(changed, unchanged):
+    """Ways to pick which characters of a token were changed (capitalised, shifted, substituted)"""
+    if not changed or not unchanged:
+        return 2
+    return sum(math.comb(changed + unchanged, i) for i in range(1, min(changed, unchanged) + 1))
+
+def uppercase_variations(token):
+    if token == token.lower():
+        return 1
+    upper = sum(char.isupper() for char in token)
+    if token == token.upper() or (upper == 1 and (token[0].isupper() or token[-1].isupper())):
+        return 2  # All caps, or just the first or last letter
+    return variations(upper, sum(char.islower() for char in token))
+
+def l33t_variations(token, word):
+    token = token.lower()
+    result = 1
+    for sub, letter in {(t, w) for t, w in zip(token, word) if t != w}:
+        result *= variations(token.count(sub), token.count(letter))
+    return result
+
+def sequence_guesses(token, ascending):
+    if token[0] in 'aAzZ019':
+        base = 4      # Obvious starting points
+    elif token[0].isdigit():
+        base = 10
+    else:
+        base = 26
+    if not ascending:
+        base *= 2
+    return base * len(token)
+
+class Keyboard:
+    """Key adjacency for one layout, used to spot keyboard walks"""
+    
+    def __init__(self, name, rows, neighbours):
+        keys = {}
+        for row, (offset, row_keys) in enumerate(rows):
+            for column, key in enumerate(row_keys.split(), offset):
+                keys[row, column] = key
+        
+        self.name = name
+        self.adjacent = {}    # char -> {neighbouring char: direction}
+        self.shifted = set()
+        degree = 0
+        for (row, column), key in keys.items():
+            directions = {}
+            for direction, (dr, dc) in enumerate(neighbours):
+                neighbour = keys.get((row + dr, column + dc))
+                if neighbour:
+                    degree += 1
+                    directions.update((char, direction) for char in neighbour)
+            for char in key:
+                self.adjacent[char] = directions
+            self.shifted.update(key[1:])
+        self.starts = len(keys)
+        self.degree = degree / len(keys)
+    
+    def guesses(self, length, turns, shifted):
+        """Walks of this length with at most this many turns, from any key"""
+        guesses = 0
+        for i in range(2, length + 1):
+            for j in range(1, min(turns, i - 1) + 1):
+                guesses += math.comb(i - 1, j - 1) * self.starts * self.degree ** j
+        if shifted:
+            guesses *= variations(shifted, length - shifted)
+        return guesses
+
+KEYBOARDS = (Keyboard('qwerty', QWERTY, SLANTED), Keyboard('keypad', KEYPAD, ALIGNED))
+
+class Dictionary:
+    """Every word list, compiled into one sorted array of reversed words"""
+    
+    def __init__(self, path=WORDS_FILE):
+        best = {}
+        section, rank = None, 0
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line.startswith('['):
+                    section, rank = line.strip('[]'), 0
+                    continue
+                rank += 1
+                word = line.lower()
+                if word not in best or rank < best[word][0]:
+                    best[word] = (rank, section)
+        
+        ordered = sorted(best, key=lambda word: word[::-1])
+        self.reversed = [word[::-1] for word in ordered]
+        self.ranks = [best[word][0] for word in ordered]
+        self.sections = [best[word][1] for word in ordered]
+    
+    def words_ending_at(self, password, end):
+        """Every (start, word, rank, section) where password[start:end + 1] spells a word.
+        
+        Walking back, each character is read as itself (lowercased) and as
+        any letter it could be a l33t substitution for. A reading is dropped
+        as soon as no word ends with it.
+        """
+        found = []
+        readings = [('', 0)]   # (reversed text so far, where it sorts in self.reversed)
+        for start in range(end, -1, -1):
+            char = password[start]
+            letters = UNL33T.get(char, [char.lower()])
+            longer = []
+            for text, low in readings:
+                for letter in letters:
+                    candidate = text + letter
+                    index = bisect.bisect_left(self.reversed, candidate, low)
+                    if index == len(self.reversed) or not self.reversed[index].startswith(candidate):
+                        continue
+                    longer.append((candidate, index))
+                    if self.reversed[index] == candidate:
+                        found.append((start, candidate[::-1], self.ranks[index], self.sections[index]))
+            if not longer:
+                break
+            readings = longer
+        return found
+
+compiled = None
+compile_lock = threading.Lock()
+
+def dictionary():
+    """The compiled word lists, loaded on first use"""
+    global compiled
+    with compile_lock:
+        if compiled is None:
+            compiled = Dictionary()
+    return compiled
+
+@lru_cache(maxsize=1024)
+def block_guesses(block):
+    """Guesses for the block a repeat is made of"""
+    return Estimator().guesses(block)
+
+class Estimator:
+    """Incremental strength estimates for a password being typed.
+    
+    State is kept per position of the last password estimated, so one
+    Estimator should follow one input field. It is not thread-safe; use
+    one per thread.
+    """
+    
+    def __init__(self):
+        self.words = dictionary()
+        self.password = ''
+        self.best = [1]      # best[k]: fewest guesses for password[:k]
+        self.back = [None]   # back[k]: (start, match or None for brute force) ending the best split of password[:k]
+        self.whole = [None]  # whole[k]: the cheapest single match spelling all of password[:k], if any
+        self.spatial = []    # Per position: a walk run (start, turns, shifted, direction) per keyboard
+        self.sequence = []   # Per position: (start, delta) of the sequence run ending there
+    
+    def guesses(self, password):
+        """Fewest guesses to find the password, reusing the work for its common prefix with the last one"""
+        common = 0
+        limit = min(len(password), len(self.password))
+        while common < limit and password[common] == self.password[common]:
+            common += 1
+        del self.best[common + 1:]
+        del self.back[common + 1:]
+        del self.whole[common + 1:]
+        del self.spatial[common:]
+        del self.sequence[common:]
+        
+        self.password = password
+        for end in range(common, len(password)):
+            self.extend(end)
+        whole = self.whole[-1]
+        return min(self.best[-1], whole['guesses']) if whole else self.best[-1]
+    
+    def estimate(self, password):
+        """Guesses, bits, a 0-4 score with its label and color, and feedback for the password"""
+        if not password:
+            return {'guesses': 1, 'bits': 0.0, 'score': 0, 'strength': LEVELS[0][0],
+                    'color': LEVELS[0][1], 'feedback': ["Password is empty"]}
+        guesses = self.guesses(password)
+        score = sum(guesses >= threshold for threshold in SCORE_THRESHOLDS)
+        strength, color = LEVELS[score]
+        return {
+            'guesses': guesses,
+            'bits': math.log2(guesses),
+            'score': score,
+            'strength': strength,
+            'color': color,
+            'feedback': self.feedback(score)
+        }
+    
+    def extend(self, end):
+        """Find the patterns ending at `end` and extend the best split by one character"""
+        matches = self.dictionary_matches(end) + self.spatial_matches(end) + self.sequence_matches(end)
+        matches += self.repeat_matches(end) + self.year_matches(end)
+        
+        best = self.best[end] * BRUTEFORCE_CARDINALITY
+        back = (end, None)
+        whole = None
+        for match in matches:
+            if match['start'] == 0 and (whole is None or match['guesses'] < whole['guesses']):
+                whole = match
+            guesses = self.best[match['start']] * max(match['guesses'], MIN_SUBMATCH_GUESSES)
+            if guesses < best:
+                best, back = guesses, (match['start'], match)
+        self.best.append(best)
+        self.back.append(back)
+        self.whole.append(whole)
+    
+    def dictionary_matches(self, end):
+        matches = []
+        for start, word, rank, section in self.words.words_ending_at(self.password, end):
+            token = self.password[start:end + 1]
+            uppercase = uppercase_variations(token)
+            l33t = l33t_variations(token, word) if token.lower() != word else 1
+            matches.append({'pattern': 'dictionary', 'start': start, 'guesses': rank * uppercase * l33t,
+                            'section': section, 'uppercase': uppercase > 1, 'l33t': l33t > 1})
+        return matches
+    
+    def spatial_matches(self, end):
+        password = self.password
+        char = password[end]
+        runs = []
+        matches = []
+        for k, keyboard in enumerate(KEYBOARDS):
+            shifted = char in keyboard.shifted
+            direction = keyboard.adjacent.get(password[end - 1], {}).get(char) if end else None
+            if direction is None:
+                run = (end, 0, shifted, None)
+            else:
+                start, turns, shifted_before, last = self.spatial[end - 1][k]
+                run = (start, turns + (direction != last), shifted_before + shifted, direction)
+            runs.append(run)
+            
+            start, turns, shifted_count, _ = run
+            length = end - start + 1
+            if length >= 3:
+                matches.append({'pattern': 'spatial', 'start': start,
+                                'guesses': keyboard.guesses(length, turns, shifted_count)})
+        self.spatial.append(runs)
+        return matches
+    
+    def sequence_matches(self, end):
+        password = self.password
+        run = (end, None)
+        if end:
+            delta = ord(password[end]) - ord(password[end - 1])
+            if 0 < abs(delta) <= MAX_SEQUENCE_DELTA:
+                start, last = self.sequence[end - 1]
+                run = (start, delta) if delta == last else (end - 1, delta)
+        self.sequence.append(run)
+        
+        start, delta = run
+        if delta is None or end - start < 2:
+            return []
+        return [{'pattern': 'sequence', 'start': start,
+                 'guesses': sequence_guesses(password[start:end + 1], delta > 0)}]
+    
+    def repeat_matches(self, end):
+        """The shortest block repeated back to back, ending here"""
+        password = self.password
+        for size in range(1, (end + 1) // 2 + 1):
+            block = password[end - size + 1:end + 1]
+            start = end - 2 * size + 1
+            if password[start:start + size] != block:
+                continue
+            while start >= size and password[start - size:start] == block:
+                start -= size
+            count = (end + 1 - start) // size
+            return [{'pattern': 'repeat', 'start': start, 'guesses': block_guesses(block) * count}]
+        return []
+    
+    def year_matches(self, end):
+        token = self.password[end - 3:end + 1] if end >= 3 else ''
+        if not (token.isascii() and token.isdigit() and 1900 <= int(token) <= 2039):
+            return []
+        return [{'pattern': 'year', 'start': end - 3,
+                 'guesses': max(abs(int(token) - REFERENCE_YEAR), MIN_YEAR_SPACE)}]
+    
+    def feedback(self, score):
+        """Advice about the patterns in the best split, in the order they appear"""
+        if score >= 3:
+            return ["No predictable patterns found"]
+        whole = self.whole[-1]
+        if whole and whole['guesses'] <= self.best[-1]:
+            matches = [whole]
+            position = 0
+        else:
+            matches = []
+            position = len(self.password)
+        while position:
+            start, match = self.back[position]
+            if match:
+                matches.append(match)
+            position = start
+        
+        advice = []
+        for match in reversed(matches):
+            if match['pattern'] == 'dictionary':
+                messages = [SECTION_FEEDBACK.get(match['section'], SECTION_FEEDBACK['english'])]
+                if match['uppercase']:
+                    messages.append("Capitalization doesn't help very much")
+                if match['l33t']:
+                    messages.append("Predictable substitutions like '@' instead of 'a' don't help very much")
+            else:
+                messages = [PATTERN_FEEDBACK[match['pattern']]]
+            advice.extend(message for message in messages if message not in advice)
+        advice.append("Add another word or two; uncommon words are better")
+        return advice
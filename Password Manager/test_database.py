@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Tests for the vault database and the session around it
+"""
+
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import MagicMock
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import migrations
+from database import Database
+from jobs import JobRunner
+from password_manager import PasswordManagerApp
+
+MASTER_PASSWORD = 'correct horse battery staple'
+
+class TestVaultSession(unittest.TestCase):
+    """Test cases for unlocking and locking the vault"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.temp_dir, 'vault.db'))
+        self.db.create_vault(MASTER_PASSWORD)
+        self.db.add_password('example.com', 'alice', 'hunter2')
+    
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def test_lock_forgets_key(self):
+        """lock() drops the data key and everything derived from it"""
+        self.assertTrue(self.db.is_unlocked())
+        self.db.lock()
+        self.assertFalse(self.db.is_unlocked())
+        self.assertIsNone(self.db.data_key)
+        self.assertIsNone(self.db.cipher)
+        with self.assertRaises(RuntimeError):
+            self.db.session_key()
+    
+    def test_logout_locks_vault(self):
+        """Logging out runs lock() on the job runner and leaves no key in memory"""
+        app = MagicMock()
+        app.db = self.db
+        app.jobs = JobRunner(MagicMock())
+        PasswordManagerApp.logout(app)
+        app.jobs.executor.shutdown(wait=True)  # Let the queued lock job run
+        self.assertFalse(self.db.is_unlocked())
+        self.assertIsNone(self.db.data_key)
+        app.show_login_screen.assert_called_once()
+    
+    def test_unlock_after_lock(self):
+        """The connection still works after locking, and the master password unlocks it again"""
+        self.db.lock()
+        self.assertFalse(self.db.unlock('wrong password'))
+        self.assertTrue(self.db.unlock(MASTER_PASSWORD))
+        password_id = self.db.get_all_passwords()[0]['id']
+        self.assertEqual(self.db.get_password(password_id, decrypt=True)['password'], 'hunter2')
+    
+    def test_login_screen_while_busy(self):
+        """Once the vault is unlocked, asking whether it exists does not wait on the connection"""
+        held, release = threading.Event(), threading.Event()
+        
+        def import_running():
+            with self.db.transaction():
+                held.set()
+                release.wait()
+        
+        importer = threading.Thread(target=import_running)
+        importer.start()
+        held.wait()
+        try:
+            checker = threading.Thread(target=self.db.has_master_password, daemon=True)
+            checker.start()
+            checker.join(timeout=2)
+            self.assertFalse(checker.is_alive())
+        finally:
+            release.set()
+            importer.join()
+    
+    def test_open_entry_while_busy(self):
+        """Opening an entry does not wait on the connection from the Tk thread, e.g. during an import"""
+        password_id = self.db.get_all_passwords()[0]['id']
+        app = MagicMock()
+        app.db = self.db
+        app.jobs = JobRunner(MagicMock())
+        app.password_tree.item.return_value = {'text': str(password_id)}
+        held, release = threading.Event(), threading.Event()
+        
+        def import_running():
+            with self.db.transaction():
+                held.set()
+                release.wait()
+        
+        importer = threading.Thread(target=import_running)
+        importer.start()
+        held.wait()
+        try:
+            for open_entry in (PasswordManagerApp.view_password_details, PasswordManagerApp.edit_password):
+                opener = threading.Thread(target=open_entry, args=(app,), daemon=True)
+                opener.start()
+                opener.join(timeout=2)
+                self.assertFalse(opener.is_alive())
+            future = app.jobs.latest['open']
+        finally:
+            release.set()
+            importer.join()
+        self.assertEqual(future.result(timeout=5)['password'], 'hunter2')
+        app.jobs.executor.shutdown(wait=True)
+
+class TestMigrations(unittest.TestCase):
+    """Test cases for upgrading older schemas"""
+    
+    def test_upgrade_reported_not_printed(self):
+        """Opening a database records the version it was upgraded from and leaves output to the caller"""
+        temp_dir = tempfile.mkdtemp()
+        path = os.path.join(temp_dir, 'vault.db')
+        try:
+            output = io.StringIO()
+            with redirect_stdout(output):
+                db = Database(path)
+                db.close()
+                reopened = Database(path)
+                reopened.close()
+            self.assertEqual(output.getvalue(), '')
+            self.assertEqual(db.upgraded_from, 0)
+            self.assertIsNone(reopened.upgraded_from)
+        finally:
+            shutil.rmtree(temp_dir)
+    
+    def test_ciphertext_columns_become_blob(self):
+        """Migrating a version 2 vault declares the encrypted columns BLOB and keeps every value as it was"""
+        conn = sqlite3.connect(':memory:')
+        cursor = conn.cursor()
+        for migration in migrations.MIGRATIONS[:2]:
+            migration(cursor)
+        cursor.execute('PRAGMA user_version = 2')
+        cursor.executemany('''
+            INSERT INTO passwords (id, website, username, password_encrypted, domain, cipher_version)
+            VALUES (?, ?, 'alice', ?, ?, ?)
+        ''', [(1, 'old.com', 'gAAAAAfernet-token', 'old.com', 1),
+              (2, 'new.com', b'\x02nonce-and-ciphertext', 'new.com', 2),
+              (3, 'gone.com', b'\x02deleted', 'gone.com', 2)])
+        cursor.execute('INSERT INTO blind_index (token, password_id) VALUES (?, 2)', (b'token',))
+        cursor.execute('DELETE FROM passwords WHERE id = 3')
+        
+        self.assertEqual(migrations.migrate(cursor), 2)
+        cursor.execute('PRAGMA user_version')
+        self.assertEqual(cursor.fetchone()[0], migrations.SCHEMA_VERSION)
+        cursor.execute('PRAGMA table_info(passwords)')
+        types = {column[1]: column[2] for column in cursor.fetchall()}
+        for column in ('password_encrypted', 'metadata_encrypted', 'notes_encrypted'):
+            self.assertEqual(types[column], 'BLOB')
+        cursor.execute('SELECT id, password_encrypted, typeof(password_encrypted), domain, cipher_version FROM passwords')
+        self.assertEqual(cursor.fetchall(), [(1, 'gAAAAAfernet-token', 'text', 'old.com', 1),
+                                             (2, b'\x02nonce-and-ciphertext', 'blob', 'new.com', 2)])
+        
+        # Indexes and the blind index trigger come back; deleted ids are not reused
+        cursor.execute("SELECT name FROM sqlite_master WHERE tbl_name = 'passwords' AND type = 'index'")
+        self.assertIn('passwords_cipher_version', {row[0] for row in cursor.fetchall()})
+        cursor.execute("INSERT INTO passwords (website, username, password_encrypted) VALUES ('x', 'y', x'02')")
+        self.assertEqual(cursor.lastrowid, 4)
+        cursor.execute('DELETE FROM passwords WHERE id = 2')
+        cursor.execute('SELECT COUNT(*) FROM blind_index')
+        self.assertEqual(cursor.fetchone()[0], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Tests for the background vault search
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from search import VaultSearch
+
+def wait_for_results(searcher, timeout=5.0):
+    """Poll like the UI does until the newest query is answered"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        results = searcher.latest()
+        if results is not None:
+            return results
+        time.sleep(0.01)
+    raise AssertionError("Search was never answered")
+
+class TestVaultSearch(unittest.TestCase):
+    """Test cases for VaultSearch"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.temp_dir, 'vault.db'))
+        self.db.create_vault('master password')
+        self.db.add_passwords([('example.com', 'alice', 'pw1'), ('github.com', 'bob', 'pw2')])
+        self.searcher = VaultSearch(self.db)
+    
+    def tearDown(self):
+        self.searcher.close()
+        self.searcher.thread.join(5)
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def test_search_answers(self):
+        self.searcher.submit('github')
+        self.assertEqual([entry['website'] for entry in wait_for_results(self.searcher)], ['github.com'])
+        self.assertFalse(self.searcher.pending())
+    
+    def test_typo_search(self):
+        """A query with a typo falls back to trigram matching, with plain or encrypted site names"""
+        for query, website in (('githbu', 'github.com'), ('exampel', 'example.com')):
+            self.searcher.submit(query)
+            self.assertEqual([entry['website'] for entry in wait_for_results(self.searcher)], [website])
+        
+        self.db.set_metadata_encryption(True)
+        self.searcher.submit('githbu')
+        self.assertEqual(wait_for_results(self.searcher), [])  # The blind index has no typo tolerance
+        self.searcher.submit('github')
+        self.assertEqual([entry['website'] for entry in wait_for_results(self.searcher)], ['github.com'])
+    
+    def test_error_does_not_stop_thread(self):
+        """A query that raises is answered with no results, and later queries still run"""
+        with patch.object(self.db, 'search_passwords', side_effect=RuntimeError("Vault is locked")):
+            self.searcher.submit('example')
+            self.assertEqual(wait_for_results(self.searcher), [])
+        self.assertFalse(self.searcher.pending())
+        
+        self.searcher.submit('example')
+        self.assertEqual([entry['website'] for entry in wait_for_results(self.searcher)], ['example.com'])
+        self.assertTrue(self.searcher.thread.is_alive())
+
+if __name__ == '__main__':
+    unittest.main()
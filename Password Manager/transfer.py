@@ -0,0 +1,252 @@
+"""
+Bulk import and export for the password vault.
+
+Import reads CSV exports from browsers and other password managers
+(Chrome, Edge, Firefox, Bitwarden, LastPass, 1Password, KeePass),
+Bitwarden's JSON export, and this app's own encrypted export. Entries are
+streamed in batches: each batch is encrypted (in a process pool for big
+files) and inserted with executemany, all inside one transaction, so an
+import either lands completely or not at all.
+
+The export format is one JSON header line (KDF salt and parameters)
+followed by one Fernet token per line, each holding a JSON batch of
+entries. It is encrypted under a key derived from an export password, so
+the file can be read without the vault's master password but never holds
+plaintext.
+"""
+
+import base64
+import csv
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from cryptography.fernet import Fernet, InvalidToken
+from ciphers import RowCipher
+from database import KDF_PARAMS, SALT_SIZE
+from health import HealthIndex
+
+BATCH_SIZE = 1000                  # Entries per executemany / export line
+PARALLEL_MIN_ROWS = 5000           # Smaller jobs encrypt in-process; a pool costs more than it saves
+PARALLEL_MIN_BYTES = 512 * 1024    # Import files this big are assumed to hold that many rows
+IN_FLIGHT = 2                      # Batches queued per worker process
+
+EXPORT_FORMAT = 'password-manager-export'
+EXPORT_VERSION = 1
+
+# Header names used by common exports (compared lowercased), best first
+WEBSITE_COLUMNS = ('url', 'login_uri', 'website', 'web site', 'uri', 'hostname', 'name', 'title', 'account')
+USERNAME_COLUMNS = ('username', 'login_username', 'login name', 'user name', 'login', 'email')
+PASSWORD_COLUMNS = ('password', 'login_password')
+
+# Set in each worker process by init_worker
+worker_cipher = None
+worker_health = None
+
+def init_worker(data_key):
+    global worker_cipher, worker_health
+    worker_cipher = RowCipher(data_key)
+    worker_health = HealthIndex(data_key)
+
+def encrypt_batch(entries, cipher=None, health=None):
+    """(website, username, password) -> (website, username, password_encrypted, fingerprint, strength)"""
+    cipher = cipher or worker_cipher
+    health = health or worker_health
+    return [(website, username, cipher.encrypt(password, 'password_encrypted'), *health.assess(password))
+            for website, username, password in entries]
+
+def decrypt_batch(rows, cipher=None, health=None):
+    """(website, username, metadata_encrypted, password_encrypted) -> (website, username, password or None)"""
+    cipher = cipher or worker_cipher
+    entries = []
+    for website, username, metadata, encrypted in rows:
+        try:
+            if metadata is not None:
+                website, username = json.loads(cipher.decrypt(metadata, 'metadata_encrypted'))
+            password = cipher.decrypt(encrypted, 'password_encrypted')
+        except InvalidToken:
+            password = None
+        entries.append((website, username, password))
+    return entries
+
+def batched(iterable, size=BATCH_SIZE):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def crypt_batches(func, batches, data_key, parallel):
+    """Apply encrypt_batch or decrypt_batch to each batch, in order.
+    
+    In parallel mode a few batches per CPU are kept queued on a process
+    pool, so reading, crypto and writing overlap without the whole file
+    being held in memory.
+    """
+    if not parallel:
+        cipher = RowCipher(data_key)
+        health = HealthIndex(data_key)
+        for batch in batches:
+            yield func(batch, cipher, health)
+        return
+    
+    workers = os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(data_key,)) as pool:
+        in_flight = deque()
+        for batch in batches:
+            in_flight.append(pool.submit(func, batch))
+            if len(in_flight) >= workers * IN_FLIGHT:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+def find_column(header, names):
+    lowered = [name.strip().lower() for name in header]
+    for name in names:
+        if name in lowered:
+            return lowered.index(name)
+    return None
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        website = find_column(header, WEBSITE_COLUMNS)
+        username = find_column(header, USERNAME_COLUMNS)
+        password = find_column(header, PASSWORD_COLUMNS)
+        if website is None or password is None:
+            raise ValueError("Unrecognised CSV: expected a URL or name column and a password column")
+        
+        def field(row, column):
+            return row[column] if column is not None and column < len(row) else ''
+        
+        for row in reader:
+            yield field(row, website), field(row, username), field(row, password)
+
+def read_json(path):
+    """Bitwarden's JSON export, or a plain list of {website/url/name, username, password} objects"""
+    with open(path, encoding='utf-8-sig') as f:
+        data = json.load(f)
+    items = data.get('items', []) if isinstance(data, dict) else data
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        login = item.get('login')
+        if isinstance(login, dict):
+            uris = login.get('uris') or [{}]
+            yield uris[0].get('uri') or item.get('name') or '', login.get('username') or '', login.get('password') or ''
+        else:
+            website = item.get('website') or item.get('url') or item.get('name') or ''
+            yield website, item.get('username') or '', item.get('password') or ''
+
+def read_export_header(path):
+    """The header of one of our exports, or None if the file is something else"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            header = json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+    if isinstance(header, dict) and header.get('format') == EXPORT_FORMAT:
+        return header
+    return None
+
+def is_encrypted_export(path):
+    return read_export_header(path) is not None
+
+def export_cipher(db, password, salt, params):
+    return Fernet(db.derive_key(password, salt, params))
+
+def read_export(db, path, password):
+    header = read_export_header(path)
+    if header.get('version') != EXPORT_VERSION:
+        raise ValueError(f"Unsupported export version {header.get('version')}")
+    cipher = export_cipher(db, password, base64.b64decode(header['kdf_salt']), header['kdf_params'])
+    with open(path, encoding='utf-8') as f:
+        f.readline()
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                entries = json.loads(cipher.decrypt(line.strip().encode()))
+            except InvalidToken:
+                raise ValueError("Wrong export password, or the file is damaged")
+            for entry in entries:
+                yield entry['website'], entry['username'], entry['password']
+
+def read_entries(db, path, password=None):
+    """Stream (website, username, password) from any supported file"""
+    if is_encrypted_export(path):
+        if password is None:
+            raise ValueError("This export is encrypted; its password is needed")
+        return read_export(db, path, password)
+    if path.lower().endswith('.json'):
+        return read_json(path)
+    return read_csv(path)
+
+def import_entries(db, path, password=None, progress=None):
+    """Add every usable entry in `path` to the vault in one transaction. Returns the number added.
+    
+    Entries without a website or a password are skipped. `password` is the
+    export password for files written by export_entries. `progress(done, total)`
+    is called after each batch; total is None because files are streamed.
+    """
+    data_key = db.session_key()
+    entries = ((website.strip(), username.strip(), secret)
+               for website, username, secret in read_entries(db, path, password)
+               if website.strip() and secret)
+    parallel = os.path.getsize(path) >= PARALLEL_MIN_BYTES
+    
+    count = 0
+    with db.transaction() as cursor:
+        for rows in crypt_batches(encrypt_batch, batched(entries), data_key, parallel):
+            db.insert_rows(cursor, rows)
+            count += len(rows)
+            if progress:
+                progress(count, None)
+    return count
+
+def export_entries(db, path, password, progress=None):
+    """Write the whole vault to `path`, encrypted under `password`. Returns the number exported.
+    
+    The vault is read in batches on a separate connection and the file is
+    written next to `path` first, so a failed export never leaves a partial
+    file behind.
+    """
+    data_key = db.session_key()
+    salt = os.urandom(SALT_SIZE)
+    params = dict(KDF_PARAMS)
+    cipher = export_cipher(db, password, salt, params)
+    total = db.query_one('SELECT COUNT(*) FROM passwords')[0]
+    
+    conn = db.open_reader()
+    tmp_path = path + '.tmp'
+    try:
+        cursor = conn.execute('SELECT website, username, metadata_encrypted, password_encrypted FROM passwords ORDER BY id')
+        batches = iter(lambda: cursor.fetchmany(BATCH_SIZE), [])
+        count = done = 0
+        with open(tmp_path, 'w', encoding='utf-8', newline='\n') as f:
+            f.write(json.dumps({
+                'format': EXPORT_FORMAT,
+                'version': EXPORT_VERSION,
+                'kdf': 'scrypt',
+                'kdf_salt': base64.b64encode(salt).decode(),
+                'kdf_params': params
+            }) + '\n')
+            for entries in crypt_batches(decrypt_batch, batches, data_key, total >= PARALLEL_MIN_ROWS):
+                readable = [{'website': website, 'username': username, 'password': password}
+                            for website, username, password in entries if password is not None]
+                f.write(cipher.encrypt(json.dumps(readable).encode()).decode() + '\n')
+                count += len(readable)
+                done += len(entries)
+                if progress:
+                    progress(done, total)
+        os.replace(tmp_path, path)
+    finally:
+        conn.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return count
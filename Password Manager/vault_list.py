@@ -0,0 +1,67 @@
+PAGE_SIZE = 200      # Rows rendered at a time
+LOAD_MORE_AT = 0.9   # Render the next page once the view scrolls past this fraction
+
+class VaultList:
+    """Keeps the password Treeview in step with a list of entries.
+    
+    Items are keyed by entry id, and `show` applies only the differences
+    from what is on screen: new rows are inserted, changed rows updated,
+    missing rows deleted, and rows are moved only if the order changed.
+    Rows are rendered a page at a time; the next page is added when the
+    user scrolls near the bottom. So a refresh costs what changed among
+    the rendered rows, not the size of the vault.
+    """
+    
+    def __init__(self, tree, scrollbar, values):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.values = values    # entry -> tuple of column values
+        self.entries = []       # Everything that could be shown, in order
+        self.order = []         # iids currently in the tree, in order
+        self.rendered = {}      # iid -> values currently shown
+        self.loading = False
+        tree.configure(yscrollcommand=self.on_scroll)
+    
+    def show(self, entries, reset=False):
+        """Display `entries`. With `reset` (a new search), only the first page is kept rendered."""
+        self.entries = entries
+        count = PAGE_SIZE if reset else max(len(self.order), PAGE_SIZE)
+        self.render(count)
+    
+    def render(self, count):
+        """Make the tree show exactly the first `count` entries"""
+        wanted = [(str(entry['id']), entry) for entry in self.entries[:count]]
+        wanted_ids = {iid for iid, _ in wanted}
+        
+        stale = [iid for iid in self.order if iid not in wanted_ids]
+        if stale:
+            self.tree.delete(*stale)
+        kept = [iid for iid in self.order if iid in wanted_ids]
+        reordered = kept != [iid for iid, _ in wanted if iid in self.rendered]
+        
+        rendered = {}
+        for index, (iid, entry) in enumerate(wanted):
+            values = self.values(entry)
+            old = self.rendered.get(iid)
+            if old is None:
+                self.tree.insert("", index, iid=iid, text=entry['id'], values=values)
+            else:
+                if old != values:
+                    self.tree.item(iid, values=values)
+                if reordered:
+                    self.tree.move(iid, "", index)
+            rendered[iid] = values
+        
+        self.order = [iid for iid, _ in wanted]
+        self.rendered = rendered
+    
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if float(last) >= LOAD_MORE_AT and len(self.order) < len(self.entries) and not self.loading:
+            # Not from inside the scroll callback: rendering scrolls again
+            self.loading = True
+            self.tree.after_idle(self.load_more)
+    
+    def load_more(self):
+        self.loading = False
+        self.render(len(self.order) + PAGE_SIZE)